@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Analytics core of the stock dashboard.
+
+The computations behind the tabs (Monte Carlo VaR, comparisons and key
+statistics, see statements.py for the financial statements) take tickers
+and parameters rather than widgets, so the dashboard and the command line
+(see cli.py) share them. Nothing here imports Streamlit or a plotting
+library.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from comparison import compare
+from instrumentation import timed
+from panel import close_matrix
+from price_store import get_history, period_start
+from simulation import CONFIDENCE_LEVELS, simulate_paths, simulate_portfolio, value_at_risk
+from yahoo_finance import Fundamentals, YFinance
+
+
+# Benchmark of the rolling beta
+BENCHMARK_TICKER = '^GSPC'
+
+
+#==============================================================================
+# Monte Carlo simulation
+#==============================================================================
+
+def stock_returns(ticker, period):
+    """
+    This function returns the last Close price of a ticker and its daily
+    returns over a period.
+    """
+    close = get_history(ticker, period=period)['Close'].dropna()
+    if close.empty:
+        raise ValueError(f"No price history for {ticker}.")
+    return close.iloc[-1], close.pct_change().dropna()
+
+
+def simulate_stock(ticker, num_simulations, time_horizon, model='gbm', seed=None):
+    """
+    This function simulates the price paths of a ticker from its daily
+    returns of the last time_horizon days (see simulation.simulate_paths).
+
+    Returns
+    -------
+    tuple
+        (last price, daily returns, simulated paths)
+    """
+    last_price, returns = stock_returns(ticker, f"{time_horizon}d")
+    paths = simulate_paths(last_price, returns, num_simulations, time_horizon, model=model, seed=seed)
+    return last_price, returns, paths
+
+
+def var_row(ticker, last_price, returns, num_simulations=1000, time_horizon=30, model='gbm',
+            seed=None, confidence_levels=CONFIDENCE_LEVELS):
+    """
+    This function computes the VaR and CVaR of a ticker by Monte Carlo
+    simulation from its last price and daily returns, as one row: ticker,
+    last_price, then var_<level> and cvar_<level> for each confidence level
+    (var_95 for 95%).
+    """
+    paths = simulate_paths(last_price, returns, num_simulations, time_horizon, model=model, seed=seed)
+    risk = value_at_risk(paths[:, -1], last_price, confidence_levels)
+
+    row = {'ticker': ticker, 'last_price': last_price}
+    for level, measures in risk.items():
+        row[f"var_{level * 100:g}"] = measures['VaR']
+        row[f"cvar_{level * 100:g}"] = measures['CVaR']
+    return row
+
+
+def stock_var(ticker, num_simulations=1000, time_horizon=30, **params):
+    """
+    This function computes the VaR and CVaR row of a ticker (see var_row)
+    from its daily returns of the last time_horizon days.
+    """
+    last_price, returns = stock_returns(ticker, f"{time_horizon}d")
+    return var_row(ticker, last_price, returns, num_simulations, time_horizon, **params)
+
+
+def _var_batch(inputs, params):
+    rows, errors = [], {}
+    for ticker, last_price, returns in inputs:
+        try:
+            rows.append(var_row(ticker, last_price, returns, **params))
+        except Exception as error:
+            # Not every exception can be pickled back to the parent process
+            errors[ticker] = RuntimeError(f"{type(error).__name__}: {error}")
+    return rows, errors
+
+
+def var_many(tickers, workers=None, max_workers=16, **params):
+    """
+    This function computes the VaR and CVaR of many tickers (see var_row
+    for params).
+
+    The daily returns are first loaded by max_workers threads (I/O bound),
+    then the simulations (CPU bound) run in batches spread over a pool of
+    workers processes (all the CPUs by default, in-process for 1), which
+    receive the returns rather than the tickers.
+
+    Returns
+    -------
+    tuple
+        (DataFrame with one row per ticker, {ticker: exception}) for the
+        tickers that failed.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    period = f"{params.get('time_horizon', 30)}d"
+
+    def load(ticker):
+        try:
+            last_price, returns = stock_returns(ticker, period)
+            return ticker, last_price, returns.to_numpy(), None
+        except Exception as error:
+            return ticker, None, None, error
+
+    with timed('analytics.var_many') as measure:
+        errors = {}
+        inputs = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for ticker, last_price, returns, error in executor.map(load, tickers):
+                if error is None:
+                    inputs.append((ticker, last_price, returns))
+                else:
+                    errors[ticker] = error
+
+        workers = min(workers or os.cpu_count() or 1, max(len(inputs), 1))
+        if workers <= 1:
+            results = [_var_batch(inputs, params)]
+        else:
+            # A few batches per process balance the load without a task per ticker
+            batches = [inputs[i::workers * 4] for i in range(min(workers * 4, len(inputs)))]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_var_batch, batches, [params] * len(batches)))
+
+        rows = []
+        for batch_rows, batch_errors in results:
+            rows.extend(batch_rows)
+            errors.update(batch_errors)
+
+        # Rows in the order of the tickers
+        order = {ticker: i for i, ticker in enumerate(tickers)}
+        rows.sort(key=lambda row: order[row['ticker']])
+        measure['rows'] = len(rows)
+        return pd.DataFrame(rows), errors
+
+
+def portfolio_simulation(tickers, weights, lookback='1y', num_simulations=1000, time_horizon=30,
+                         **params):
+    """
+    This function simulates a portfolio of tickers from their daily returns
+    over the lookback period, on the days every ticker traded (see
+    simulation.simulate_portfolio for params and the result).
+    """
+    close = close_matrix(tickers, start=period_start(lookback, pd.Timestamp.now()))
+    return simulate_portfolio(close.pct_change().dropna(), weights, num_simulations, time_horizon,
+                              **params)
+
+
+#==============================================================================
+# Comparison
+#==============================================================================
+
+def compare_stocks(close, metric, start=None, end=None):
+    """
+    This function computes one of the comparison.COMPARISONS on the Close
+    matrix, loading the benchmark between start and end when it is needed.
+    """
+    benchmark = None
+    if metric == 'Rolling Beta':
+        benchmark = get_history(BENCHMARK_TICKER, start=start, end=end)['Close']
+    return compare(close, metric, benchmark)
+
+
+#==============================================================================
+# Key statistics
+#==============================================================================
+
+def key_statistics(tickers, fields, max_workers=16):
+    """
+    This function loads numeric statistics of many tickers concurrently.
+
+    Returns
+    -------
+    tuple
+        (DataFrame with one row per ticker and one column per field,
+        {ticker: exception}) for the tickers that could not be loaded.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    infos, errors = YFinance.info_many(tickers, modules=Fundamentals.modules_for(fields),
+                                       max_workers=max_workers)
+
+    loaded = [ticker for ticker in tickers if ticker in infos]
+    statistics = pd.DataFrame([infos[ticker] for ticker in loaded],
+                              index=pd.Index(loaded, name='ticker')).reindex(columns=fields)
+    statistics = statistics.apply(pd.to_numeric, errors='coerce').astype('float64')
+    return statistics, errors
+
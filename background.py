@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Background refreshes of the stock dashboard.
+
+Slow data (universes, screener snapshots) is served from memory or disk while
+a daemon thread loads it again, so the pages never wait for the source. The
+snapshots are saved atomically, as several server processes may share them.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+#==============================================================================
+# Background refresh
+#==============================================================================
+
+class BackgroundRefresh:
+    """
+    Refreshes of keyed data, each run by function(key) in a daemon thread.
+
+    Only one refresh of a key runs at a time, and a failed refresh is not
+    started again before retry_after seconds, so a source that cannot be
+    reached is not hit at every rerun.
+
+    Example
+    -------
+    universes = BackgroundRefresh(refresh_universe, 'universe')
+    universes.start('sp500')
+    """
+
+    def __init__(self, function, name, retry_after=300):
+        self.function = function
+        self.name = name
+        self.retry_after = retry_after
+        self._running = set()
+        self._failures = {}  # {key: time of the last failed refresh}
+        self._lock = threading.Lock()
+
+    def start(self, key):
+        """
+        This function starts the refresh of key, unless it is running or
+        failed less than retry_after seconds ago. It returns True when the
+        refresh is started.
+        """
+        with self._lock:
+            if key in self._running or time.time() - self._failures.get(key, 0) < self.retry_after:
+                return False
+            self._running.add(key)
+        threading.Thread(target=self._run, args=(key,), name=f"{self.name}-{key}", daemon=True).start()
+        return True
+
+    def is_running(self, key):
+        """
+        This function tells if the refresh of key is running.
+        """
+        with self._lock:
+            return key in self._running
+
+    def _run(self, key):
+        try:
+            self.function(key)
+        except Exception as error:
+            logger.warning("Could not refresh the %s %s: %s", key, self.name, error)
+            with self._lock:
+                self._failures[key] = time.time()
+        else:
+            with self._lock:
+                self._failures.pop(key, None)
+        finally:
+            with self._lock:
+                self._running.discard(key)
+
+
+def save_atomically(path, write):
+    """
+    This function saves a file by calling write(temporary path), then moving
+    the temporary file to path, so readers never see a partial file. The
+    temporary file is named per process and thread.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    write(temporary_path)
+    os.replace(temporary_path, path)
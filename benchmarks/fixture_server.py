@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Yahoo Finance and Wikipedia endpoints used by the
+stock dashboard, so that benchmarks run offline and reproducibly.
+
+Responses are generated deterministically from the ticker name (same ticker,
+same prices) and follow the format of the real endpoints:
+
+    /                                       fc.yahoo.com auth cookie
+    /v1/test/getcrumb                       crumb
+    /v10/finance/quoteSummary/<ticker>      quoteSummary modules
+    /v8/finance/chart/<ticker>              daily OHLCV bars
+    /statements/<ticker>/<statement>/<period>
+                                            financial statement
+    /wiki/List_of_S%26P_500_companies       S&P 500 constituents table
+
+An optional latency (in seconds) is added to every response to mimic the
+network.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import json
+import os
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+
+# Bundled S&P 500 constituents, served as the Wikipedia table
+SP500_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'sp500.csv')
+
+# First date of the generated price histories
+FIRST_DATE = '1990-01-01'
+
+# Line items of the generated financial statements
+STATEMENT_ITEMS = {
+    'Income Statement': ['Total Revenue', 'Cost Of Revenue', 'Gross Profit', 'Operating Expense',
+                         'Operating Income', 'Interest Expense', 'Pretax Income', 'Tax Provision',
+                         'Net Income', 'Basic EPS', 'Diluted EPS', 'EBITDA'],
+    'Balance Sheet': ['Total Assets', 'Current Assets', 'Cash And Cash Equivalents', 'Inventory',
+                      'Total Liabilities Net Minority Interest', 'Current Liabilities',
+                      'Long Term Debt', 'Stockholders Equity', 'Retained Earnings'],
+    'Cash Flow': ['Operating Cash Flow', 'Capital Expenditure', 'Free Cash Flow',
+                  'Investing Cash Flow', 'Financing Cash Flow', 'Repurchase Of Capital Stock',
+                  'Cash Dividends Paid'],
+}
+
+
+#==============================================================================
+# Generated data
+#==============================================================================
+
+def _seed(ticker):
+    return zlib.crc32(ticker.encode())
+
+
+@lru_cache(maxsize=1024)
+def daily_bars(ticker):
+    """
+    This function generates the daily OHLCV bars of a ticker, from FIRST_DATE
+    to today.
+    """
+    rng = np.random.default_rng(_seed(ticker))
+    dates = pd.bdate_range(FIRST_DATE, pd.Timestamp.now().normalize())
+
+    close = 20 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, len(dates))))
+    spread = close * rng.uniform(0, 0.02, len(dates))
+    bars = pd.DataFrame({'open': close * (1 + rng.normal(0, 0.005, len(dates))),
+                         'high': close + spread,
+                         'low': close - spread,
+                         'close': close,
+                         'volume': rng.integers(10 ** 5, 10 ** 7, len(dates))},
+                        index=dates)
+    bars.index = bars.index + pd.Timedelta(hours=14, minutes=30)  # market open (UTC)
+    return bars
+
+
+def chart(ticker, period1, period2):
+    """
+    This function builds a /v8/finance/chart answer.
+    """
+    bars = daily_bars(ticker)
+    timestamps = (bars.index - pd.Timestamp('1970-01-01')) // pd.Timedelta(seconds=1)
+    bars = bars[(timestamps >= period1) & (timestamps < period2)]
+    timestamps = timestamps[(timestamps >= period1) & (timestamps < period2)]
+
+    return {'chart': {'result': [{
+        'meta': {'symbol': ticker, 'currency': 'USD', 'exchangeTimezoneName': 'America/New_York',
+                 'gmtoffset': -14400, 'dataGranularity': '1d'},
+        'timestamp': timestamps.tolist(),
+        'indicators': {'quote': [{column: bars[column].tolist()
+                                  for column in ['open', 'high', 'low', 'close', 'volume']}]},
+    }], 'error': None}}
+
+
+def quote_summary(ticker, modules):
+    """
+    This function builds a /v10/finance/quoteSummary answer.
+    """
+    rng = np.random.default_rng(_seed(ticker))
+    price = float(daily_bars(ticker)['close'].iloc[-1])
+
+    def value(raw):
+        return {'raw': raw, 'fmt': f'{raw:.2f}'}
+
+    available = {
+        'assetProfile': {
+            'address1': '1 Main Street', 'city': 'New York', 'state': 'NY', 'zip': '10001',
+            'country': 'United States', 'phone': '212 555 0100', 'website': f'https://www.{ticker.lower()}.com',
+            'industry': 'Software', 'sector': 'Technology', 'fullTimeEmployees': int(rng.integers(100, 10 ** 5)),
+            'longBusinessSummary': f'{ticker} designs, manufactures and markets products. ' * 20,
+            'companyOfficers': [{'name': f'Officer {i}', 'age': int(rng.integers(35, 70)),
+                                 'title': 'Executive', 'totalPay': value(float(rng.uniform(1e5, 1e7)))}
+                                for i in range(10)]},
+        'summaryDetail': {
+            'previousClose': value(price), 'open': value(price), 'bid': value(price * 0.999),
+            'ask': value(price * 1.001), 'dayLow': value(price * 0.98), 'dayHigh': value(price * 1.02),
+            'fiftyTwoWeekLow': value(price * 0.7), 'fiftyTwoWeekHigh': value(price * 1.3),
+            'volume': value(float(rng.integers(10 ** 5, 10 ** 7))),
+            'averageVolume': value(float(rng.integers(10 ** 5, 10 ** 7))),
+            'marketCap': value(float(rng.uniform(1e9, 1e12))), 'beta': value(float(rng.uniform(0.3, 2))),
+            'trailingPE': value(float(rng.uniform(5, 60))), 'forwardPE': value(float(rng.uniform(5, 50))),
+            'dividendRate': value(float(rng.uniform(0, 5))), 'dividendYield': value(float(rng.uniform(0, 0.05)))},
+        'financialData': {
+            'currentPrice': value(price), 'targetMeanPrice': value(price * 1.1),
+            'recommendationKey': 'buy', 'totalRevenue': value(float(rng.uniform(1e8, 1e11))),
+            'profitMargins': value(float(rng.uniform(-0.1, 0.4))),
+            'returnOnEquity': value(float(rng.uniform(-0.1, 0.5)))},
+        'indexTrend': {'symbol': 'SP5', 'peRatio': value(float(rng.uniform(10, 30)))},
+        'defaultKeyStatistics': {
+            'trailingEps': value(float(rng.uniform(-2, 20))), 'forwardEps': value(float(rng.uniform(-2, 20))),
+            'priceToBook': value(float(rng.uniform(0.5, 20))),
+            'sharesOutstanding': value(float(rng.uniform(1e7, 1e10))),
+            'enterpriseValue': value(float(rng.uniform(1e9, 1e12)))},
+    }
+
+    return {'quoteSummary': {'result': [{module: available[module] for module in modules
+                                         if module in available}],
+                             'error': None}}
+
+
+def statement(ticker, name, period):
+    """
+    This function builds a financial statement as {item: {date: value}}.
+    """
+    rng = np.random.default_rng(_seed(ticker + name + period))
+    frequency = 'YE' if period == 'yearly' else 'QE'
+    dates = pd.date_range(end=pd.Timestamp.now(), periods=4 if period == 'yearly' else 5, freq=frequency)
+
+    return {item: {date.strftime('%Y-%m-%d'): float(rng.uniform(-1e9, 1e10)) for date in dates}
+            for item in STATEMENT_ITEMS[name]}
+
+
+@lru_cache(maxsize=1)
+def sp500_page():
+    """
+    This function builds an HTML page with the S&P 500 table in the
+    Wikipedia format.
+    """
+    constituents = pd.read_csv(SP500_PATH)
+    constituents['Symbol'] = constituents['Symbol'].str.replace('-', '.', regex=False)
+    constituents = constituents.rename(columns={'Sector': 'GICS Sector',
+                                                'Industry': 'GICS Sub-Industry'})
+    return ('<html><body><h1>List of S&amp;P 500 companies</h1>'
+            + constituents.to_html(index=False)
+            + '</body></html>')
+
+
+#==============================================================================
+# Server
+#==============================================================================
+
+class FixtureHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        # Keep the benchmark output clean
+        pass
+
+    def _send(self, body, content_type='application/json', headers=None):
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = path.strip('/').split('/')
+
+        if path == '/':
+            self._send('', 'text/html', {'Set-Cookie': 'A3=fixture; Path=/'})
+        elif path == '/v1/test/getcrumb':
+            self._send('fixture-crumb', 'text/plain')
+        elif path.startswith('/v10/finance/quoteSummary/'):
+            self._send(quote_summary(parts[-1], query.get('modules', '').split(',')))
+        elif path.startswith('/v8/finance/chart/'):
+            self._send(chart(parts[-1], int(query.get('period1', 0)), int(query.get('period2', 2 ** 40))))
+        elif path.startswith('/statements/'):
+            self._send(statement(parts[1], parts[2], parts[3]))
+        elif path.startswith('/wiki/'):
+            self._send(sp500_page(), 'text/html')
+        else:
+            self.send_error(404)
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Fixture server running in a background thread.
+
+    Example
+    -------
+    with FixtureServer(latency=0.05) as server:
+        print(server.url)
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        super().__init__((host, port), FixtureHandler)
+        self.latency = latency
+        self.url = f"http://{host}:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FixtureServer(port=args.port, latency=args.latency)
+    print(f"Serving fixtures on {server.url}")
+    server.serve_forever()
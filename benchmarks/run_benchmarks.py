@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks of the stock dashboard.
+
+The data and compute stages behind each tab are timed headlessly against the
+local fixture server (see fixture_server.py) over a grid of ticker counts,
+date ranges and simulation sizes. Results are written as JSON, and can be
+compared with the results of a previous version:
+
+    python benchmarks/run_benchmarks.py --output new.json --baseline old.json
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+# The benchmarks use their own cache folder and import the dashboard modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = tempfile.mkdtemp(prefix='stock_dashboard_bench_')
+os.environ['STOCK_DASHBOARD_CACHE_DIR'] = CACHE_DIR
+sys.path.insert(0, ROOT)
+
+import cache
+import comparison
+import downsampling
+import export
+import indicators
+import panel
+import price_store
+import simulation
+import statements
+import universe
+import yahoo_finance
+from fixture_server import FixtureServer
+
+
+# Parameter grids
+GRIDS = {'quick': {'tickers': [1, 10], 'ranges': ['1y', '10y'], 'simulations': [1000, 10000],
+                   'repeats': 3},
+         'full' : {'tickers': [1, 10, 50, 200, 500], 'ranges': ['1y', '5y', '10y', 'max'],
+                   'simulations': [1000, 10000, 100000], 'repeats': 5}}
+
+# Regression threshold of --baseline (ratio of the medians)
+REGRESSION_RATIO = 1.2
+
+
+#==============================================================================
+# Fixture connections
+#==============================================================================
+
+def fixture_history(base_url):
+    """
+    This function returns a price store fetcher reading the fixture chart
+    endpoint.
+    """
+    session = requests.Session()
+
+    def fetch(ticker, start, end, interval):
+        params = {'period1': int(start.timestamp()), 'period2': int(end.timestamp()),
+                  'interval': interval}
+        result = session.get(f"{base_url}/v8/finance/chart/{ticker}", params=params).json()
+        result = result['chart']['result'][0]
+        quote = result['indicators']['quote'][0]
+
+        index = pd.to_datetime(result['timestamp'], unit='s', utc=True)
+        index = index.tz_convert(result['meta']['exchangeTimezoneName']).normalize()
+        return pd.DataFrame({'Open': quote['open'], 'High': quote['high'], 'Low': quote['low'],
+                             'Close': quote['close'], 'Volume': quote['volume']}, index=index)
+
+    return fetch
+
+
+def fixture_statement(base_url):
+    """
+    This function returns a statement fetcher reading the fixture statements
+    endpoint.
+    """
+    session = requests.Session()
+
+    def fetch(ticker, statement, period):
+        data = session.get(f"{base_url}/statements/{ticker}/{statement}/{period}").json()
+        frame = pd.DataFrame.from_dict(data, orient='index')
+        frame.columns = pd.to_datetime(frame.columns)
+        return frame
+
+    return fetch
+
+
+def connect(server):
+    """
+    This function points the dashboard data layer at the fixture server.
+    """
+    session = yahoo_finance.YahooSession()
+    session.cookie_url = server.url + '/'
+    session.crumb_url = server.url + '/v1/test/getcrumb'
+    session.quote_summary_url = server.url + '/v10/finance/quoteSummary/{ticker}'
+    yahoo_finance._session = session
+
+    price_store._store = price_store.PriceStore(fetcher=fixture_history(server.url))
+    statements.fetch_statement = fixture_statement(server.url)
+    universe.register_universe(
+        'sp500', universe.WikipediaUniverse(server.url + '/wiki/List_of_S%26P_500_companies',
+                                            {'GICS Sector': 'Sector',
+                                             'GICS Sub-Industry': 'Industry'}))
+
+
+def clear_caches():
+    """
+    This function empties every cache of the data layer, for cold timings.
+    """
+    shutil.rmtree(price_store.get_store().root, ignore_errors=True)
+    cache.get_cache().clear()
+    universe._memory.clear()
+    shutil.rmtree(os.path.dirname(panel._panel_path('1d')), ignore_errors=True)
+    panel._panels.clear()
+    panel._pending.clear()
+    panel._panel_used.clear()
+    panel._refresh_due.clear()
+
+
+#==============================================================================
+# Timing
+#==============================================================================
+
+class Benchmark:
+
+    def __init__(self, repeats):
+        self.repeats = repeats
+        self.results = []
+
+    def run(self, tab, stage, function, setup=None, **params):
+        """
+        This function times function() repeats times, calling setup() before
+        each run, and records the result.
+        """
+        timings = []
+        for _ in range(self.repeats):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+
+        result = {'tab': tab, 'stage': stage, 'params': params,
+                  'median': statistics.median(timings), 'min': min(timings),
+                  'max': max(timings), 'repeats': self.repeats}
+        self.results.append(result)
+        print(f"{tab:8} {stage:28} {json.dumps(params):45} {result['median'] * 1000:10.2f} ms")
+        return result
+
+
+#==============================================================================
+# Benchmarks per tab
+#==============================================================================
+
+def bench_sidebar(bench, grid):
+    bench.run('sidebar', 'universe.scrape', lambda: universe.refresh_universe('sp500'))
+    bench.run('sidebar', 'universe.cached', lambda: universe.get_universe('sp500'))
+
+
+def bench_tab1(bench, grid, ticker):
+    bench.run('tab1', 'fundamentals.cold', lambda: yahoo_finance.Fundamentals(ticker).get(),
+              setup=clear_caches)
+    bench.run('tab1', 'fundamentals.warm', lambda: yahoo_finance.Fundamentals(ticker).get())
+
+    for period in grid['ranges']:
+        bench.run('tab1', 'history.cold', lambda: price_store.get_history(ticker, period=period),
+                  setup=clear_caches, period=period)
+        bench.run('tab1', 'history.warm', lambda: price_store.get_history(ticker, period=period),
+                  period=period)
+
+        history = price_store.get_history(ticker, period=period)
+        bench.run('tab1', 'downsample.line', lambda: downsampling.downsample_series(history['Close']),
+                  period=period, rows=len(history))
+
+
+def bench_tab2(bench, grid, ticker):
+    for period in grid['ranges']:
+        history = price_store.get_history(ticker, period=period)
+        for candlestick in (False, True):
+            bench.run('tab2', 'downsample.ohlcv',
+                      lambda: downsampling.downsample_ohlcv(history, candlestick),
+                      period=period, candlestick=candlestick, rows=len(history))
+
+        every_indicator = [(name, {}) for name in indicators.INDICATORS]
+        bench.run('tab2', 'indicators.cold',
+                  lambda: indicators.compute_indicators(ticker, '1d', history, every_indicator),
+                  setup=cache.get_cache().clear, period=period, rows=len(history))
+        bench.run('tab2', 'indicators.append',
+                  lambda: indicators.compute_indicators(ticker, '1d', history, every_indicator),
+                  setup=lambda: indicators.compute_indicators(ticker, '1d', history.iloc[:-1], every_indicator),
+                  period=period, rows=len(history))
+
+
+def bench_tab3(bench, grid, tickers):
+    bench.run('tab3', 'statements.cold', lambda: statements.load_statements(tickers[0]),
+              setup=clear_caches)
+    bench.run('tab3', 'statements.warm', lambda: statements.load_statements(tickers[0]))
+
+    for count in grid['tickers']:
+        bench.run('tab3', 'statements.panel', lambda: statements.statements_panel(tickers[:count]),
+                  setup=clear_caches, tickers=count)
+
+
+def bench_tab4(bench, grid, ticker):
+    history = price_store.get_history(ticker, period='1y')
+    returns = history['Close'].pct_change().dropna()
+    last_price = history['Close'].iloc[-1]
+
+    for model in simulation.MODELS:
+        for num_simulations in grid['simulations']:
+            paths = bench.run('tab4', 'simulation.paths',
+                              lambda: simulation.simulate_paths(last_price, returns, num_simulations, 90,
+                                                                model=model, seed=0),
+                              model=model, simulations=num_simulations, horizon=90)
+            paths = simulation.simulate_paths(last_price, returns, num_simulations, 90, model=model, seed=0)
+            bench.run('tab4', 'simulation.var', lambda: simulation.value_at_risk(paths[:, -1], last_price),
+                      model=model, simulations=num_simulations)
+
+    for fmt in ('CSV', 'Parquet'):
+        for num_simulations in grid['simulations']:
+            bench.run('tab4', f"export.{fmt.lower()}",
+                      lambda: export.export(export.path_frames(last_price, returns, num_simulations, 90, seed=0),
+                                            fmt),
+                      simulations=num_simulations, horizon=90)
+
+
+def bench_tab5(bench, grid, tickers):
+    for count in grid['tickers']:
+        selected = tickers[:count]
+        bench.run('tab5', 'info_many', lambda: yahoo_finance.YFinance.info_many(selected),
+                  setup=clear_caches, tickers=count)
+
+        for period in grid['ranges']:
+            bench.run('tab5', 'close_matrix.cold',
+                      lambda: price_store.get_close_matrix(selected, period=period),
+                      setup=clear_caches, tickers=count, period=period)
+            bench.run('tab5', 'close_matrix.warm',
+                      lambda: price_store.get_close_matrix(selected, period=period),
+                      tickers=count, period=period)
+
+            start = price_store.period_start(period, pd.Timestamp.now())
+            if start >= panel.panel_start():
+                # Merge the histories into the shared panel before timing it
+                panel.get_panel(selected)
+                panel.update_panel()
+                bench.run('tab5', 'panel.close_matrix',
+                          lambda: panel.close_matrix(selected, start=start),
+                          tickers=count, period=period)
+
+            close = price_store.get_close_matrix(selected, period=period)
+            benchmark = close.iloc[:, 0]
+
+            def analytics():
+                comparison.rebased_returns(close)
+                comparison.correlation(close)
+                comparison.rolling_volatility(close)
+                comparison.rolling_beta(close, benchmark)
+                comparison.drawdowns(close)
+
+            bench.run('tab5', 'analytics', analytics, tickers=count, period=period)
+
+
+#==============================================================================
+# Report
+#==============================================================================
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """
+    This function prints the stages slower than in the baseline results.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(result):
+        return (result['tab'], result['stage'], json.dumps(result['params'], sort_keys=True))
+
+    previous = {key(result): result for result in baseline['results']}
+    regressions = 0
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or old['median'] == 0:
+            continue
+        ratio = result['median'] / old['median']
+        if ratio > REGRESSION_RATIO:
+            regressions += 1
+            print(f"REGRESSION {result['tab']} {result['stage']} {json.dumps(result['params'])}: "
+                  f"{old['median'] * 1000:.2f} ms -> {result['median'] * 1000:.2f} ms ({ratio:.2f}x)")
+
+    print(f"{regressions} regression(s) against {baseline.get('version')}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the stock dashboard.")
+    parser.add_argument('--grid', choices=sorted(GRIDS), default='quick')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Latency added to every fixture response, in seconds.")
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline', help="Results of a previous run to compare with.")
+    args = parser.parse_args(argv)
+
+    grid = GRIDS[args.grid]
+    bench = Benchmark(grid['repeats'])
+
+    try:
+        with FixtureServer(latency=args.latency) as server:
+            connect(server)
+            tickers = universe.get_universe('sp500')['Symbol'].tolist()
+            bench_sidebar(bench, grid)
+            bench_tab1(bench, grid, tickers[0])
+            bench_tab2(bench, grid, tickers[0])
+            bench_tab3(bench, grid, tickers)
+            bench_tab4(bench, grid, tickers[0])
+            bench_tab5(bench, grid, tickers)
+    finally:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+    report = {'version': git_version(),
+              'timestamp': pd.Timestamp.now(tz='UTC').isoformat(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'pandas': pd.__version__,
+              'grid': args.grid,
+              'latency': args.latency,
+              'results': bench.results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        return 1 if compare(bench.results, args.baseline) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Shared cache of the stock dashboard.
+
+Values are kept in a process-wide LRU cache bounded by their estimated size in
+memory, with a time to live per data class (quotes, profiles, statements, ...).
+An optional Redis-compatible backend can be shared by several Streamlit worker
+processes: values missing from memory are looked up there before being
+fetched from Yahoo.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import functools
+import logging
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+from settings import CACHE_MAX_BYTES, REDIS_URL
+
+
+logger = logging.getLogger(__name__)
+
+# Time to live (seconds) of each data class
+TTLS = {'quote'       : 60,
+        'history'     : 300,
+        'fundamentals': 3600,
+        'profile'     : 7 * 24 * 3600,
+        'holders'     : 24 * 3600,
+        'trend'       : 24 * 3600,
+        'statements'  : 24 * 3600}
+
+
+def estimate_cost(value):
+    """
+    This function estimates the memory used by a value, in bytes.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_cost(key) + estimate_cost(item)
+                                          for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_cost(item) for item in value)
+    return sys.getsizeof(value)
+
+
+#==============================================================================
+# Memory tier
+#==============================================================================
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the total cost of its values.
+    """
+
+    def __init__(self, max_cost):
+        self.max_cost = max_cost
+        self.cost = 0
+        self._entries = OrderedDict()   # {key: (value, expiry time, cost)}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        This function returns (True, value), or (False, None) when the key is
+        missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[1] <= time.time():
+                self._remove(key)
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[0]
+
+    def set(self, key, value, ttl, cost=None):
+        cost = estimate_cost(value) if cost is None else cost
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if cost > self.max_cost:
+                return
+            self._entries[key] = (value, time.time() + ttl, cost)
+            self.cost += cost
+
+            # Evict the least recently used values
+            while self.cost > self.max_cost:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.cost = 0
+
+    def _remove(self, key):
+        self.cost -= self._entries.pop(key)[2]
+
+
+#==============================================================================
+# Shared tier
+#==============================================================================
+
+class RedisBackend:
+    """
+    Cache backend stored on a Redis-compatible server, shared by processes.
+    """
+
+    def __init__(self, url, prefix='stock_dashboard:'):
+        # Optional dependency, only needed when a Redis URL is configured
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, key):
+        return self.prefix + repr(key)
+
+    def get(self, key):
+        data = self.client.get(self._key(key))
+        if data is None:
+            return False, None
+        return True, pickle.loads(data)
+
+    def set(self, key, value, ttl):
+        self.client.set(self._key(key), pickle.dumps(value), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+#==============================================================================
+# Cache
+#==============================================================================
+
+class Cache:
+    """
+    Two-tier cache: process memory first, then the optional shared backend.
+
+    Backend errors are logged and treated as misses, so a down server only
+    costs the speed-up.
+    """
+
+    def __init__(self, max_cost, backend=None):
+        self.memory = LRUCache(max_cost)
+        self.backend = backend
+        self._locks = {}  # {key: (lock, number of threads holding or waiting for it)}
+        self._locks_lock = threading.Lock()
+
+    def get(self, key):
+        found, value = self.memory.get(key)
+        if found or self.backend is None:
+            return found, value
+
+        try:
+            found, value = self.backend.get(key)
+        except Exception as error:
+            logger.warning("Cache backend get failed: %s", error)
+            return False, None
+
+        if found:
+            # Keep a local copy for the shortest data class time to live
+            self.memory.set(key, value, min(TTLS.values()))
+        return found, value
+
+    def set(self, key, value, data_class=None, ttl=None):
+        """
+        This function stores a value for ttl seconds, or for the time to live
+        of its data class.
+        """
+        ttl = ttl if ttl is not None else TTLS[data_class]
+        self.memory.set(key, value, ttl)
+
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value, ttl)
+            except Exception as error:
+                logger.warning("Cache backend set failed: %s", error)
+
+    def get_or_load(self, key, loader, data_class=None, ttl=None):
+        """
+        This function returns the cached value of key, or calls loader() and
+        caches its result. Concurrent loads of the same key wait for the
+        first one instead of calling loader() again.
+        """
+        with timed(f"cache.{data_class or 'value'}") as measure:
+            found, value = self.get(key)
+            measure['cache'] = 'hit' if found else 'miss'
+            if found:
+                return value
+
+            with self._locks_lock:
+                lock, users = self._locks.get(key, (threading.Lock(), 0))
+                self._locks[key] = (lock, users + 1)
+
+            try:
+                with lock:
+                    found, value = self.get(key)
+                    if not found:
+                        value = loader()
+                        self.set(key, value, data_class, ttl)
+            finally:
+                # The lock is dropped with its last user, also when loader()
+                # raises: until then the waiters and the threads arriving
+                # meanwhile share it, so the loads of a key never overlap
+                with self._locks_lock:
+                    lock, users = self._locks[key]
+                    if users == 1:
+                        del self._locks[key]
+                    else:
+                        self._locks[key] = (lock, users - 1)
+            return value
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.backend is not None:
+            try:
+                self.backend.delete(key)
+            except Exception as error:
+                logger.warning("Cache backend delete failed: %s", error)
+
+    def clear(self):
+        self.memory.clear()
+        if self.backend is not None:
+            try:
+                self.backend.clear()
+            except Exception as error:
+                logger.warning("Cache backend clear failed: %s", error)
+
+
+def cached(data_class, ttl=None):
+    """
+    This function decorates a function so that its results are cached by
+    arguments in the shared cache.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (function.__module__, function.__qualname__, args, tuple(sorted(kwargs.items())))
+            return get_cache().get_or_load(key, lambda: function(*args, **kwargs), data_class, ttl)
+        return wrapper
+    return decorator
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    This function returns the cache shared by the whole process, backed by
+    the Redis server of STOCK_DASHBOARD_REDIS_URL when it is set.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            backend = None
+            if REDIS_URL:
+                try:
+                    backend = RedisBackend(REDIS_URL)
+                except Exception as error:
+                    logger.warning("Redis cache backend not available: %s", error)
+            _cache = Cache(CACHE_MAX_BYTES, backend)
+        return _cache
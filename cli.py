@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Command line of the stock dashboard.
+
+Runs the analytics of the dashboard in batch, without Streamlit, and writes
+the results to Parquet:
+
+    python cli.py batch var --tickers-file tickers.txt --workers 8 --output var.parquet
+    python cli.py batch stats --universe sp500
+    python cli.py batch statements --tickers AAPL MSFT --period quarterly
+    python cli.py batch compare --tickers AAPL MSFT --metric drawdown --start 2020-01-01
+
+Tickers are given on the command line, in a file (one per line, # starts a
+comment) or default to the constituents of a universe. The analytics modules
+are only imported once the arguments are parsed, so --help and argument
+errors do not wait for pandas.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import argparse
+import os
+import sys
+import time
+
+
+# Comparisons of the compare command: {name: comparison.COMPARISONS name}
+COMPARE_METRICS = {'price'     : 'Stock Price',
+                   'rebased'   : 'Rebased Returns',
+                   'drawdown'  : 'Drawdown',
+                   'volatility': 'Rolling Volatility',
+                   'beta'      : 'Rolling Beta'}
+
+
+#==============================================================================
+# Tickers
+#==============================================================================
+
+def read_tickers_file(path):
+    """
+    This function reads the tickers of a file, one per line.
+    """
+    with open(path) as f:
+        lines = [line.split('#')[0].strip() for line in f]
+    return [line for line in lines if line]
+
+
+def get_tickers(args):
+    if args.tickers:
+        return args.tickers
+    if args.tickers_file:
+        return read_tickers_file(args.tickers_file)
+
+    from universe import get_universe
+    return get_universe(args.universe)['Symbol'].tolist()
+
+
+#==============================================================================
+# Batch commands
+#==============================================================================
+
+# Each command is a function (args, tickers) returning (DataFrame, {ticker:
+# exception}).
+
+def batch_var(args, tickers):
+    from analytics import var_many
+
+    return var_many(tickers, workers=args.workers, num_simulations=args.simulations,
+                    time_horizon=args.horizon, model=args.model, seed=args.seed)
+
+
+def batch_stats(args, tickers):
+    from analytics import key_statistics
+    from screener import SCREENER_FIELDS
+
+    statistics, errors = key_statistics(tickers, args.fields or SCREENER_FIELDS, args.workers or 16)
+    return statistics.reset_index(), errors
+
+
+def batch_statements(args, tickers):
+    from statements import statements_panel
+
+    return statements_panel(tickers, args.statement, args.period, args.workers or 16)
+
+
+def batch_compare(args, tickers):
+    from analytics import compare_stocks
+    from comparison import comparison_summary, correlation
+    from panel import close_matrix
+
+    close = close_matrix(tickers, start=args.start, end=args.end)
+    errors = {ticker: ValueError(f"No price history for {ticker}.")
+              for ticker in tickers if ticker not in close or close[ticker].isna().all()}
+
+    if args.metric == 'summary':
+        return comparison_summary(close).rename_axis('ticker').reset_index(), errors
+    if args.metric == 'correlation':
+        return correlation(close).rename_axis('ticker').reset_index(), errors
+    values = compare_stocks(close, COMPARE_METRICS[args.metric], args.start, args.end)
+    return values.rename_axis('Date').reset_index(), errors
+
+
+#==============================================================================
+# Arguments
+#==============================================================================
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='stock-dashboard',
+                                     description="Analytics of the stock dashboard from the command line.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    batch = commands.add_parser('batch', help="Run an analysis over many tickers and write it to Parquet.")
+    analyses = batch.add_subparsers(dest='analysis', required=True)
+
+    # Options shared by every analysis
+    shared = argparse.ArgumentParser(add_help=False)
+    source = shared.add_mutually_exclusive_group()
+    source.add_argument('--tickers', nargs='+', help="Tickers to analyze.")
+    source.add_argument('--tickers-file', help="File with one ticker per line.")
+    source.add_argument('--universe', default='sp500',
+                        help="Universe whose constituents are analyzed by default (default: sp500).")
+    shared.add_argument('--workers', type=int,
+                        help="Worker processes for var (default: every CPU), threads for the "
+                             "other analyses (default: 16).")
+    shared.add_argument('--output', help="Parquet file written (default: <analysis>.parquet).")
+
+    var = analyses.add_parser('var', parents=[shared],
+                              help="Monte Carlo VaR and CVaR of each ticker.")
+    var.add_argument('--simulations', type=int, default=10000)
+    var.add_argument('--horizon', type=int, default=30, help="Time horizon in days (default: 30).")
+    var.add_argument('--model', choices=['gbm', 'bootstrap'], default='gbm')
+    var.add_argument('--seed', type=int, default=42)
+    var.set_defaults(run=batch_var)
+
+    stats = analyses.add_parser('stats', parents=[shared], help="Key statistics of each ticker.")
+    stats.add_argument('--fields', nargs='+',
+                       help="Statistics loaded (default: those of the screener).")
+    stats.set_defaults(run=batch_stats)
+
+    statements = analyses.add_parser('statements', parents=[shared],
+                                     help="Financial statements of each ticker, in long format.")
+    statements.add_argument('--statement', nargs='+',
+                            choices=['Income Statement', 'Balance Sheet', 'Cash Flow'])
+    statements.add_argument('--period', nargs='+', choices=['yearly', 'quarterly'])
+    statements.set_defaults(run=batch_statements)
+
+    compare = analyses.add_parser('compare', parents=[shared],
+                                  help="Comparison of the Close prices of the tickers.")
+    compare.add_argument('--metric', choices=list(COMPARE_METRICS) + ['summary', 'correlation'],
+                         default='summary',
+                         help="Comparison over time, or the summary or correlation of the returns "
+                              "(default: summary).")
+    compare.add_argument('--start', help="First date (YYYY-MM-DD).")
+    compare.add_argument('--end', help="Last date (YYYY-MM-DD).")
+    compare.set_defaults(run=batch_compare)
+
+    return parser
+
+
+#==============================================================================
+# Main
+#==============================================================================
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    output = args.output or f"{args.analysis}.parquet"
+
+    start = time.perf_counter()
+    tickers = get_tickers(args)
+    result, errors = args.run(args, tickers)
+
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    result.to_parquet(output, index=False)
+    print(f"{args.analysis}: {len(result)} rows for {len(tickers) - len(errors)} of {len(tickers)} "
+          f"tickers written to {output} in {time.perf_counter() - start:.1f} s")
+
+    for ticker, error in errors.items():
+        print(f"{ticker}: {error}", file=sys.stderr)
+    return 1 if errors and result.empty else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
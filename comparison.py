@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Comparison analytics of the stock dashboard.
+
+Every function works on the wide Close matrix (one column per ticker) in a
+single vectorized pass, so the cost does not grow with a Python loop over the
+tickers.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import numpy as np
+import pandas as pd
+
+
+# Trading days in a year
+TRADING_DAYS = 252
+
+
+#==============================================================================
+# Returns
+#==============================================================================
+
+def daily_returns(close):
+    """
+    This function computes the daily simple returns of the Close matrix.
+    """
+    return close.pct_change(fill_method=None)
+
+
+def rebased_returns(close, base=100):
+    """
+    This function rebases every price series to base at its first price, so
+    the cumulative returns of the tickers can be compared.
+    """
+    first_prices = close.bfill().iloc[0]
+    return close.div(first_prices) * base
+
+
+def correlation(close):
+    """
+    This function computes the correlation matrix of the daily returns.
+    """
+    return daily_returns(close).corr()
+
+
+#==============================================================================
+# Risk
+#==============================================================================
+
+def rolling_volatility(close, window=21, annualize=True):
+    """
+    This function computes the rolling volatility of the daily returns.
+    """
+    volatility = daily_returns(close).rolling(window).std()
+    return volatility * np.sqrt(TRADING_DAYS) if annualize else volatility
+
+
+def rolling_beta(close, benchmark, window=63):
+    """
+    This function computes the rolling beta of every ticker against the
+    benchmark prices.
+
+    Beta is cov(r, r_b) / var(r_b), with the rolling moments of the whole
+    matrix computed at once from rolling means.
+    """
+    returns = daily_returns(close)
+    benchmark_returns = benchmark.reindex(close.index).pct_change(fill_method=None)
+
+    mean_returns = returns.rolling(window).mean()
+    mean_benchmark = benchmark_returns.rolling(window).mean()
+    mean_product = returns.mul(benchmark_returns, axis=0).rolling(window).mean()
+
+    covariance = mean_product - mean_returns.mul(mean_benchmark, axis=0)
+    variance = (benchmark_returns ** 2).rolling(window).mean() - mean_benchmark ** 2
+
+    return covariance.div(variance.replace(0, np.nan), axis=0)
+
+
+def drawdowns(close):
+    """
+    This function computes the drawdown of every ticker from its running peak.
+    """
+    return close / close.cummax() - 1
+
+
+def max_drawdowns(close):
+    """
+    This function computes the maximum drawdown of every ticker.
+    """
+    return drawdowns(close).min()
+
+
+#==============================================================================
+# Summary
+#==============================================================================
+
+def comparison_summary(close):
+    """
+    This function summarizes the comparison of the tickers: total return,
+    annualized volatility and maximum drawdown.
+    """
+    returns = daily_returns(close)
+    return pd.DataFrame({'Total Return': rebased_returns(close, base=1).ffill().iloc[-1] - 1,
+                         'Volatility': returns.std() * np.sqrt(TRADING_DAYS),
+                         'Max Drawdown': max_drawdowns(close)})
+
+
+#==============================================================================
+# Comparisons
+#==============================================================================
+
+# Comparisons of the Analysis tab
+COMPARISONS = ['Stock Price', 'Rebased Returns', 'Drawdown', 'Rolling Volatility', 'Rolling Beta']
+
+
+def compare(close, metric, benchmark=None):
+    """
+    This function computes one of the COMPARISONS on the Close matrix. The
+    Rolling Beta needs the benchmark prices.
+    """
+    if metric == 'Stock Price':
+        return close
+    if metric == 'Rebased Returns':
+        return rebased_returns(close)
+    if metric == 'Drawdown':
+        return drawdowns(close)
+    if metric == 'Rolling Volatility':
+        return rolling_volatility(close)
+    if metric == 'Rolling Beta':
+        if benchmark is None:
+            raise ValueError("The Rolling Beta needs the benchmark prices.")
+        return rolling_beta(close, benchmark)
+    raise ValueError(f"Unknown comparison '{metric}', expected one of {COMPARISONS}.")
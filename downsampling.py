@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Downsampling of long price histories before they are sent to the charts.
+
+Line charts use Largest-Triangle-Three-Buckets (LTTB), which keeps the visual
+shape of the series; candlestick charts re-bucket the bars into wider OHLC
+bars. Either way the number of points is bounded by the chart width.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import numpy as np
+import pandas as pd
+
+
+# Default chart width in pixels
+CHART_WIDTH = 700
+
+# Pixels needed to draw one candle
+CANDLE_PIXELS = 4
+
+
+#==============================================================================
+# Largest-Triangle-Three-Buckets
+#==============================================================================
+
+def _as_float(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.view('i8')
+    return values.astype(float)
+
+
+def lttb(x, y, n_out):
+    """
+    This function selects n_out points of (x, y) with the
+    Largest-Triangle-Three-Buckets algorithm and returns their positions.
+
+    The first and last points are always kept; every other point is the one
+    of its bucket forming the largest triangle with the previously selected
+    point and the average of the next bucket.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = _as_float(x)
+    y = _as_float(y)
+
+    # n_out - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Average point of the next bucket (the last point for the last bucket)
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # Point of the bucket with the largest triangle area
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+def downsample_series(series, n_out=CHART_WIDTH):
+    """
+    This function downsamples a series for a line chart with LTTB.
+    """
+    series = series.dropna()
+    return series.iloc[lttb(series.index, series.to_numpy(), n_out)]
+
+
+#==============================================================================
+# OHLC re-bucketing
+#==============================================================================
+
+def ohlc_buckets(frame, n_out):
+    """
+    This function merges consecutive OHLCV bars into at most n_out bars.
+
+    Each bucket opens at its first open, closes at its last close, and keeps
+    the highest high, the lowest low and the total volume. The bucket is
+    dated by its first bar.
+    """
+    n = len(frame)
+    if n <= n_out:
+        return frame
+
+    # First position of each bucket
+    starts = np.flatnonzero(np.diff(np.arange(n) * n_out // n, prepend=-1))
+    ends = np.r_[starts[1:], n] - 1
+
+    buckets = {'Open'  : frame['Open'].to_numpy()[starts],
+               'High'  : np.maximum.reduceat(frame['High'].to_numpy(), starts),
+               'Low'   : np.minimum.reduceat(frame['Low'].to_numpy(), starts),
+               'Close' : frame['Close'].to_numpy()[ends]}
+    if 'Volume' in frame:
+        buckets['Volume'] = np.add.reduceat(frame['Volume'].to_numpy(), starts)
+
+    return pd.DataFrame(buckets, index=frame.index[starts])
+
+
+#==============================================================================
+# Charts
+#==============================================================================
+
+def downsample_ohlcv(frame, candlestick=False, width=CHART_WIDTH):
+    """
+    This function bounds the number of bars of an OHLCV history by the width
+    of the chart it is drawn on. The volume of the bars left out is added to
+    the bars kept, so the total volume is unchanged.
+    """
+    if candlestick:
+        return ohlc_buckets(frame, width // CANDLE_PIXELS)
+
+    selected = lttb(frame.index, frame['Close'].to_numpy(), width)
+    sampled = frame.iloc[selected]
+    if 'Volume' in frame and len(selected) < len(frame):
+        # Each point carries the volume traded until the next point
+        sampled = sampled.assign(Volume=np.add.reduceat(frame['Volume'].to_numpy(), selected))
+    return sampled
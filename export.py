@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Exports and reports of the stock dashboard.
+
+Data is exported as a stream of DataFrame chunks (one ticker, statement or
+block of simulated paths at a time) written straight to a file in CSV,
+Parquet or Excel, so the full dataset is never materialized. Multi-ticker
+reports are built as HTML or PDF by a background thread.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import base64
+import importlib.util
+import io
+import logging
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from comparison import comparison_summary
+from instrumentation import timed
+from price_store import OHLCV_COLUMNS, get_store
+from settings import CACHE_DIR
+from simulation import iter_paths
+from statements import PANEL_COLUMNS, load_statements, long_format
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of rows of an Excel sheet (header included)
+EXCEL_MAX_ROWS = 1048576
+
+# Exports older than this (seconds) are deleted
+EXPORT_TTL = 24 * 3600
+
+# Column types of the exported histories and statements, the same in every
+# chunk whatever the source returned (empty or object columns)
+HISTORY_DTYPES = {'Date': 'datetime64[ns]', 'Ticker': 'str', **{column: 'float64' for column in OHLCV_COLUMNS}}
+STATEMENT_DTYPES = dict(zip(PANEL_COLUMNS, ['str', 'str', 'str', 'str', 'datetime64[ns]', 'float64']))
+
+
+#==============================================================================
+# Chunks
+#==============================================================================
+
+def _typed(frame, dtypes):
+    frame = frame.reindex(columns=list(dtypes))
+    for column, dtype in dtypes.items():
+        if dtype == 'float64':
+            frame[column] = pd.to_numeric(frame[column], errors='coerce').astype(dtype)
+        else:
+            frame[column] = frame[column].astype(dtype)
+    return frame
+
+
+def history_frames(tickers, start=None, end=None, interval='1d', period=None):
+    """
+    This function yields the OHLCV history of each ticker from the price
+    store, with the columns Date, Ticker and OHLCV.
+    """
+    for ticker in tickers:
+        history = get_store().get_history(ticker, start, end, interval, period)
+        frame = history.reindex(columns=OHLCV_COLUMNS)
+        frame.insert(0, 'Ticker', ticker)
+        yield _typed(frame.rename_axis('Date').reset_index(), HISTORY_DTYPES)
+
+
+def statement_frames(tickers, statements=None, periods=None):
+    """
+    This function yields the financial statements of each ticker in long
+    format (see statements.PANEL_COLUMNS).
+    """
+    for ticker in tickers:
+        for frame in long_format(ticker, load_statements(ticker), statements, periods):
+            yield _typed(frame, STATEMENT_DTYPES)
+
+
+def path_frames(*args, **kwargs):
+    """
+    This function yields simulated paths (see simulation.iter_paths for the
+    parameters), one row per path and one column per day.
+    """
+    first = 0
+    for paths in iter_paths(*args, **kwargs):
+        frame = pd.DataFrame(paths, columns=[f"Day{day + 1}" for day in range(paths.shape[1])])
+        frame.insert(0, 'Simulation', np.arange(first, first + len(paths)))
+        first += len(paths)
+        yield frame
+
+
+def frame_chunks(frame, rows=100000):
+    """
+    This function yields a DataFrame by blocks of rows.
+    """
+    for start in range(0, len(frame), rows):
+        yield frame.iloc[start:start + rows]
+
+
+#==============================================================================
+# Writers
+#==============================================================================
+
+# Empty chunks are skipped, their column types (null or int64 when empty) may
+# not match the other chunks
+
+def write_csv(frames, path):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    # Arrow formats numbers about ten times faster than DataFrame.to_csv
+    writer, schema = None, None
+    try:
+        for frame in frames:
+            if frame.empty:
+                continue
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer, schema = pa_csv.CSVWriter(path, table.schema), table.schema
+            writer.write_table(table.cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        open(path, 'w').close()
+
+
+def write_parquet(frames, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for frame in frames:
+            if frame.empty:
+                continue
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(pa.table({}), path)
+
+
+def write_excel(frames, path):
+    # Optional dependency, only needed for Excel exports
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet, rows = None, EXCEL_MAX_ROWS
+    for frame in frames:
+        for row in frame.itertuples(index=False):
+            # Continue on a new sheet once a sheet is full
+            if rows == EXCEL_MAX_ROWS:
+                sheet, rows = workbook.create_sheet(f"Data{len(workbook.worksheets) + 1}"), 1
+                sheet.append(list(frame.columns))
+            sheet.append([None if pd.isna(value) else value for value in row])
+            rows += 1
+    if sheet is None:
+        workbook.create_sheet('Data1')
+    workbook.save(path)
+
+
+# Export formats: {name: (file extension, MIME type, writer)}
+EXPORT_FORMATS = {'CSV'    : ('csv', 'text/csv', write_csv),
+                  'Parquet': ('parquet', 'application/vnd.apache.parquet', write_parquet),
+                  'Excel'  : ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                              write_excel)}
+
+
+def available_formats():
+    """
+    This function returns the export formats whose dependencies are
+    installed.
+    """
+    return [name for name in EXPORT_FORMATS
+            if name != 'Excel' or importlib.util.find_spec('openpyxl') is not None]
+
+
+def _export_path(extension):
+    directory = os.path.join(CACHE_DIR, 'exports')
+    os.makedirs(directory, exist_ok=True)
+
+    # Remove the old exports
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if time.time() - os.path.getmtime(path) > EXPORT_TTL:
+                os.remove(path)
+        except OSError:
+            pass
+
+    return os.path.join(directory, f"{uuid.uuid4().hex}.{extension}")
+
+
+def export(frames, fmt='CSV'):
+    """
+    This function writes a stream of DataFrames to a new file in one of the
+    EXPORT_FORMATS and returns its path.
+    """
+    extension, _, writer = EXPORT_FORMATS[fmt]
+    path = _export_path(extension)
+    with timed(f"export.{extension}") as measure:
+        try:
+            writer(frames, path)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        measure['bytes'] = os.path.getsize(path)
+    return path
+
+
+#==============================================================================
+# Reports
+#==============================================================================
+
+def _price_figure(ticker, close):
+    # Matplotlib figure without pyplot, safe to draw outside the main thread
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8.27, 4))
+    axes = figure.subplots()
+    axes.plot(close.index, close.to_numpy())
+    axes.set_title(f"{ticker} Close Price")
+    axes.grid(alpha=0.3)
+    figure.autofmt_xdate()
+    return figure
+
+
+def _summary_figure(summary):
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8.27, 0.6 + 0.25 * len(summary)))
+    axes = figure.subplots()
+    axes.axis('off')
+    axes.table(cellText=summary.round(4).to_numpy(), rowLabels=summary.index,
+               colLabels=summary.columns, loc='upper center')
+    return figure
+
+
+def write_report(tickers, start=None, end=None, fmt='HTML', progress=None):
+    """
+    This function writes a report with the summary statistics of several
+    tickers and the price chart of each one, as HTML or PDF, and returns its
+    path. progress is called with the fraction done after each ticker.
+    """
+    closes = {}
+    for ticker in tickers:
+        closes[ticker] = get_store().get_history(ticker, start, end)['Close']
+    summary = comparison_summary(pd.DataFrame(closes))
+
+    path = _export_path('pdf' if fmt == 'PDF' else 'html')
+    if fmt == 'PDF':
+        from matplotlib.backends.backend_pdf import PdfPages
+
+        with PdfPages(path) as pdf:
+            pdf.savefig(_summary_figure(summary))
+            for i, ticker in enumerate(tickers):
+                pdf.savefig(_price_figure(ticker, closes[ticker]))
+                if progress is not None:
+                    progress((i + 1) / len(tickers))
+    else:
+        with open(path, 'w') as f:
+            f.write(f"<html><head><meta charset='utf-8'><title>Stock report</title></head><body>"
+                    f"<h1>Stock report</h1><p>{start or ''} - {end or ''}</p>"
+                    f"<h2>Summary</h2>{summary.to_html(float_format='{:.4f}'.format)}")
+            for i, ticker in enumerate(tickers):
+                image = io.BytesIO()
+                _price_figure(ticker, closes[ticker]).savefig(image, format='png')
+                f.write(f"<h2>{ticker}</h2><img src='data:image/png;base64,"
+                        f"{base64.b64encode(image.getvalue()).decode()}'/>")
+                if progress is not None:
+                    progress((i + 1) / len(tickers))
+            f.write("</body></html>")
+    return path
+
+
+class ReportJob:
+    """
+    Report written by a background thread.
+    """
+
+    def __init__(self, tickers, start=None, end=None, fmt='HTML'):
+        self.id = uuid.uuid4().hex
+        self.tickers = list(tickers)
+        self.fmt = fmt
+        self.progress = 0.0
+        self.path = None
+        self.error = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(start, end), daemon=True,
+                                        name=f"report-{self.id}")
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def _run(self, start, end):
+        try:
+            with timed('export.report'):
+                self.path = write_report(self.tickers, start, end, self.fmt,
+                                         progress=lambda fraction: setattr(self, 'progress', fraction))
+        except Exception as error:
+            logger.warning("Could not write the report of %s: %s", self.tickers, error)
+            self.error = error
+        finally:
+            self._done.set()
+
+
+_jobs = {}         # {job id: ReportJob}
+_jobs_lock = threading.Lock()
+
+
+def start_report(tickers, start=None, end=None, fmt='HTML'):
+    """
+    This function starts writing a report in the background and returns its
+    job, which can be found again with get_report(job.id).
+    """
+    job = ReportJob(tickers, start, end, fmt)
+    with _jobs_lock:
+        # Forget the finished reports whose file was deleted
+        for job_id, old_job in list(_jobs.items()):
+            if old_job.done and (old_job.path is None or not os.path.exists(old_job.path)):
+                del _jobs[job_id]
+        _jobs[job.id] = job
+    job._thread.start()
+    return job
+
+
+def get_report(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Technical indicators of the stock dashboard.
+
+Indicators are computed on NumPy arrays by an engine holding the OHLCV bars
+of one ticker and interval. Every series (indicator or intermediate, such as
+an EMA used by both an overlay and the MACD) is computed once and shared.
+When bars are appended, or the last bars revised, only the values from the
+first changed bar onwards are computed again.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cache import get_cache
+from instrumentation import timed
+from price_store import OHLCV_COLUMNS
+
+
+# Default parameters of each indicator
+INDICATORS = {'SMA'      : {'window': 20},
+              'EMA'      : {'window': 20},
+              'Bollinger': {'window': 20, 'width': 2.0},
+              'VWAP'     : {},
+              'RSI'      : {'window': 14},
+              'MACD'     : {'fast': 12, 'slow': 26, 'signal': 9}}
+
+# Indicators drawn below the price rather than on top of it
+OSCILLATORS = ('RSI', 'MACD')
+
+
+#==============================================================================
+# Series
+#==============================================================================
+
+# Each series is computed by a function (engine, start, *params) returning its
+# values from position start to the last bar. Values before start are already
+# computed and can be used as the state of the computation.
+
+def _ewm(values, alpha, previous=None):
+    # Exponential moving average continuing from the previous value
+    if previous is not None and np.isfinite(previous):
+        values = np.concatenate(([previous], values))
+    smoothed = pd.Series(values).ewm(alpha=alpha, adjust=False, ignore_na=True).mean().to_numpy()
+    return smoothed[1:] if previous is not None and np.isfinite(previous) else smoothed
+
+
+def _column(engine, start, name):
+    return engine.values[start:, OHLCV_COLUMNS.index(name)]
+
+
+def _window_sums(values, first, start, window):
+    # Sums over the window ending at each bar from start, of the values from
+    # position first, from a cumulative sum skipping the missing ones
+    sums = np.concatenate(([0.0], np.nancumsum(values)))
+    ends = np.arange(start, first + len(values)) - first + 1
+    ret = sums[ends] - sums[np.maximum(ends - window, 0)]
+    ret[np.arange(start, first + len(values)) < window - 1] = np.nan
+    return ret
+
+
+def _rolling_sum(engine, start, name, window, power=1):
+    first = max(start - window + 1, 0)
+    return _window_sums(_column(engine, first, name) ** power, first, start, window)
+
+
+def _rolling_count(engine, start, name, window):
+    # Number of values that are not missing in the window
+    first = max(start - window + 1, 0)
+    return _window_sums(np.isfinite(_column(engine, first, name)).astype(float), first, start, window)
+
+
+def _sma(engine, start, window):
+    # Mean of the Close prices of the window that are not missing, like
+    # rolling(window, min_periods=1) once the window is full
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return engine.series('sum', 'Close', window, 1)[start:] / engine.series('count', 'Close', window)[start:]
+
+
+def _ema(engine, start, window):
+    return _ewm(_column(engine, start, 'Close'), 2 / (window + 1), engine.previous(('ema', window), start))
+
+
+def _std(engine, start, window):
+    mean = engine.series('sma', window)[start:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        squares = engine.series('sum', 'Close', window, 2)[start:] / engine.series('count', 'Close', window)[start:]
+    return np.sqrt(np.clip(squares - mean ** 2, 0, None))
+
+
+def _change(engine, start):
+    closes = engine.values[max(start - 1, 0):, OHLCV_COLUMNS.index('Close')]
+    changes = np.diff(closes)
+    return np.concatenate(([np.nan], changes)) if start == 0 else changes
+
+
+def _wilder(engine, start, sign, window):
+    # Wilder average of the gains (sign 1) or losses (sign -1)
+    moves = np.clip(sign * engine.series('change')[start:], 0, None)
+    return _ewm(moves, 1 / window, engine.previous(('wilder', sign, window), start))
+
+
+def _rsi(engine, start, window):
+    gains = engine.series('wilder', 1, window)[start:]
+    losses = engine.series('wilder', -1, window)[start:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100 - 100 / (1 + gains / losses)
+
+
+def _macd(engine, start, fast, slow):
+    return engine.series('ema', fast)[start:] - engine.series('ema', slow)[start:]
+
+
+def _macd_signal(engine, start, fast, slow, signal):
+    return _ewm(engine.series('macd', fast, slow)[start:], 2 / (signal + 1),
+                engine.previous(('macd_signal', fast, slow, signal), start))
+
+
+def _cumulative(engine, start, name):
+    # Running sum of a column, or of the traded value for 'value'
+    if name == 'value':
+        typical = (_column(engine, start, 'High') + _column(engine, start, 'Low')
+                   + _column(engine, start, 'Close')) / 3
+        values = typical * _column(engine, start, 'Volume')
+    else:
+        values = _column(engine, start, name)
+    previous = engine.previous(('cumulative', name), start)
+    return np.nancumsum(values) + (previous if previous is not None else 0.0)
+
+
+def _vwap(engine, start):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return engine.series('cumulative', 'value')[start:] / engine.series('cumulative', 'Volume')[start:]
+
+
+SERIES = {'sum'        : _rolling_sum,
+          'count'      : _rolling_count,
+          'sma'        : _sma,
+          'ema'        : _ema,
+          'std'        : _std,
+          'change'     : _change,
+          'wilder'     : _wilder,
+          'rsi'        : _rsi,
+          'macd'       : _macd,
+          'macd_signal': _macd_signal,
+          'cumulative' : _cumulative,
+          'vwap'       : _vwap}
+
+
+#==============================================================================
+# Engine
+#==============================================================================
+
+class IndicatorEngine:
+    """
+    OHLCV bars of one ticker and interval, with the series computed on them.
+    """
+
+    def __init__(self):
+        self.times = np.array([], dtype='datetime64[ns]')
+        self.values = np.empty((0, len(OHLCV_COLUMNS)))
+        self._series = {}   # {(name, *params): values}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.times)
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + self.times.nbytes + self.values.nbytes
+                + sum(values.nbytes for values in self._series.values()))
+
+    def __getstate__(self):
+        # Locks cannot be pickled by a shared cache backend
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def update(self, frame):
+        """
+        This function replaces the bars by those of frame, keeping the series
+        computed on the bars that did not change.
+
+        Returns
+        -------
+        int
+            Number of bars whose series have to be computed again.
+        """
+        with self._lock:
+            return self._update(frame)
+
+    def _update(self, frame):
+        times = frame.index.values.astype('datetime64[ns]')
+        values = frame.reindex(columns=OHLCV_COLUMNS).to_numpy(dtype=float)
+
+        # Leading bars identical in time and value
+        common = min(len(times), len(self.times))
+        same = (times[:common] == self.times[:common]) & \
+               ((values[:common] == self.values[:common])
+                | (np.isnan(values[:common]) & np.isnan(self.values[:common]))).all(axis=1)
+        kept = common if same.all() else int(np.argmin(same))
+
+        self.times = times
+        self.values = values
+        for key in self._series:
+            self._series[key] = self._series[key][:kept]
+        return len(times) - kept
+
+    def previous(self, key, start):
+        """
+        This function returns the value of a series just before start, or
+        None at the first bar.
+        """
+        return self._series[key][start - 1] if start > 0 else None
+
+    def series(self, name, *params):
+        """
+        This function returns a series over every bar, computing only the
+        values missing since the last call.
+        """
+        key = (name, *params)
+        values = self._series.get(key)
+        computed = 0 if values is None else len(values)
+        if computed < len(self):
+            new_values = np.asarray(SERIES[name](self, computed, *params), dtype=float)
+            values = new_values if values is None else np.concatenate((values, new_values))
+            self._series[key] = values
+        return values
+
+    def indicator(self, name, **params):
+        """
+        This function returns the columns of an indicator as {label: values}.
+        """
+        with self._lock:
+            return self._indicator(name, **params)
+
+    def _indicator(self, name, **params):
+        if name not in INDICATORS:
+            raise ValueError(f"Unknown indicator '{name}', expected one of {list(INDICATORS)}.")
+        params = {**INDICATORS[name], **params}
+        if name == 'SMA':
+            return {f"SMA({params['window']})": self.series('sma', params['window'])}
+        if name == 'EMA':
+            return {f"EMA({params['window']})": self.series('ema', params['window'])}
+        if name == 'Bollinger':
+            window, width = params['window'], params['width']
+            middle = self.series('sma', window)
+            band = width * self.series('std', window)
+            return {f"Bollinger upper({window}, {width:g})": middle + band,
+                    f"Bollinger middle({window}, {width:g})": middle,
+                    f"Bollinger lower({window}, {width:g})": middle - band}
+        if name == 'VWAP':
+            return {'VWAP': self.series('vwap')}
+        if name == 'RSI':
+            return {f"RSI({params['window']})": self.series('rsi', params['window'])}
+        fast, slow, signal = params['fast'], params['slow'], params['signal']
+        macd = self.series('macd', fast, slow)
+        signal_line = self.series('macd_signal', fast, slow, signal)
+        return {f"MACD({fast}, {slow})": macd,
+                f"MACD signal({signal})": signal_line,
+                'MACD histogram': macd - signal_line}
+
+    def compute(self, frame, indicators):
+        """
+        This function updates the bars with frame (see update) and returns
+        the columns of indicators, (name, params) pairs. The engine is locked
+        meanwhile, so the columns are computed on the bars of frame even when
+        another session updates the same engine.
+
+        Returns
+        -------
+        tuple
+            (number of bars computed again, {label: values})
+        """
+        with self._lock:
+            changed = self._update(frame)
+            columns = {}
+            for name, params in indicators:
+                columns.update(self._indicator(name, **params))
+            return changed, columns
+
+
+#==============================================================================
+# Cached indicators
+#==============================================================================
+
+def compute_indicators(ticker, interval, frame, indicators):
+    """
+    This function computes indicators on the OHLCV bars of a ticker.
+
+    The engine of each (ticker, interval, first bar) is kept in the shared
+    cache, so a rerun only computes the series of new or revised bars.
+
+    Parameters
+    ----------
+    indicators : list
+        (name, params) pairs, such as [('SMA', {'window': 50}), ('RSI', {})].
+
+    Returns
+    -------
+    pandas.DataFrame
+        One column per indicator line, on the index of frame.
+    """
+    if frame.empty:
+        return pd.DataFrame(index=frame.index)
+
+    cache = get_cache()
+    key = ('indicators', ticker, interval, frame.index[0])
+    with timed('indicators.compute') as measure:
+        found, engine = cache.get(key)
+        if not found:
+            engine = IndicatorEngine()
+        measure['cache'] = 'hit' if found else 'miss'
+        measure['rows'], columns = engine.compute(frame, indicators)
+        cache.set(key, engine, 'history')
+
+    return pd.DataFrame(columns, index=frame.index)
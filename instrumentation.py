@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight instrumentation of the stock dashboard hot paths.
+
+Network calls, cache lookups, transforms and renders record their wall time,
+bytes transferred, cache hit or miss and row count into a process-wide
+registry, which can be shown in the debug panel or exported as JSON lines and
+Prometheus text.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+#==============================================================================
+# Metrics registry
+#==============================================================================
+
+class Metrics:
+    """
+    Thread-safe registry of the last max_events measurements.
+    """
+
+    def __init__(self, max_events=10000):
+        self._events = deque(maxlen=max_events)
+        self._sequence = itertools.count(1)
+        self._exported = 0
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, bytes=0, cache=None, rows=None):
+        """
+        This function records one measurement.
+
+        cache is 'hit', 'miss' or None when no cache is involved.
+        """
+        event = {'name': name,
+                 'time': time.time(),
+                 'seconds': seconds,
+                 'bytes': bytes,
+                 'cache': cache,
+                 'rows': rows}
+        with self._lock:
+            event['seq'] = next(self._sequence)
+            self._events.append(event)
+
+    def events(self):
+        """
+        This function returns the recorded measurements, oldest first.
+        """
+        with self._lock:
+            return list(self._events)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def summary(self):
+        """
+        This function aggregates the measurements per name.
+
+        Returns
+        -------
+        dict
+            {name: {'count', 'p50', 'p95', 'total_seconds', 'bytes', 'hits',
+            'misses', 'rows'}}
+        """
+        grouped = {}
+        for event in self.events():
+            grouped.setdefault(event['name'], []).append(event)
+
+        summary = {}
+        for name, events in sorted(grouped.items()):
+            seconds = np.array([event['seconds'] for event in events])
+            summary[name] = {'count': len(events),
+                             'p50': float(np.percentile(seconds, 50)),
+                             'p95': float(np.percentile(seconds, 95)),
+                             'total_seconds': float(seconds.sum()),
+                             'bytes': sum(event['bytes'] for event in events),
+                             'hits': sum(event['cache'] == 'hit' for event in events),
+                             'misses': sum(event['cache'] == 'miss' for event in events),
+                             'rows': sum(event['rows'] or 0 for event in events)}
+        return summary
+
+    def export_jsonl(self, path):
+        """
+        This function appends the measurements not exported yet to a JSON
+        lines file.
+        """
+        with self._lock:
+            events = [event for event in self._events if event['seq'] > self._exported]
+            if events:
+                self._exported = events[-1]['seq']
+
+        with open(path, 'a') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+
+    def export_prometheus(self, path, prefix='stock_dashboard'):
+        """
+        This function writes the summary of the measurements in the Prometheus
+        text exposition format.
+        """
+        lines = [f"# TYPE {prefix}_duration_seconds summary"]
+        for name, stats in self.summary().items():
+            lines += [f'{prefix}_duration_seconds{{name="{name}",quantile="0.5"}} {stats["p50"]}',
+                      f'{prefix}_duration_seconds{{name="{name}",quantile="0.95"}} {stats["p95"]}',
+                      f'{prefix}_duration_seconds_sum{{name="{name}"}} {stats["total_seconds"]}',
+                      f'{prefix}_duration_seconds_count{{name="{name}"}} {stats["count"]}']
+
+        lines.append(f"# TYPE {prefix}_bytes_total counter")
+        for name, stats in self.summary().items():
+            lines.append(f'{prefix}_bytes_total{{name="{name}"}} {stats["bytes"]}')
+
+        lines.append(f"# TYPE {prefix}_cache_total counter")
+        for name, stats in self.summary().items():
+            if stats['hits'] or stats['misses']:
+                lines += [f'{prefix}_cache_total{{name="{name}",result="hit"}} {stats["hits"]}',
+                          f'{prefix}_cache_total{{name="{name}",result="miss"}} {stats["misses"]}']
+
+        # Write to a temporary file first so scrapers never see a partial file
+        with open(path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+# Registry shared by the whole process
+metrics = Metrics()
+
+
+#==============================================================================
+# Decorators and context managers
+#==============================================================================
+
+@contextmanager
+def timed(name):
+    """
+    This function measures the wall time of a block. The block can fill in
+    the yielded dict with 'bytes', 'cache' and 'rows'.
+
+    Example
+    -------
+    with timed('yahoo.quoteSummary') as measure:
+        response = session.get(url)
+        measure['bytes'] = len(response.content)
+    """
+    measure = {'bytes': 0, 'cache': None, 'rows': None}
+    start = time.perf_counter()
+    try:
+        yield measure
+    finally:
+        metrics.record(name, time.perf_counter() - start, **measure)
+
+
+def instrument(name):
+    """
+    This function decorates a function so that its calls are timed. The row
+    count of the result is recorded when it has a length.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(name) as measure:
+                result = function(*args, **kwargs)
+                if hasattr(result, '__len__'):
+                    measure['rows'] = len(result)
+                return result
+        return wrapper
+    return decorator
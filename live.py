@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Live intraday quotes of the stock dashboard.
+
+One background poller per (ticker, interval) fetches only the newest bars and
+appends them to an in-memory ring buffer. Every session watching the same
+ticker reads the same buffer, so the number of requests sent to Yahoo does not
+grow with the number of viewers. A poller stops once no session has read it
+for a while.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from instrumentation import timed
+from price_store import OHLCV_COLUMNS
+
+
+logger = logging.getLogger(__name__)
+
+# Intervals available in live mode, with the period of the first fetch
+LIVE_INTERVALS = {'1m': '1d', '5m': '5d'}
+
+
+#==============================================================================
+# Ring buffer
+#==============================================================================
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the last capacity OHLCV bars of a ticker.
+
+    Every write is numbered, so readers can ask for the bars added or revised
+    since the last sequence number they have seen.
+    """
+
+    def __init__(self, capacity=2000):
+        self.capacity = capacity
+        self.sequence = 0
+        self._times = np.zeros(capacity, dtype='datetime64[ns]')
+        self._values = np.full((capacity, len(OHLCV_COLUMNS)), np.nan)
+        self._sequences = np.zeros(capacity, dtype=np.int64)
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def _order(self):
+        # Slots from the oldest bar to the newest one
+        return np.arange(self._next - self._size, self._next) % self.capacity
+
+    def last_time(self):
+        """
+        This function returns the time of the newest bar, or None.
+        """
+        with self._lock:
+            if not self._size:
+                return None
+            return pd.Timestamp(self._times[(self._next - 1) % self.capacity])
+
+    def append(self, frame):
+        """
+        This function appends new bars. Bars already in the buffer (such as the
+        still moving last bar) are updated in place.
+        """
+        times = frame.index.values.astype('datetime64[ns]')
+        values = frame.reindex(columns=OHLCV_COLUMNS).to_numpy(dtype=float)
+
+        with self._lock:
+            for bar_time, bar_values in zip(times, values):
+                order = self._order()
+                newest = self._times[order[-1]] if self._size else None
+
+                if newest is None or bar_time > newest:
+                    slot = self._next
+                    self._next = (self._next + 1) % self.capacity
+                    self._size = min(self._size + 1, self.capacity)
+                else:
+                    # Revision of a bar still in the buffer, older bars are dropped
+                    matches = order[self._times[order] == bar_time]
+                    if not matches.size:
+                        continue
+                    slot = matches[0]
+
+                self.sequence += 1
+                self._times[slot] = bar_time
+                self._values[slot] = bar_values
+                self._sequences[slot] = self.sequence
+
+    def frame(self, since=0):
+        """
+        This function returns the buffered bars, oldest first. With since,
+        only the bars added or revised after that sequence number are returned.
+        """
+        with self._lock:
+            order = self._order()
+            order = order[self._sequences[order] > since]
+            return pd.DataFrame(self._values[order],
+                                index=pd.DatetimeIndex(self._times[order], name='Date'),
+                                columns=OHLCV_COLUMNS)
+
+
+#==============================================================================
+# Pollers
+#==============================================================================
+
+def download_latest(ticker, interval, since=None):
+    """
+    This function downloads the newest intraday bars of a ticker, starting at
+    since (included) or covering the first-fetch period of the interval.
+    """
+    if since is None:
+        bars = yf.Ticker(ticker).history(period=LIVE_INTERVALS[interval], interval=interval)
+    else:
+        bars = yf.Ticker(ticker).history(start=since, interval=interval)
+
+    if getattr(bars.index, 'tz', None) is not None:
+        bars.index = bars.index.tz_localize(None)
+    return bars
+
+
+class LivePoller:
+    """
+    Background poller of the newest bars of one ticker and interval.
+    """
+
+    def __init__(self, ticker, interval, poll_seconds=15, capacity=2000,
+                 idle_timeout=120, fetcher=download_latest):
+        self.ticker = ticker
+        self.interval = interval
+        self.poll_seconds = poll_seconds
+        self.idle_timeout = idle_timeout
+        self.fetcher = fetcher
+        self.buffer = RingBuffer(capacity)
+        self.last_poll = None
+        self.last_error = None
+        self._viewers = {}   # {viewer: last time it read the poller}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"live-{ticker}-{interval}")
+
+    def touch(self, viewer):
+        """
+        This function marks a viewer as still watching the ticker.
+        """
+        self._viewers[viewer] = time.monotonic()
+
+    def viewers(self):
+        """
+        This function returns the number of viewers seen in the last
+        idle_timeout seconds.
+        """
+        now = time.monotonic()
+        for viewer, seen in list(self._viewers.items()):
+            if now - seen > self.idle_timeout:
+                self._viewers.pop(viewer, None)
+        return len(self._viewers)
+
+    def poll(self):
+        """
+        This function fetches the bars since the newest buffered one.
+        """
+        with timed('live.poll') as measure:
+            bars = self.fetcher(self.ticker, self.interval, self.buffer.last_time())
+            measure['rows'] = len(bars)
+        self.buffer.append(bars)
+        self.last_poll = time.time()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Stop when nobody watches the ticker anymore
+            with _pollers_lock:
+                if not self.viewers():
+                    _pollers.pop((self.ticker, self.interval), None)
+                    return
+
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as error:
+                self.last_error = error
+                logger.warning("Could not poll %s %s: %s", self.ticker, self.interval, error)
+
+            self._stop.wait(self.poll_seconds)
+
+
+_pollers = {}      # {(ticker, interval): LivePoller}
+_pollers_lock = threading.Lock()
+
+
+def get_poller(ticker, interval, viewer, **kwargs):
+    """
+    This function returns the poller shared by every viewer of a ticker and
+    interval, starting it if needed, and registers viewer as watching it.
+    """
+    if interval not in LIVE_INTERVALS:
+        raise ValueError(f"Live mode supports the intervals {list(LIVE_INTERVALS)}.")
+
+    with _pollers_lock:
+        poller = _pollers.get((ticker, interval))
+        if poller is None:
+            poller = LivePoller(ticker, interval, **kwargs)
+            _pollers[(ticker, interval)] = poller
+            poller.touch(viewer)
+            poller._thread.start()
+        else:
+            poller.touch(viewer)
+        return poller
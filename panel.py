@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Compact price panel of the stock dashboard.
+
+The OHLCV histories of many tickers are held in one contiguous float32 array
+of shape (fields, dates, tickers), indexed by integer date and ticker ids.
+Charts get zero-copy views of it (a field over a date range), and the panel
+is saved as a .npy file opened read-only with np.memmap, so every session of
+a process, and every process of the server, share the same pages.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from background import BackgroundRefresh
+from instrumentation import timed
+from price_store import OHLCV_COLUMNS, get_close_matrix, get_store
+from settings import CACHE_DIR
+
+
+# Years of daily history held by the shared panel
+PANEL_YEARS = 20
+
+# Maximum number of tickers held by the shared panel, the least recently
+# requested ones are evicted first
+PANEL_MAX_TICKERS = 600
+
+# Histories read for the shared panel are merged into it in batches of this
+# many tickers, as each merge copies and saves the whole array
+PANEL_BATCH = 32
+
+
+#==============================================================================
+# Price panel
+#==============================================================================
+
+class PricePanel:
+    """
+    OHLCV histories of several tickers on a common date index.
+
+    Prices are stored as float32 (about 7 significant digits, volumes above
+    16 million are rounded accordingly), missing bars as NaN.
+    """
+
+    def __init__(self, values, dates, tickers, fields=OHLCV_COLUMNS, refreshed=None):
+        self.values = values                  # (fields, dates, tickers)
+        self.dates = pd.DatetimeIndex(dates)
+        self.tickers = list(tickers)
+        self.fields = list(fields)
+        self.refreshed = refreshed if refreshed is not None else time.time()
+        self.ticker_ids = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.field_ids = {field: i for i, field in enumerate(self.fields)}
+
+    def __contains__(self, ticker):
+        return ticker in self.ticker_ids
+
+    def __len__(self):
+        return len(self.tickers)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    @classmethod
+    def from_histories(cls, histories, fields=OHLCV_COLUMNS):
+        """
+        This function builds a panel from {ticker: OHLCV DataFrame}.
+        """
+        dates = pd.DatetimeIndex([])
+        for history in histories.values():
+            dates = dates.union(history.index)
+
+        values = np.full((len(fields), len(dates), len(histories)), np.nan, dtype=np.float32)
+        for i, history in enumerate(histories.values()):
+            rows = dates.get_indexer(history.index)
+            values[:, rows, i] = history.reindex(columns=fields).to_numpy(dtype=np.float32).T
+
+        return cls(values, dates, histories.keys(), fields)
+
+    def merge(self, histories, keep):
+        """
+        This function returns a new panel holding the tickers of keep that
+        this panel holds, and the histories of {ticker: OHLCV DataFrame}
+        (replacing the held ones).
+        """
+        kept = [ticker for ticker in self.tickers if ticker in keep and ticker not in histories]
+        added = PricePanel.from_histories(histories, self.fields)
+        dates = self.dates.union(added.dates)
+
+        values = np.full((len(self.fields), len(dates), len(kept) + len(added)), np.nan, dtype=np.float32)
+        if kept:
+            rows = dates.get_indexer(self.dates)
+            values[:, rows, :len(kept)] = self.values[:, :, [self.ticker_ids[ticker] for ticker in kept]]
+        values[:, dates.get_indexer(added.dates), len(kept):] = added.values
+
+        return PricePanel(values, dates, kept + added.tickers, self.fields, self.refreshed)
+
+    def save(self, path):
+        """
+        This function saves the panel as path.npy (values) and path.json
+        (dates, tickers and fields).
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+
+        # The values are replaced first, a reader opening both files in between
+        # detects the mismatch (see open)
+        with open(path + '.npy' + suffix, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.values))
+        with open(path + '.json' + suffix, 'w') as f:
+            json.dump({'dates': self.dates.as_unit('ns').asi8.tolist(), 'tickers': self.tickers,
+                       'fields': self.fields, 'refreshed': self.refreshed}, f)
+        os.replace(path + '.npy' + suffix, path + '.npy')
+        os.replace(path + '.json' + suffix, path + '.json')
+
+    @classmethod
+    def open(cls, path):
+        """
+        This function opens a saved panel read-only, memory-mapped.
+        """
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        values = np.load(path + '.npy', mmap_mode='r')
+        if values.shape != (len(meta['fields']), len(meta['dates']), len(meta['tickers'])):
+            raise ValueError(f"The panel {path} is being written.")
+        return cls(values, pd.to_datetime(meta['dates'], unit='ns'), meta['tickers'], meta['fields'],
+                   meta.get('refreshed', os.path.getmtime(path + '.npy')))
+
+    def date_slice(self, start=None, end=None):
+        """
+        This function returns the slice of the date ids between start
+        (included) and end (excluded).
+        """
+        first = 0 if start is None else self.dates.searchsorted(pd.Timestamp(start))
+        last = len(self.dates) if end is None else self.dates.searchsorted(pd.Timestamp(end))
+        return slice(first, last)
+
+    def frame(self, field='Close', tickers=None, start=None, end=None):
+        """
+        This function returns a field as a dates x tickers DataFrame.
+
+        The DataFrame is a read-only view of the panel when every ticker is
+        selected (or a contiguous run of them), otherwise only the selected
+        columns are copied.
+        """
+        dates = self.date_slice(start, end)
+        values = self.values[self.field_ids[field], dates]
+
+        if tickers is None:
+            tickers = self.tickers
+        else:
+            tickers = list(tickers)
+            ids = [self.ticker_ids[ticker] for ticker in tickers]
+            if ids and ids == list(range(ids[0], ids[0] + len(ids))):
+                values = values[:, ids[0]:ids[0] + len(ids)]
+            else:
+                values = values[:, ids]
+
+        return pd.DataFrame(values, index=self.dates[dates], columns=tickers, copy=False)
+
+    def history(self, ticker, start=None, end=None):
+        """
+        This function returns the OHLCV history of a ticker as a read-only
+        view.
+        """
+        dates = self.date_slice(start, end)
+        values = self.values[:, dates, self.ticker_ids[ticker]].T
+        return pd.DataFrame(values, index=self.dates[dates], columns=self.fields, copy=False)
+
+
+#==============================================================================
+# Shared panel
+#==============================================================================
+
+_panels = {}          # {interval: (panel, modification time of the saved panel opened)}
+_pending = {}         # {interval: {ticker: OHLCV history read, not merged yet}}
+_panel_used = {}      # {(interval, ticker): time of the last request}
+_refresh_due = set()  # intervals whose panel is older than its time to live
+_panel_lock = threading.Lock()
+
+
+def _panel_path(interval):
+    return os.path.join(CACHE_DIR, 'panel', interval)
+
+
+def panel_start():
+    return pd.Timestamp.now().normalize() - pd.DateOffset(years=PANEL_YEARS)
+
+
+def _open_saved(interval):
+    # Open the panel saved by this or another process when it is newer
+    panel, opened = _panels.get(interval, (None, 0.0))
+    path = _panel_path(interval)
+    if os.path.exists(path + '.npy') and os.path.getmtime(path + '.npy') > opened:
+        try:
+            panel = PricePanel.open(path)
+            _panels[interval] = (panel, os.path.getmtime(path + '.npy'))
+        except (OSError, ValueError):
+            pass
+    return panel
+
+
+def _read_histories(tickers, interval, max_workers):
+    start = panel_start()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(tickers, executor.map(lambda ticker: get_store().get_history(ticker, start=start,
+                                                                                     interval=interval),
+                                              tickers)))
+
+
+def update_panel(interval='1d', max_workers=16):
+    """
+    This function merges the pending histories into the shared panel of an
+    interval, reading every held ticker again when the panel is due for a
+    refresh, and saves it. At most PANEL_MAX_TICKERS are kept, evicting the
+    least recently requested ones.
+
+    get_panel runs it in the background, the store is read and the panel
+    merged and saved without holding the lock of the panel.
+    """
+    with _panel_lock:
+        panel = _open_saved(interval)
+        batch = dict(_pending.get(interval, {}))
+        refresh = interval in _refresh_due
+        held = [ticker for ticker in (panel.tickers if panel is not None else []) if ticker not in batch]
+        held.sort(key=lambda ticker: -_panel_used.get((interval, ticker), 0))
+
+    kept = held[:max(PANEL_MAX_TICKERS - len(batch), 0)]
+    histories = _read_histories(kept, interval, max_workers) if refresh else {}
+    histories.update(batch)
+    if panel is None:
+        new_panel = PricePanel.from_histories(histories)
+    else:
+        new_panel = panel.merge(histories, set(kept))
+    if refresh:
+        new_panel.refreshed = time.time()
+
+    path = _panel_path(interval)
+    new_panel.save(path)
+
+    with _panel_lock:
+        _panels[interval] = (PricePanel.open(path), os.path.getmtime(path + '.npy'))
+        pending = _pending.get(interval, {})
+        for ticker, history in batch.items():
+            if pending.get(ticker) is history:
+                del pending[ticker]
+        for ticker in held[len(kept):]:
+            _panel_used.pop((interval, ticker), None)
+        if refresh:
+            _refresh_due.discard(interval)
+
+
+_updates = BackgroundRefresh(update_panel, 'price panel')
+
+
+def get_panel(tickers=(), interval='1d', ttl=3600, max_workers=16):
+    """
+    This function returns a read-only panel holding at least tickers.
+
+    The panel shared by the process for the interval is returned when it
+    holds every ticker. Otherwise the missing tickers are read from the price
+    store, outside the lock, and a panel of the requested tickers is
+    returned. Their histories wait to be merged into the shared panel in the
+    background (see update_panel), once PANEL_BATCH of them are pending.
+
+    When the shared panel is older than ttl seconds it is still returned, and
+    read again in the background. It is saved and memory-mapped, so other
+    processes open it instead of building it again.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    with timed('panel.get_panel') as measure:
+        with _panel_lock:
+            panel = _open_saved(interval)
+            pending = _pending.setdefault(interval, {})
+            _panel_used.update(dict.fromkeys([(interval, ticker) for ticker in tickers], time.time()))
+
+            outside = [ticker for ticker in tickers if panel is None or ticker not in panel]
+            histories = {ticker: pending[ticker] for ticker in outside if ticker in pending}
+            missing = [ticker for ticker in outside if ticker not in histories]
+            if panel is not None and time.time() - panel.refreshed >= ttl:
+                _refresh_due.add(interval)
+        measure['cache'] = 'miss' if missing else 'hit'
+
+        if missing:
+            # Read the store without holding the lock
+            read = _read_histories(missing, interval, max_workers)
+            histories.update(read)
+            with _panel_lock:
+                pending.update(read)
+
+        with _panel_lock:
+            if interval in _refresh_due or len(pending) >= PANEL_BATCH or (panel is None and pending):
+                _updates.start(interval)
+
+        if panel is not None and not outside:
+            measure['rows'] = len(panel)
+            return panel
+
+        requested = {ticker: histories[ticker] if ticker in histories else panel.history(ticker)
+                     for ticker in tickers}
+        measure['rows'] = len(requested)
+        return PricePanel.from_histories(requested)
+
+
+def close_matrix(tickers, start=None, end=None, interval='1d'):
+    """
+    This function returns the Close prices of several tickers as a view of
+    the shared panel, or from the price store when start is before the
+    history held by the panel.
+    """
+    if start is not None and pd.Timestamp(start) < panel_start():
+        return get_close_matrix(tickers, start, end, interval)
+
+    close = get_panel(tickers, interval).frame('Close', tickers, start, end)
+
+    # Dates on which none of the tickers traded
+    traded = ~np.isnan(close.to_numpy()).all(axis=1)
+    return close if traded.all() else close[traded]
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Background prefetching of the stock dashboard.
+
+A worker thread warms the caches (fundamentals, holders, price histories and
+statements) of the configured and most viewed tickers on a schedule, and
+speculatively of the tickers of the same sector as the one being viewed.
+Requests are spread by a global token bucket, and the worker only ever
+fills caches, so the pages never wait for it.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+
+from instrumentation import timed
+from price_store import get_history
+from settings import PREFETCH_RATE, PREFETCH_TICKERS
+from statements import PERIODS, STATEMENTS, load_statements
+from universe import get_universe
+from yahoo_finance import MODULE_TTL, Fundamentals, get_major_holders
+
+
+logger = logging.getLogger(__name__)
+
+# History periods warmed for each ticker
+WARM_PERIODS = ('1mo', '1y', '5y')
+
+# Priorities of the prefetch queue (lowest first)
+VIEWED, SCHEDULED, SPECULATIVE = 0, 1, 2
+
+
+#==============================================================================
+# Rate limit
+#==============================================================================
+
+class TokenBucket:
+    """
+    Token bucket allowing rate requests per second, in bursts of up to
+    capacity requests.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop=None, tokens=1):
+        """
+        This function waits for tokens, one per request. It returns False
+        when stop (an Event) is set while waiting.
+
+        More tokens than the capacity are taken once the bucket is full, and
+        the debt delays the next requests.
+        """
+        needed = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return True
+                wait = (needed - self.tokens) / self.rate
+
+            if stop is None:
+                time.sleep(wait)
+            elif stop.wait(wait):
+                return False
+
+
+#==============================================================================
+# Prefetcher
+#==============================================================================
+
+def warm_tasks(ticker, interval=3600):
+    """
+    This function returns the (name, requests, function) loads warming the
+    caches of a ticker, with the number of requests each one sends.
+
+    Only the fundamentals modules living longer than interval seconds (the
+    time between two warm-ups) are loaded, the others would expire before
+    being used.
+    """
+    modules = tuple(module for module, ttl in MODULE_TTL.items() if ttl > interval)
+
+    tasks = [('holders', 1, lambda: get_major_holders(ticker)),
+             ('statements', len(STATEMENTS) * len(PERIODS), lambda: load_statements(ticker))]
+    if modules:
+        tasks.insert(0, ('fundamentals', 1, lambda: Fundamentals(ticker).get(modules=modules)))
+    tasks += [(f"history.{period}", 1, lambda period=period: get_history(ticker, period=period))
+              for period in WARM_PERIODS]
+    return tasks
+
+
+class Prefetcher:
+    """
+    Background worker warming the caches of the tickers likely to be viewed.
+
+    Example
+    -------
+    prefetcher = Prefetcher(['AAPL', 'MSFT']).start()
+    prefetcher.record_view('NVDA')
+    print(prefetcher.progress())
+    """
+
+    def __init__(self, tickers=(), rate=PREFETCH_RATE, interval=3600, top=20,
+                 speculative=5, universe='sp500'):
+        self.tickers = list(tickers)
+        self.bucket = TokenBucket(rate)
+        self.interval = interval
+        self.top = top
+        self.speculative = speculative
+        self.universe = universe
+        self.views = Counter()
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._queued = set()
+        self._warmed = {}   # {ticker: time of the last warm-up}
+        self._status = {'current': None, 'done': 0, 'failed': 0, 'last_schedule': None}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='prefetch')
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def enqueue(self, ticker, priority=SCHEDULED):
+        """
+        This function queues the warm-up of a ticker, unless it is already
+        queued or was warmed less than interval seconds ago.
+        """
+        with self._lock:
+            if ticker in self._queued or time.time() - self._warmed.get(ticker, 0) < self.interval:
+                return False
+            self._queued.add(ticker)
+        self._queue.put((priority, next(self._order), ticker))
+        return True
+
+    def record_view(self, ticker):
+        """
+        This function counts a view of a ticker, and queues the tickers of
+        the same sector that are the most viewed (or listed first).
+        """
+        with self._lock:
+            self.views[ticker] += 1
+
+        try:
+            constituents = get_universe(self.universe)
+        except Exception as error:
+            logger.warning("Could not load the %s universe: %s", self.universe, error)
+            return
+
+        sector = constituents.loc[constituents['Symbol'] == ticker, 'Sector']
+        if sector.empty:
+            return
+        peers = constituents.loc[(constituents['Sector'] == sector.iloc[0])
+                                 & (constituents['Symbol'] != ticker), 'Symbol'].tolist()
+        with self._lock:
+            peers.sort(key=lambda peer: -self.views[peer])
+        queued = 0
+        for peer in peers:
+            if queued == self.speculative:
+                break
+            queued += self.enqueue(peer, SPECULATIVE)
+
+    def schedule(self):
+        """
+        This function queues the configured tickers and the most viewed ones.
+        """
+        with self._lock:
+            popular = [ticker for ticker, _ in self.views.most_common(self.top)]
+            self._status['last_schedule'] = time.time()
+        for ticker in dict.fromkeys(self.tickers + popular):
+            self.enqueue(ticker, SCHEDULED)
+
+    def progress(self):
+        """
+        This function returns the state of the prefetcher: the ticker being
+        warmed, the number of queued tickers and of done or failed loads.
+        """
+        with self._lock:
+            return {**self._status, 'queued': len(self._queued), 'warmed': len(self._warmed)}
+
+    def warm(self, ticker):
+        """
+        This function loads every cached data of a ticker, one rate-limited
+        load at a time.
+        """
+        for name, requests, load in warm_tasks(ticker, self.interval):
+            if not self.bucket.acquire(self._stop, requests):
+                return
+            try:
+                with timed(f"prefetch.{name.split('.')[0]}"):
+                    load()
+                with self._lock:
+                    self._status['done'] += 1
+            except Exception as error:
+                logger.warning("Could not prefetch the %s of %s: %s", name, ticker, error)
+                with self._lock:
+                    self._status['failed'] += 1
+
+    def _run(self):
+        next_schedule = 0.0
+        while not self._stop.is_set():
+            if time.time() >= next_schedule:
+                self.schedule()
+                next_schedule = time.time() + self.interval
+
+            try:
+                _, _, ticker = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            with self._lock:
+                self._status['current'] = ticker
+            self.warm(ticker)
+            with self._lock:
+                self._queued.discard(ticker)
+                self._warmed[ticker] = time.time()
+                self._status['current'] = None
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+def get_prefetcher():
+    """
+    This function returns the prefetcher shared by the whole process, started
+    with the tickers of STOCK_DASHBOARD_PREFETCH_TICKERS.
+    """
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher(PREFETCH_TICKERS).start()
+        return _prefetcher
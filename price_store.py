@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent OHLCV price store for the stock dashboard.
+
+Histories are kept on disk as one Parquet file per ticker and interval. A
+request only downloads the date ranges that are not stored yet and merges
+them in, so a warm store is read from disk and keeps working offline. The
+bar of the current day is fetched again once it is older than the freshness
+of the store.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import json
+import logging
+import os
+import threading
+
+import pandas as pd
+import yfinance as yf
+from pandas.tseries.holiday import (AbstractHolidayCalendar, GoodFriday, Holiday, USLaborDay,
+                                    USMartinLutherKingJr, USMemorialDay, USPresidentsDay,
+                                    USThanksgivingDay, nearest_workday)
+
+from cache import TTLS, get_cache
+from instrumentation import instrument, timed
+from settings import CACHE_DIR
+
+
+logger = logging.getLogger(__name__)
+
+# Oldest date requested for the 'max' period
+MAX_START = pd.Timestamp('1900-01-01')
+
+# Columns kept in the store
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Calendar offsets of the yfinance periods
+PERIOD_OFFSETS = {'1mo': pd.DateOffset(months=1),
+                  '3mo': pd.DateOffset(months=3),
+                  '6mo': pd.DateOffset(months=6),
+                  '1y' : pd.DateOffset(years=1),
+                  '2y' : pd.DateOffset(years=2),
+                  '5y' : pd.DateOffset(years=5),
+                  '10y': pd.DateOffset(years=10)}
+
+
+#==============================================================================
+# Helpers
+#==============================================================================
+
+class ExchangeHolidayCalendar(AbstractHolidayCalendar):
+    """
+    Holidays of the US stock exchanges, on which no daily bar is expected.
+    """
+    rules = [Holiday('New Year\'s Day', month=1, day=1, observance=nearest_workday),
+             USMartinLutherKingJr,
+             USPresidentsDay,
+             GoodFriday,
+             USMemorialDay,
+             Holiday('Juneteenth', month=6, day=19, start_date='2022-01-01', observance=nearest_workday),
+             Holiday('Independence Day', month=7, day=4, observance=nearest_workday),
+             USLaborDay,
+             USThanksgivingDay,
+             Holiday('Christmas', month=12, day=25, observance=nearest_workday)]
+
+
+def has_sessions(start, end):
+    """
+    This function tells if the exchanges open on any day between start
+    (included) and end (excluded).
+    """
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end)
+    days = pd.bdate_range(start, end, inclusive='left')
+    if days.empty:
+        return False
+    holidays = ExchangeHolidayCalendar().holidays(days[0], days[-1])
+    return not days.isin(holidays).all()
+
+
+def period_start(period, end):
+    """
+    This function converts a yfinance period ('1y', 'ytd', '30d', ...) to the
+    first date of the range ending at end.
+    """
+    period = period.lower()
+    end = pd.Timestamp(end)
+
+    if period == 'max':
+        return MAX_START
+    if period == 'ytd':
+        return pd.Timestamp(year=end.year, month=1, day=1)
+    if period in PERIOD_OFFSETS:
+        return end - PERIOD_OFFSETS[period]
+    if period.endswith('d') and period[:-1].isdigit():
+        return end - pd.Timedelta(days=int(period[:-1]))
+
+    raise ValueError(f"Unknown period '{period}'.")
+
+
+@instrument('yfinance.history')
+def download_history(ticker, start, end, interval):
+    """
+    This function downloads the OHLCV history of a ticker from Yahoo Finance.
+    """
+    return yf.Ticker(ticker).history(start=start, end=end, interval=interval)
+
+
+def _normalize(frame):
+    # Keep the OHLCV columns with a timezone-naive, sorted, unique index
+    frame = frame.reindex(columns=OHLCV_COLUMNS)
+    if getattr(frame.index, 'tz', None) is not None:
+        frame.index = frame.index.tz_localize(None)
+    frame.index.name = 'Date'
+    frame = frame[~frame.index.duplicated(keep='last')]
+    return frame.sort_index()
+
+
+#==============================================================================
+# Price store
+#==============================================================================
+
+class PriceStore:
+    """
+    On-disk store of OHLCV histories, partitioned per interval and ticker.
+
+    Each partition keeps the covered date range next to the data, so that only
+    the missing ranges are fetched on the next request, and the time of the
+    last fetch, so that the bar of that day (still moving) is fetched again
+    once older than freshness seconds.
+    """
+
+    def __init__(self, root=None, fetcher=download_history, freshness=TTLS['history']):
+        self.root = root or os.path.join(CACHE_DIR, 'prices')
+        self.fetcher = fetcher
+        self.freshness = freshness
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _partition_lock(self, ticker, interval):
+        # One lock per partition, so different tickers are fetched concurrently
+        with self._locks_lock:
+            return self._locks.setdefault((ticker, interval), threading.Lock())
+
+    def _path(self, ticker, interval, extension):
+        return os.path.join(self.root, interval, f"{ticker}.{extension}")
+
+    def read(self, ticker, interval='1d'):
+        """
+        This function reads a stored history and its coverage, as (start,
+        end, time of the last fetch).
+        """
+        data_path = self._path(ticker, interval, 'parquet')
+        coverage_path = self._path(ticker, interval, 'json')
+
+        empty = pd.DataFrame(columns=OHLCV_COLUMNS, index=pd.DatetimeIndex([], name='Date'))
+        if not (os.path.exists(data_path) and os.path.exists(coverage_path)):
+            return empty, None
+
+        # Another process may have removed or replaced the files meanwhile, an
+        # unreadable partition is fetched again like a missing one
+        try:
+            with open(coverage_path) as f:
+                coverage = json.load(f)
+            return (pd.read_parquet(data_path),
+                    (pd.Timestamp(coverage['start']), pd.Timestamp(coverage['end']),
+                     pd.Timestamp(coverage.get('fetched', coverage['end']))))
+        except Exception as error:
+            logger.warning("Could not read the stored %s %s history: %s", ticker, interval, error)
+            return empty, None
+
+    def write(self, ticker, interval, frame, coverage):
+        """
+        This function writes a history and its coverage (start, end, time of
+        the last fetch).
+        """
+        data_path = self._path(ticker, interval, 'parquet')
+        coverage_path = self._path(ticker, interval, 'json')
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+
+        # Write to temporary files first so readers never see a partial file,
+        # named per process and thread as several servers may share the store
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        frame.to_parquet(data_path + suffix)
+        with open(coverage_path + suffix, 'w') as f:
+            json.dump({'start': coverage[0].isoformat(),
+                       'end': coverage[1].isoformat(),
+                       'fetched': coverage[2].isoformat()}, f)
+        os.replace(data_path + suffix, data_path)
+        os.replace(coverage_path + suffix, coverage_path)
+
+    def get_history(self, ticker, start=None, end=None, interval='1d', period=None):
+        """
+        This function returns the OHLCV history of a ticker between start
+        (included) and end (excluded), fetching only the missing ranges.
+
+        When start is not given it is derived from period (default 'max').
+        If Yahoo Finance cannot be reached the stored data is returned.
+        """
+        with timed('price_store.get_history') as measure:
+            end = pd.Timestamp(end) if end is not None else pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+            start = pd.Timestamp(start) if start is not None else period_start(period or 'max', end)
+
+            now = pd.Timestamp.now()
+            tomorrow = now.normalize() + pd.Timedelta(days=1)
+
+            with self._partition_lock(ticker, interval):
+                stored, coverage = self.read(ticker, interval)
+                covered_start, covered_end, fetched = coverage if coverage else (None, None, None)
+
+                # The bar of the day of the last fetch was still moving, fetch it
+                # again once stale
+                if coverage and (now - fetched).total_seconds() > self.freshness:
+                    covered_end = min(covered_end, fetched.normalize())
+
+                # Ranges to fetch, always adjacent to the covered range so that it
+                # stays contiguous
+                if coverage is None:
+                    missing = [(start, end)]
+                else:
+                    missing = []
+                    if start < covered_start:
+                        missing.append((start, covered_start))
+                    if end > covered_end:
+                        missing.append((covered_end, end))
+
+                measure['cache'] = 'miss' if missing else 'hit'
+                frames = []
+                for fetch_start, fetch_end in missing:
+                    try:
+                        fetched_bars = _normalize(self.fetcher(ticker, fetch_start, fetch_end, interval))
+                    except Exception as error:
+                        logger.warning("Could not fetch %s %s from %s to %s: %s",
+                                       ticker, interval, fetch_start, fetch_end, error)
+                        continue
+
+                    # yfinance returns an empty frame on network errors, so a range
+                    # without bars is only covered when no bar is expected in it
+                    if fetched_bars.empty and not self._no_bars_expected(stored, covered_start, fetch_start,
+                                                                        fetch_end, now):
+                        logger.warning("No %s %s bars from %s to %s, they will be fetched again.",
+                                       ticker, interval, fetch_start, fetch_end)
+                        continue
+
+                    frames.append(fetched_bars)
+                    fetch_end = min(fetch_end, tomorrow)
+                    covered_start = fetch_start if covered_start is None else min(covered_start, fetch_start)
+                    if covered_end is None or fetch_end >= covered_end:
+                        covered_end, fetched = fetch_end, now
+
+                if frames:
+                    frames = [frame for frame in [stored] + frames if not frame.empty]
+                    stored = _normalize(pd.concat(frames)) if frames else _normalize(stored)
+                    self.write(ticker, interval, stored, (covered_start, max(covered_start, covered_end), fetched))
+
+            history = stored.loc[(stored.index >= start) & (stored.index < end)]
+            measure['rows'] = len(history)
+            return history
+
+    @staticmethod
+    def _no_bars_expected(stored, covered_start, start, end, now):
+        # No session before today (today's bar may not exist yet and is fetched
+        # again once stale)
+        if not has_sessions(start, min(end, now.normalize())):
+            return True
+
+        # Before the covered range, whose first sessions have no bars either:
+        # the ticker was not listed yet
+        return (covered_start is not None and end <= covered_start and not stored.empty
+                and has_sessions(covered_start, stored.index[0]))
+
+    def get_close_matrix(self, tickers, start=None, end=None, interval='1d', period=None):
+        """
+        This function returns the Close prices of several tickers, one column
+        per ticker.
+        """
+        closes = {ticker: self.get_history(ticker, start, end, interval, period)['Close']
+                  for ticker in tickers}
+        return pd.DataFrame(closes)
+
+
+#==============================================================================
+# Default store
+#==============================================================================
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """
+    This function returns the price store shared by the dashboard.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PriceStore()
+        return _store
+
+
+def get_history(ticker, start=None, end=None, interval='1d', period=None):
+    """
+    This function returns the OHLCV history of a ticker from the shared store.
+
+    Histories are also kept in the shared cache for a few minutes, so reruns
+    do not read the store again.
+    """
+    return get_cache().get_or_load(('history', ticker, start, end, interval, period),
+                                   lambda: get_store().get_history(ticker, start, end, interval, period),
+                                   'history')
+
+
+def get_close_matrix(tickers, start=None, end=None, interval='1d', period=None):
+    """
+    This function returns the Close prices of several tickers from the shared
+    store, cached like get_history.
+    """
+    tickers = tuple(tickers)
+    return get_cache().get_or_load(('close_matrix', tickers, start, end, interval, period),
+                                   lambda: get_store().get_close_matrix(tickers, start, end, interval, period),
+                                   'history')
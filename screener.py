@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Stock screener of the stock dashboard.
+
+Key statistics of every constituent of a universe are kept in a columnar
+Parquet snapshot, built and refreshed once a day in the background. Screens
+are vectorized filters and sorts of the snapshot in memory, so they never
+wait for Yahoo Finance.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import logging
+import operator
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from analytics import key_statistics
+from background import BackgroundRefresh, save_atomically
+from instrumentation import instrument, timed
+from settings import CACHE_DIR
+from universe import UNIVERSE_COLUMNS, get_universe
+
+
+logger = logging.getLogger(__name__)
+
+# Statistics of the snapshot, as in the key statistics of the Summary tab
+SCREENER_FIELDS = ['previousClose', 'open', 'bid', 'ask', 'dayLow', 'dayHigh',
+                   'fiftyTwoWeekLow', 'fiftyTwoWeekHigh', 'volume', 'averageVolume',
+                   'marketCap', 'beta', 'trailingPE', 'trailingEps', 'dividendRate',
+                   'dividendYield', 'targetMeanPrice']
+
+# Operators of the screen conditions
+OPERATORS = {'<' : operator.lt,
+             '<=': operator.le,
+             '>' : operator.gt,
+             '>=': operator.ge,
+             '==': operator.eq,
+             '!=': operator.ne}
+
+# Share of the tickers that must be loaded for a snapshot to be saved
+MIN_LOADED_SHARE = 0.5
+
+
+#==============================================================================
+# Snapshot
+#==============================================================================
+
+_memory = {}       # {universe: (snapshot time, snapshot)}
+_lock = threading.Lock()
+
+
+def _snapshot_path(universe):
+    return os.path.join(CACHE_DIR, 'screener', f"{universe}.parquet")
+
+
+@instrument('screener.refresh')
+def refresh_snapshot(universe='sp500', max_workers=16):
+    """
+    This function downloads the statistics of every constituent of a universe
+    and saves them as the snapshot.
+
+    Tickers that could not be loaded are kept with missing statistics. When
+    less than MIN_LOADED_SHARE of them are loaded (Yahoo Finance cannot be
+    reached), the previous snapshot is kept and a RuntimeError is raised.
+    """
+    constituents = get_universe(universe)
+    statistics, errors = key_statistics(constituents['Symbol'], SCREENER_FIELDS, max_workers)
+    if len(constituents) - len(errors) < MIN_LOADED_SHARE * len(constituents):
+        raise RuntimeError(f"Could not load {len(errors)} of the {len(constituents)} {universe} tickers.")
+    if errors:
+        logger.warning("Could not load %d of the %d %s tickers.", len(errors), len(constituents), universe)
+
+    snapshot = constituents[UNIVERSE_COLUMNS].join(statistics, on='Symbol').reset_index(drop=True)
+    save_atomically(_snapshot_path(universe), lambda path: snapshot.to_parquet(path, index=False))
+
+    with _lock:
+        _memory[universe] = (time.time(), snapshot)
+    return snapshot
+
+
+_refreshes = BackgroundRefresh(refresh_snapshot, 'screener snapshot')
+
+
+def get_snapshot(universe='sp500', ttl=24 * 3600):
+    """
+    This function returns the snapshot of a universe and its time.
+
+    The snapshot is read from memory or from disk. When it is older than ttl
+    seconds it is still returned, and a refresh is started in the background.
+    Without any snapshot yet, it is built in the background and None is
+    returned (see is_refreshing).
+
+    Returns
+    -------
+    tuple
+        (snapshot time, DataFrame with the universe columns and the
+        SCREENER_FIELDS), or None
+    """
+    with timed('screener.get_snapshot') as measure:
+        with _lock:
+            cached = _memory.get(universe)
+
+        path = _snapshot_path(universe)
+        if cached is None and os.path.exists(path):
+            cached = (os.path.getmtime(path), pd.read_parquet(path))
+            with _lock:
+                _memory[universe] = cached
+
+        measure['cache'] = 'miss' if cached is None else 'hit'
+        if cached is None or time.time() - cached[0] >= ttl:
+            _refreshes.start(universe)
+        if cached is not None:
+            measure['rows'] = len(cached[1])
+        return cached
+
+
+def is_refreshing(universe='sp500'):
+    """
+    This function tells if the snapshot of a universe is being built.
+    """
+    return _refreshes.is_running(universe)
+
+
+#==============================================================================
+# Screens
+#==============================================================================
+
+def screen(snapshot, conditions=(), sectors=None, sort_by=None, ascending=True, limit=None):
+    """
+    This function filters and sorts a snapshot.
+
+    Parameters
+    ----------
+    conditions : iterable
+        (field, operator, value) conditions that must all hold, such as
+        [('trailingPE', '<', 15), ('beta', '<', 1)]. Rows with a missing
+        field never match a condition on it.
+    sectors : list, optional
+        Sectors to keep.
+    sort_by : str, optional
+        Field to sort on, missing values last.
+    limit : int, optional
+        Maximum number of rows returned.
+    """
+    with timed('screener.screen') as measure:
+        mask = np.ones(len(snapshot), dtype=bool)
+        for field, op, value in conditions:
+            if op not in OPERATORS:
+                raise ValueError(f"Unknown operator '{op}', expected one of {list(OPERATORS)}.")
+            mask &= OPERATORS[op](snapshot[field].to_numpy(), value)
+        if sectors:
+            mask &= snapshot['Sector'].isin(sectors).to_numpy()
+
+        result = snapshot[mask]
+        if sort_by is not None:
+            result = result.sort_values(sort_by, ascending=ascending, na_position='last')
+        if limit is not None:
+            result = result.head(limit)
+
+        measure['rows'] = len(result)
+        return result
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Shared settings of the stock dashboard.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import os
+
+
+#==============================================================================
+# Local storage
+#==============================================================================
+
+# Folder holding the on-disk caches (price store, snapshots, ...)
+CACHE_DIR = os.environ.get(
+    'STOCK_DASHBOARD_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+
+
+#==============================================================================
+# Instrumentation
+#==============================================================================
+
+# Folder where the metrics are exported as metrics.jsonl and metrics.prom
+# after each page run (not exported when empty)
+METRICS_DIR = os.environ.get('STOCK_DASHBOARD_METRICS_DIR', '')
+
+
+#==============================================================================
+# Shared cache
+#==============================================================================
+
+# Memory budget of the in-process cache, in bytes
+CACHE_MAX_BYTES = int(os.environ.get('STOCK_DASHBOARD_CACHE_MAX_BYTES', 512 * 2 ** 20))
+
+# Redis-compatible server shared by the worker processes, such as
+# redis://localhost:6379/0 (memory only when empty)
+REDIS_URL = os.environ.get('STOCK_DASHBOARD_REDIS_URL', '')
+
+
+#==============================================================================
+# Prefetching
+#==============================================================================
+
+# Tickers always kept warm, comma separated (the most viewed ones are added)
+PREFETCH_TICKERS = [ticker.strip() for ticker in os.environ.get('STOCK_DASHBOARD_PREFETCH_TICKERS', '').split(',')
+                    if ticker.strip()]
+
+# Maximum number of prefetch requests per second
+PREFETCH_RATE = float(os.environ.get('STOCK_DASHBOARD_PREFETCH_RATE', 2))
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo simulation engine used by the stock dashboard.
+
+Paths are generated as (num_simulations x time_horizon) NumPy arrays, in
+chunks of PATH_CHUNK paths, so the cost is a handful of vectorized
+operations instead of one random draw per simulated day, and large
+simulations can be streamed.
+
+Portfolios of correlated assets are simulated in chunks of paths, so the
+memory used does not grow with the number of simulations.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+# Available simulation models
+MODELS = ('gbm', 'bootstrap')
+
+# Default confidence levels for VaR / CVaR
+CONFIDENCE_LEVELS = (0.90, 0.95, 0.99)
+
+# Number of paths simulated at a time
+PATH_CHUNK = 10000
+
+
+#==============================================================================
+# Price paths
+#==============================================================================
+
+def _growth(returns, size, model, drift, rng):
+    # Daily growth factors of size (paths, days)
+    if model == 'gbm':
+        # Daily log returns with the historical volatility
+        volatility = np.log1p(returns).std()
+        log_returns = rng.normal(drift - 0.5 * volatility ** 2, volatility, size)
+        return np.exp(log_returns)
+    if model == 'bootstrap':
+        # Resample the historical daily returns
+        return 1 + rng.choice(returns, size=size, replace=True)
+    raise ValueError(f"Unknown model '{model}', expected one of {MODELS}.")
+
+
+def iter_paths(last_price, returns, num_simulations, time_horizon,
+               model='gbm', drift=0.0, seed=None, chunk_size=PATH_CHUNK):
+    """
+    This function simulates future stock prices chunk_size paths at a time,
+    yielding (chunk_size x time_horizon) arrays. See simulate_paths for the
+    parameters.
+
+    Each chunk has its own seed spawned from seed, so the paths of a given
+    seed are the same whether they are streamed or simulated at once.
+    """
+    returns = np.asarray(returns, dtype=float)
+    returns = returns[np.isfinite(returns)]
+    if returns.size == 0:
+        raise ValueError("At least one historical return is required.")
+    if model not in MODELS:
+        raise ValueError(f"Unknown model '{model}', expected one of {MODELS}.")
+
+    starts = range(0, num_simulations, chunk_size)
+    for start, chunk_seed in zip(starts, np.random.SeedSequence(seed).spawn(len(starts))):
+        size = (min(chunk_size, num_simulations - start), time_horizon)
+        growth = _growth(returns, size, model, drift, np.random.default_rng(chunk_seed))
+
+        # Compound the daily growth factors along each path
+        yield last_price * np.cumprod(growth, axis=1)
+
+
+def simulate_paths(last_price, returns, num_simulations, time_horizon,
+                   model='gbm', drift=0.0, seed=None):
+    """
+    This function simulates future stock prices.
+
+    Parameters
+    ----------
+    last_price : float
+        Price the simulation starts from.
+    returns : array-like
+        Historical daily simple returns used to calibrate the model.
+    num_simulations : int
+        Number of simulated paths.
+    time_horizon : int
+        Number of simulated days.
+    model : {'gbm', 'bootstrap'}
+        'gbm' draws normal log returns with the historical volatility,
+        'bootstrap' resamples the historical returns with replacement.
+    drift : float
+        Daily drift of the GBM model (0 keeps the expected price flat).
+    seed : int, optional
+        Seed of the random generator, pass it to reproduce a simulation.
+
+    Returns
+    -------
+    numpy.ndarray
+        Simulated prices with shape (num_simulations, time_horizon).
+    """
+    paths = np.empty((num_simulations, time_horizon))
+    row = 0
+    for chunk in iter_paths(last_price, returns, num_simulations, time_horizon, model, drift, seed):
+        paths[row:row + len(chunk)] = chunk
+        row += len(chunk)
+    return paths
+
+
+#==============================================================================
+# Risk measures
+#==============================================================================
+
+def value_at_risk(final_prices, last_price, confidence_levels=CONFIDENCE_LEVELS):
+    """
+    This function computes the VaR and CVaR of simulated final prices.
+
+    VaR is the loss (as a negative change in price) that is not exceeded at
+    the given confidence level; CVaR is the average change in price of the
+    paths at or beyond the VaR.
+
+    Returns
+    -------
+    dict
+        {confidence_level: {'VaR': float, 'CVaR': float}}
+    """
+    pnl = np.asarray(final_prices, dtype=float) - last_price
+
+    risk = {}
+    for level in confidence_levels:
+        var = np.percentile(pnl, (1 - level) * 100)
+        tail = pnl[pnl <= var]
+        risk[level] = {'VaR': var,
+                       'CVaR': tail.mean() if tail.size else var}
+
+    return risk
+
+
+#==============================================================================
+# Portfolio
+#==============================================================================
+
+def covariance_factor(covariance):
+    """
+    This function returns the lower Cholesky factor of a covariance matrix.
+
+    Sample covariance matrices of many assets over a short lookback are often
+    only positive semi-definite, so negative eigenvalues are clipped first.
+    """
+    try:
+        return np.linalg.cholesky(covariance)
+    except np.linalg.LinAlgError:
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        eigenvalues = np.clip(eigenvalues, 1e-12, None)
+        return np.linalg.cholesky((eigenvectors * eigenvalues) @ eigenvectors.T)
+
+
+def _portfolio_chunk(seed, size, mean, factor, exposures, thresholds=None):
+    """
+    This function simulates one chunk of portfolio paths.
+
+    Without thresholds, it returns the profit and loss of each path. With
+    thresholds, it returns, for each threshold, the sum of the asset profits
+    and losses over the paths at or below it, and the number of such paths.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Correlated log returns over the whole horizon, N(h * mean, h * covariance)
+    log_returns = mean + rng.standard_normal((size, len(mean))) @ factor.T
+    asset_pnl = np.expm1(log_returns) * exposures
+    pnl = asset_pnl.sum(axis=1)
+
+    if thresholds is None:
+        return pnl
+    tails = pnl[:, None] <= thresholds
+    return tails.T.astype(float) @ asset_pnl, tails.sum(axis=0)
+
+
+def simulate_portfolio(returns, weights, num_simulations, time_horizon,
+                       portfolio_value=1.0, confidence_levels=CONFIDENCE_LEVELS,
+                       chunk_size=10000, seed=None, workers=None):
+    """
+    This function simulates the profit and loss of a portfolio of correlated
+    assets over a horizon, with its VaR, CVaR and the CVaR contribution of
+    each asset.
+
+    The horizon log returns are drawn at once from a normal distribution with
+    the mean and covariance of the historical daily log returns, scaled by
+    the horizon, through the Cholesky factor of the covariance. Paths are
+    generated in chunks of chunk_size, each with its own seed spawned from
+    seed, so results do not depend on workers and the memory used stays
+    around chunk_size x assets. The tail contributions are computed in a
+    second pass that regenerates the same chunks.
+
+    Parameters
+    ----------
+    returns : pandas.DataFrame
+        Historical daily simple returns over the lookback, one column per
+        asset.
+    weights : array-like
+        Weight of each asset in the portfolio, normalized to sum to 1.
+    num_simulations : int
+        Number of simulated paths.
+    time_horizon : int
+        Number of simulated days.
+    portfolio_value : float
+        Value of the portfolio at the start of the simulation.
+    chunk_size : int
+        Number of paths simulated at a time.
+    seed : int, optional
+        Seed of the random generator, pass it to reproduce a simulation.
+    workers : int, optional
+        Number of processes simulating the chunks (in-process when None).
+
+    Returns
+    -------
+    dict
+        {'pnl': profit and loss of each path,
+         'risk': {confidence_level: {'VaR': float, 'CVaR': float}},
+         'contributions': DataFrame of the CVaR contribution of each asset
+         (rows) at each confidence level (columns), summing to the CVaR}
+    """
+    returns = returns.dropna()
+    if len(returns) < 2:
+        raise ValueError("At least two days of returns are required for every asset.")
+
+    weights = np.asarray(weights, dtype=float)
+    if weights.shape != (returns.shape[1],) or not np.isfinite(weights).all():
+        raise ValueError("One weight per asset is required, and every weight must be a number.")
+    if np.isclose(weights.sum(), 0):
+        raise ValueError("The weights must not sum to zero.")
+    exposures = portfolio_value * weights / weights.sum()
+
+    log_returns = np.log1p(returns.to_numpy(dtype=float))
+    mean = time_horizon * log_returns.mean(axis=0)
+    factor = covariance_factor(time_horizon * np.atleast_2d(np.cov(log_returns, rowvar=False)))
+
+    sizes = [min(chunk_size, num_simulations - start) for start in range(0, num_simulations, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    levels = list(confidence_levels)
+
+    def run(thresholds=None):
+        arguments = [(chunk_seed, size, mean, factor, exposures, thresholds)
+                     for chunk_seed, size in zip(seeds, sizes)]
+        if workers is None or workers <= 1 or len(sizes) == 1:
+            return [_portfolio_chunk(*chunk_arguments) for chunk_arguments in arguments]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_portfolio_chunk, *zip(*arguments)))
+
+    # First pass: profit and loss of the portfolio on every path
+    pnl = np.concatenate(run())
+    thresholds = np.percentile(pnl, [(1 - level) * 100 for level in levels])
+
+    # Second pass: asset profits and losses on the tail paths
+    tail_sums = np.zeros((len(levels), len(exposures)))
+    tail_counts = np.zeros(len(levels))
+    for sums, counts in run(thresholds):
+        tail_sums += sums
+        tail_counts += counts
+
+    contributions = tail_sums / np.maximum(tail_counts, 1)[:, None]
+    risk = {level: {'VaR': var, 'CVaR': contributions[i].sum() if tail_counts[i] else var}
+            for i, (level, var) in enumerate(zip(levels, thresholds))}
+
+    return {'pnl': pnl,
+            'risk': risk,
+            'contributions': pd.DataFrame(contributions.T, index=returns.columns, columns=levels)}
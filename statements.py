@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Financial statements of the stock dashboard.
+
+The three statements of a company are fetched for both periods at once, in
+parallel, and cached together, so switching between them is instant.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import yfinance as yf
+
+from cache import TTLS, get_cache
+from instrumentation import instrument, timed
+
+
+# yfinance getter of each financial statement
+STATEMENTS = {'Income Statement': 'get_income_stmt',
+              'Balance Sheet'   : 'get_balance_sheet',
+              'Cash Flow'       : 'get_cash_flow'}
+
+# Periods of the financial statements
+PERIODS = ('yearly', 'quarterly')
+
+# Columns of the long-format panel
+PANEL_COLUMNS = ['ticker', 'statement', 'period', 'item', 'date', 'value']
+
+
+#==============================================================================
+# Company statements
+#==============================================================================
+
+@instrument('yfinance.statement')
+def fetch_statement(ticker, statement, period):
+    """
+    This function downloads one financial statement from Yahoo Finance.
+    """
+    # One Ticker per call, yfinance objects are not meant to be shared
+    # between threads
+    return getattr(yf.Ticker(ticker), STATEMENTS[statement])(pretty=True, freq=period)
+
+
+def load_statements(ticker, ttl=TTLS['statements']):
+    """
+    This function returns every financial statement of a ticker as
+    {(statement, period): DataFrame}.
+
+    The six statements are downloaded in parallel and cached together for
+    ttl seconds. Concurrent loads of the same ticker wait for the first one.
+    """
+    def fetch():
+        keys = [(statement, period) for statement in STATEMENTS for period in PERIODS]
+        with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+            futures = {key: executor.submit(fetch_statement, ticker, *key) for key in keys}
+            return {key: future.result() for key, future in futures.items()}
+
+    with timed('statements.load_statements') as measure:
+        found, statements = get_cache().get(('statements', ticker))
+        measure['cache'] = 'hit' if found else 'miss'
+        if not found:
+            statements = get_cache().get_or_load(('statements', ticker), fetch, 'statements', ttl)
+        return statements
+
+
+#==============================================================================
+# Peer panel
+#==============================================================================
+
+def long_format(ticker, loaded, statements=None, periods=None):
+    """
+    This function yields the statements loaded by load_statements as
+    long-format DataFrames with the PANEL_COLUMNS, one per statement and
+    period.
+    """
+    for statement in statements or STATEMENTS:
+        for period in periods or PERIODS:
+            values = loaded[(statement, period)].stack().dropna()
+            yield pd.DataFrame({'ticker': ticker,
+                                'statement': statement,
+                                'period': period,
+                                'item': values.index.get_level_values(0),
+                                'date': values.index.get_level_values(1),
+                                'value': values.to_numpy()})
+
+
+def statements_panel(tickers, statements=None, periods=None, max_workers=16):
+    """
+    This function builds a long-format panel of financial statements for many
+    tickers, with the columns ticker, statement, period, item, date, value.
+
+    Tickers are loaded in parallel.
+
+    Returns
+    -------
+    tuple
+        (panel, {ticker: exception}) for the tickers that could not be loaded.
+    """
+    statements = statements or list(STATEMENTS)
+    periods = periods or list(PERIODS)
+
+    frames = []
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(load_statements, ticker): ticker for ticker in dict.fromkeys(tickers)}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                loaded = future.result()
+            except Exception as error:
+                errors[ticker] = error
+                continue
+
+            frames.extend(long_format(ticker, loaded, statements, periods))
+
+    panel = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=PANEL_COLUMNS)
+    return panel, errors
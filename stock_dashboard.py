@@ -11,110 +11,86 @@ Created on Mon Nov  6 13:35:53 2023
 
 
 # Libraries
-import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-import yfinance as yf
+import os
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import streamlit as st
 
+from analytics import compare_stocks, portfolio_simulation, simulate_stock
+from comparison import COMPARISONS, comparison_summary, correlation
+from instrumentation import instrument, metrics, timed
+from live import LIVE_INTERVALS, get_poller
+from panel import close_matrix
+from prefetch import get_prefetcher
+from downsampling import CANDLE_PIXELS, CHART_WIDTH, downsample_ohlcv, downsample_series
+from export import (EXPORT_FORMATS, available_formats, export, frame_chunks, get_report,
+                    history_frames, path_frames, start_report, statement_frames)
+from indicators import OSCILLATORS, compute_indicators
+from price_store import get_history
+from screener import SCREENER_FIELDS, get_snapshot, is_refreshing, screen
+from settings import METRICS_DIR
+from simulation import value_at_risk
+from statements import load_statements, statements_panel
+from universe import get_universe
+from yahoo_finance import Fundamentals, YFinance, get_major_holders
+
 
 #==============================================================================
-# HOT FIX FOR YFINANCE .INFO METHOD
-# Ref: https://github.com/ranaroussi/yfinance/issues/1729
+# App state
 #==============================================================================
 
+class AppState:
+    """
+    Inputs set in the sidebar and read by the tabs, kept in st.session_state.
+    """
+    def __init__(self):
+        self.ticker_list = None
+        self.selected_stock = ''
+        self.start_date = None
+        self.end_date = None
+        self.update_button = False
+        self.report_id = None
+        self.viewer_id = uuid.uuid4().hex
 
-import requests
-import urllib
-
-class YFinance:
-    user_agent_key = "User-Agent"
-    user_agent_value = ("Mozilla/5.0 (Windows NT 6.1; Win64; x64) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/58.0.3029.110 Safari/537.36")
-    
-    def __init__(self, ticker):
-        self.yahoo_ticker = ticker
-
-    def __str__(self):
-        return self.yahoo_ticker
-
-    def _get_yahoo_cookie(self):
-        cookie = None
-
-        headers = {self.user_agent_key: self.user_agent_value}
-        response = requests.get("https://fc.yahoo.com",
-                                headers=headers,
-                                allow_redirects=True)
-
-        if not response.cookies:
-            raise Exception("Failed to obtain Yahoo auth cookie.")
-
-        cookie = list(response.cookies)[0]
-
-        return cookie
-
-    def _get_yahoo_crumb(self, cookie):
-        crumb = None
 
-        headers = {self.user_agent_key: self.user_agent_value}
+def get_app_state():
+    # Create the state once per session
+    if 'app_state' not in st.session_state:
+        st.session_state['app_state'] = AppState()
+    return st.session_state['app_state']
 
-        crumb_response = requests.get(
-            "https://query1.finance.yahoo.com/v1/test/getcrumb",
-            headers=headers,
-            cookies={cookie.name: cookie.value},
-            allow_redirects=True,
-        )
-        crumb = crumb_response.text
 
-        if crumb is None:
-            raise Exception("Failed to retrieve Yahoo crumb.")
-
-        return crumb
-
-    @property
-    def info(self):
-        # Yahoo modules doc informations :
-        # https://cryptocointracker.com/yahoo-finance/yahoo-finance-api
-        cookie = self._get_yahoo_cookie()
-        crumb = self._get_yahoo_crumb(cookie)
-        info = {}
-        ret = {}
-
-        headers = {self.user_agent_key: self.user_agent_value}
-
-        yahoo_modules = ("assetProfile,"  # longBusinessSummary
-                         "summaryDetail,"
-                         "financialData,"
-                         "indexTrend,"
-                         "defaultKeyStatistics")
-
-        url = ("https://query1.finance.yahoo.com/v10/finance/"
-               f"quoteSummary/{self.yahoo_ticker}"
-               f"?modules={urllib.parse.quote_plus(yahoo_modules)}"
-               f"&ssl=true&crumb={urllib.parse.quote_plus(crumb)}")
+#==============================================================================
+# Exports
+#==============================================================================
 
-        info_response = requests.get(url,
-                                     headers=headers,
-                                     cookies={cookie.name: cookie.value},
-                                     allow_redirects=True)
+def export_button(label, make_frames, file_stem, key):
+    """
+    This function shows a format selection and a download button. The file
+    is only written, from the DataFrames yielded by make_frames(), when the
+    button is clicked.
+    """
+    col1, col2 = st.columns([1, 3], vertical_alignment='bottom')
+    fmt = col1.selectbox('Format:', available_formats(), key=f'{key}_format')
+    extension, mime, _ = EXPORT_FORMATS[fmt]
+    col2.download_button(label, data=lambda: open(export(make_frames(), fmt), 'rb'),
+                         file_name=f'{file_stem}.{extension}', mime=mime,
+                         on_click='ignore', key=key)
 
-        info = info_response.json()
-        info = info['quoteSummary']['result'][0]
 
-        for mainKeys in info.keys():
-            for key in info[mainKeys].keys():
-                if isinstance(info[mainKeys][key], dict):
-                    try:
-                        ret[key] = info[mainKeys][key]['raw']
-                    except (KeyError, TypeError):
-                        pass
-                else:
-                    ret[key] = info[mainKeys][key]
+#==============================================================================
+# Prefetching
+#==============================================================================
 
-        return ret
+@st.cache_resource
+def start_prefetcher():
+    # Start the background prefetcher once per server process
+    return get_prefetcher()
 
 
 #==============================================================================
@@ -140,32 +116,33 @@ def render_header():
 # Sidebar
 #==============================================================================    
 
-def render_sidebar():
+@instrument('render.sidebar')
+def render_sidebar(state):
     # Add the ticker selection on the sidebar
     # Get the list of stock tickers 
-    global ticker_list
-    ticker_list = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')[0]['Symbol']
+    state.ticker_list = get_universe('sp500')['Symbol']
         
     # Create a dropdown to select a stock
-    global selected_stock
-    selected_stock = st.sidebar.selectbox("Select a ticker:", ticker_list)
+    selected_stock = st.sidebar.selectbox("Select a ticker:", state.ticker_list)
+    
+    # Count the view and prefetch the tickers likely to be selected next
+    if selected_stock != state.selected_stock:
+        start_prefetcher().record_view(selected_stock)
+    state.selected_stock = selected_stock
     
     # Function to fetch stock data
     def fetch_stock_data(stock_symbol, start_date, end_date):
-        stock_data = yf.download(stock_symbol, start=start_date, end=end_date)
+        stock_data = get_history(stock_symbol, start=start_date, end=end_date)
         return stock_data
     
     # Sidebar for date range selection
-    global start_date
-    global end_date
-    start_date = st.sidebar.date_input("Start Date", pd.to_datetime('2023-01-01'))
-    end_date = st.sidebar.date_input("End Date", pd.to_datetime('2023-10-01'))
+    state.start_date = st.sidebar.date_input("Start Date", pd.to_datetime('2023-01-01'))
+    state.end_date = st.sidebar.date_input("End Date", pd.to_datetime('2023-10-01'))
     
     # Button to fetch data
-    global update_button
-    update_button= st.sidebar.button("⟳")
-    if update_button:
-        stock_data = fetch_stock_data(selected_stock, start_date, end_date)
+    state.update_button = st.sidebar.button("⟳")
+    if state.update_button:
+        stock_data = fetch_stock_data(state.selected_stock, state.start_date, state.end_date)
         stock_data
         
         
@@ -173,40 +150,86 @@ def render_sidebar():
 # Tab 1
 #==============================================================================
 
-def render_tab1():
-  
+# Labels of the key statistics, on the Summary tab and in the screener
+key_stats_labels = {'previousClose'   : 'Previous Close',
+                    'open'            : 'Open',
+                    'bid'             : 'Bid',
+                    'ask'             : 'Ask',
+                    'dayLow'          : "Day's Range Low",
+                    'dayHigh'         : "Day's Range High",
+                    'fiftyTwoWeekLow' : '52 Week Range Low',
+                    'fiftyTwoWeekHigh': '52 Week Range High',
+                    'volume'          : 'Volume',
+                    'averageVolume'   : 'Average Volume',
+                    'marketCap'       : 'Market Cap',
+                    'beta'            : 'Beta (5Y Monthly)',
+                    'trailingPE'      : 'PE Ratio (TTM)',
+                    'trailingEps'     : 'EPS (TTM)',
+                    'dividendRate'    : 'Dividend Rate',
+                    'dividendYield'   : 'Dividend Yield',
+                    'targetMeanPrice' : '1y Target Est'}
+
+# Company information fields shown on the Summary tab, fetched as two
+# independent requests: the key statistics (screener.SCREENER_FIELDS) and the
+# profile
+profile_fields = ('address1', 'address2', 'city', 'state', 'zip', 'country', 'phone',
+                  'website', 'industry', 'sector', 'fullTimeEmployees',
+                  'longBusinessSummary', 'companyOfficers')
+
+# Time (seconds) each Summary section waits for its data before falling back
+summary_timeouts = {'stats': 10, 'history': 15, 'profile': 10, 'holders': 10}
+
+@st.cache_resource
+def get_summary_executor():
+    # Bounded pool shared by every session for the Summary tab fetches
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix='summary')
+
+
+def iter_completed(futures, timeouts):
+    """
+    This function yields (name, result, error) for each of the {name: future}
+    as soon as it completes, or with a TimeoutError once its timeout (in
+    seconds) has passed.
+    """
+    start = time.monotonic()
+    pending = dict(futures)
+    while pending:
+        elapsed = time.monotonic() - start
+        for name in [name for name in pending if elapsed >= timeouts[name]]:
+            del pending[name]
+            yield name, None, TimeoutError(f'no answer after {timeouts[name]} seconds')
+        if not pending:
+            break
+        
+        done, _ = wait(pending.values(), timeout=min(timeouts[name] for name in pending) - elapsed,
+                       return_when=FIRST_COMPLETED)
+        for name, future in list(pending.items()):
+            if future in done:
+                del pending[name]
+                try:
+                    yield name, future.result(), None
+                except Exception as error:
+                    yield name, None, error
+
+
+@st.fragment
+@instrument('render.tab1')
+def render_tab1(state):
+    # Read the inputs of the tab
+    selected_stock = state.selected_stock
+    
     # Get the company information
-    @st.cache_data
-    def GetCompanyInfo(ticker):
+    def GetCompanyInfo(ticker, fields):
         """
         This function get the company information from Yahoo Finance.
         """
-        return YFinance(ticker).info
+        return Fundamentals(ticker).get(fields=fields)
     
-    # If the ticker is already selected
-    if selected_stock != '':
-        # Get the company information in list format
-        info = GetCompanyInfo(selected_stock)
-        
-        
+    def render_key_stats(info):
         # Show some statistics as a DataFrame
-        st.write('**1. Key Statistics:**')
-        info_keys = {'previousClose':'Previous Close',
-                     'open'         :'Open',
-                     'bid'          :'Bid',
-                     'ask'          :'Ask',
-                     'dayLow'       : "Day's Range low" ,
-                     'dayHigh'      : "Day's Range High",
-                     'fiftyTwoWeekLow' : '52 Week Range Low',
-                     'fiftyTwoWeekHigh' : '52 Week Range High',
-                     'volume'       :'Volume',
-                     'averageVolume' : 'Average Volume',
-                     'marketCap'    :'Market Cap',
-                     'beta'         :'Beta (5Y Monthly)',
-                     'peRatio'      : 'PE Ratio (TTM)',
-                     'trailingEps'  : 'EPS (TTM)',
-                     'dividendYield' : 'Forward Dividend & Yield',	
-                     'targetMeanPrice': '1y Target Est'}
+        # The dividend rate is shown with the yield
+        info_keys = {key: label for key, label in key_stats_labels.items() if key != 'dividendRate'}
+        info_keys['dividendYield'] = 'Forward Dividend & Yield'
         
         #Create two columns layout
         col1, col2 = st.columns(2)          
@@ -222,36 +245,24 @@ def render_tab1():
         company_stats_right = {}
         for key in list(info_keys.keys())[len(info_keys) // 2:]:
             company_stats_right.update({info_keys[key]: info.get(key, 'Not Available')})
-        company_stats_right = pd.DataFrame({'Value': pd.Series(company_stats_right)})
+        company_stats_right = pd.DataFrame({'Value': pd.Series(company_stats_right, dtype=object)})
         
         # Format the 'Forward Dividend & Yield' column        
         dividend_rate = info.get('dividendRate', 'Not provided')         
         dividend_yield = info.get('dividendYield', 'Not provided')         
         dividend_yield_formatted = f'{dividend_rate} ({dividend_yield * 100:.2f}%)'        
-        company_stats_right['Value'].loc[company_stats_right.index == 'Forward Dividend & Yield'] = dividend_yield_formatted
+        company_stats_right.loc['Forward Dividend & Yield', 'Value'] = dividend_yield_formatted
         
         col2.table(company_stats_right) 
-        
-        
-        # Show the Chart
-        st.write('**2. Chart:**')
-        
-        #Create two columns layout
-        col1, col2 = st.columns(2) 
-        
-        # Create a list of duration options
-        range_options = ['1mo', '3mo', '6mo', 'ytd', '1y', '2y', '5y', '10y', 'max']
-        
-        # Create a selection box
-        time_range = col1.selectbox('Select a time range :', range_options)
-        
-        # Get historical data
-        historical_data = yf.Ticker(selected_stock).history(period=time_range)
+    
+    def render_chart(historical_data):
+        # Downsample the prices to the chart width
+        close_prices = downsample_series(historical_data['Close'])
         
         # Plot the selected chart type
         fig = go.Figure()
         
-        fig.add_trace(go.Scatter(x=historical_data.index, y=historical_data['Close'], mode='lines', name='Close Price'))
+        fig.add_trace(go.Scatter(x=close_prices.index, y=close_prices, mode='lines', name='Close Price'))
         
         # Update layout
         fig.update_layout(title=f'{selected_stock} Stock Price ({time_range.capitalize()})',
@@ -261,12 +272,8 @@ def render_tab1():
         
         # Show the chart
         st.plotly_chart(fig)    
-                           
-                    
-        
-        # Show the company description 
-        st.write('**3. Company Profile:**')
-        
+    
+    def render_profile(info):
         # Define keys
         info_keys1 = {'address1':'Address1',
                      'address2'         :'Address 2',
@@ -286,41 +293,203 @@ def render_tab1():
             company_profile.update({info_keys1[key]: info.get(key, 'Not Available')})
         company_profile = pd.DataFrame({'Information': pd.Series(company_profile)})
         st.table(company_profile)
-        
     
-        #Show shareholders
-        st.write('**4. Shareholders:**')
-        
-        shareholders= yf.Ticker(selected_stock).get_major_holders()
+    def render_shareholders(shareholders):
         shareholders_df = pd.DataFrame(shareholders)
-        shareholders_df
-
-        
-        # Business summary
-        st.write('**5. Business Summary:**')
-        
+        st.dataframe(shareholders_df)
+    
+    def render_business_summary(info):
         st.markdown('<div style="text-align: justify;">' + \
                     info['longBusinessSummary'] + \
                     '</div><br>',
                     unsafe_allow_html=True)
-        
-        st.write('**6. Executives:**')
+    
+    def render_executives(info):
         # Get the company officers
         company_officers = info["companyOfficers"]
-        # Get the company officers
         # Create a DataFrame with only the desired columns
         desired_columns = ['name', 'age', 'title'] 
         company_officers_df = pd.DataFrame(company_officers)[desired_columns]
-        company_officers_df
+        st.dataframe(company_officers_df)
+    
+    # If the ticker is already selected
+    if selected_stock != '':
+        # Start every independent fetch at once
+        executor = get_summary_executor()
+        futures = {'stats'  : executor.submit(GetCompanyInfo, selected_stock, SCREENER_FIELDS),
+                   'profile': executor.submit(GetCompanyInfo, selected_stock, profile_fields),
+                   'holders': executor.submit(get_major_holders, selected_stock)}
+        
+        # Lay out the sections, each filled in as soon as its data arrives
+        st.write('**1. Key Statistics:**')
+        key_stats_section = st.empty()
+        
+        st.write('**2. Chart:**')
+        
+        #Create two columns layout
+        col1, col2 = st.columns(2) 
+        
+        # Create a list of duration options
+        range_options = ['1mo', '3mo', '6mo', 'ytd', '1y', '2y', '5y', '10y', 'max']
+        
+        # Create a selection box
+        time_range = col1.selectbox('Select a time range :', range_options)
+        
+        # Get historical data
+        futures['history'] = executor.submit(get_history, selected_stock, period=time_range)
+        chart_section = st.empty()
+        
+        st.write('**3. Company Profile:**')
+        profile_section = st.empty()
+        
+        st.write('**4. Shareholders:**')
+        shareholders_section = st.empty()
+        
+        st.write('**5. Business Summary:**')
+        business_summary_section = st.empty()
+        
+        st.write('**6. Executives:**')
+        executives_section = st.empty()
+        
+        # Sections drawn from the data of each fetch
+        sections = {'stats'  : [(key_stats_section, render_key_stats)],
+                    'history': [(chart_section, render_chart)],
+                    'profile': [(profile_section, render_profile),
+                                (business_summary_section, render_business_summary),
+                                (executives_section, render_executives)],
+                    'holders': [(shareholders_section, render_shareholders)]}
+        for section in sections.values():
+            for placeholder, _ in section:
+                placeholder.caption('Loading...')
+        
+        for name, data, error in iter_completed(futures, summary_timeouts):
+            for placeholder, render in sections[name]:
+                if error is None:
+                    try:
+                        with placeholder.container():
+                            render(data)
+                        continue
+                    except Exception as render_error:
+                        error = render_error
+                placeholder.warning(f'Not available right now ({error}).')
             
       
 #==============================================================================
 # Tab 2
 #==============================================================================
 
-def render_tab2():
+def zoom_history(historical_data, candlestick, key):
+    """
+    This function lets the user zoom on a part of a history too long to be
+    drawn at full resolution.
+    """
+    max_points = CHART_WIDTH // CANDLE_PIXELS if candlestick else CHART_WIDTH
+    if len(historical_data) <= max_points:
+        return historical_data
+    
+    dates = historical_data.index.to_pydatetime()
+    zoom = st.slider('Zoom:', min_value=dates[0], max_value=dates[-1],
+                     value=(dates[0], dates[-1]), format='YYYY-MM-DD', key=key)
+    return historical_data.loc[zoom[0]:zoom[1]]
+
+
+# Indicators available on the chart
+indicator_options = {'SMA 20'         : ('SMA', {'window': 20}),
+                     'SMA 50'         : ('SMA', {'window': 50}),
+                     'SMA 200'        : ('SMA', {'window': 200}),
+                     'EMA 20'         : ('EMA', {'window': 20}),
+                     'EMA 50'         : ('EMA', {'window': 50}),
+                     'Bollinger Bands': ('Bollinger', {}),
+                     'VWAP'           : ('VWAP', {}),
+                     'RSI'            : ('RSI', {}),
+                     'MACD'           : ('MACD', {})}
+
+def add_indicator_traces(fig, indicator_data):
+    """
+    This function draws indicators on a price chart, the overlays on the price
+    axis and each oscillator on its own panel below the chart.
+    """
+    oscillator_axes = {}
+    for column in indicator_data.columns:
+        oscillator = next((name for name in OSCILLATORS if column.startswith(name)), None)
+        if oscillator is None:
+            fig.add_trace(go.Scatter(x=indicator_data.index, y=indicator_data[column], mode='lines',
+                                     name=column, yaxis='y1'))
+            continue
+        
+        axis = oscillator_axes.setdefault(oscillator, f"y{len(oscillator_axes) + 3}")
+        if column == 'MACD histogram':
+            fig.add_trace(go.Bar(x=indicator_data.index, y=indicator_data[column], name=column, yaxis=axis))
+        else:
+            fig.add_trace(go.Scatter(x=indicator_data.index, y=indicator_data[column], mode='lines',
+                                     name=column, yaxis=axis))
+    
+    if oscillator_axes:
+        # Stack the oscillator panels under the price and volume axes
+        panel_height = 0.2
+        price_domain = [panel_height * len(oscillator_axes), 1]
+        fig.update_layout(yaxis=dict(domain=price_domain), yaxis2=dict(domain=price_domain),
+                          xaxis=dict(anchor=list(oscillator_axes.values())[0]),
+                          height=450 + 150 * len(oscillator_axes))
+        for i, (name, axis) in enumerate(oscillator_axes.items()):
+            fig.update_layout({f"yaxis{axis[1:]}": dict(title=name, anchor='x',
+                                                          domain=[panel_height * i, panel_height * (i + 1) - 0.04])})
+
+
+# Refresh period of the live chart, in seconds
+live_refresh_seconds = 15
+
+@st.fragment(run_every=live_refresh_seconds)
+def render_live_chart(ticker, interval, viewer):
+    """
+    This function draws the live chart from the bars buffered by the poller
+    shared by every session watching the ticker.
+    """
+    poller = get_poller(ticker, interval, viewer, poll_seconds=live_refresh_seconds)
+    live_data = poller.buffer.frame()
+    
+    if live_data.empty:
+        st.info(f'Waiting for the first {interval} bars of {ticker}...')
+        return
+    
+    # Plot the buffered bars
+    fig = go.Figure(data=[go.Candlestick(x=live_data.index,
+                                         open=live_data['Open'],
+                                         high=live_data['High'],
+                                         low=live_data['Low'],
+                                         close=live_data['Close'], yaxis='y1')])
+    fig.add_trace(go.Bar(x=live_data.index, y=live_data['Volume'], name='Volume', yaxis='y2'))
+    
+    # Update layout
+    fig.update_layout(title=f'{ticker} Live ({interval})',
+                     xaxis_title='Time',
+                     xaxis_rangeslider_visible=False,
+                     yaxis=dict(title='Price', side='left'),
+                     yaxis2=dict(title='Volume', side='right', overlaying='y'))
+    
+    # Show the chart
+    st.plotly_chart(fig)
+    st.caption(f'Last bar: {live_data.index[-1]} | watched by {poller.viewers()} session(s)')
+    if poller.last_error is not None:
+        st.warning(f'Live update failed: {poller.last_error}')
+
+
+@st.fragment
+@instrument('render.tab2')
+def render_tab2(state):
+    # Read the inputs of the tab
+    selected_stock = state.selected_stock
+    start_date = state.start_date
+    end_date = state.end_date
+    update_button = state.update_button
+    
+    # Show the live intraday chart instead of the history
+    live_mode = st.toggle('Live (intraday)')
+    if live_mode:
+        live_interval = st.selectbox('Select a live interval:', list(LIVE_INTERVALS))
+        render_live_chart(selected_stock, live_interval, state.viewer_id)
+        return
     
-
     #Create two columns layout
     col1, col2, col3 = st.columns(3) 
     
@@ -343,11 +512,24 @@ def render_tab2():
     # Create a selection box
     chart_type = col3.selectbox('Select a Chart Type :', chart_options)
     
+    # Select the indicators to draw
+    selected_indicators = st.multiselect('Select indicators:', list(indicator_options))
+    indicators = [indicator_options[option] for option in selected_indicators]
+    
     
     # Plot based on the selected period    
     if update_button:
         # Get historical data based on user inputs
-        historical_data = yf.Ticker(selected_stock).history(period=end_date-start_date, interval=time_interval, start=start_date, end=end_date)
+        historical_data = get_history(selected_stock, start=start_date, end=end_date, interval=time_interval)
+        
+        # Compute the indicators on the whole history
+        indicator_data = compute_indicators(selected_stock, time_interval, historical_data, indicators)
+        
+        # Zoom on a part of the history and downsample it to the chart width
+        candlestick = chart_type == 'Candlestick Chart'
+        historical_data = zoom_history(historical_data, candlestick,
+                                       key=f'zoom_{selected_stock}_{start_date}_{end_date}_{time_interval}')
+        historical_data = downsample_ohlcv(historical_data, candlestick)
         
         # Plot the selected chart type
         fig = go.Figure()
@@ -372,12 +554,30 @@ def render_tab2():
                          yaxis=dict(title='Close Price', side='left'),
                          yaxis2=dict(title='Volume', side='right', overlaying='y'))
         
+        # Draw the indicators on the bars shown
+        add_indicator_traces(fig, indicator_data.reindex(historical_data.index))
+        
         # Show the chart
         st.plotly_chart(fig) 
+        
+        # Export the whole history, not only the bars shown
+        export_button('Download the history',
+                      lambda: history_frames([selected_stock], start=start_date, end=end_date,
+                                             interval=time_interval),
+                      f'{selected_stock}_{start_date}_{end_date}_{time_interval}', key='export_history')
     
     elif time_range1:
         # Get historical data based on user inputs
-        historical_data = yf.Ticker(selected_stock).history(period=time_range1, interval=time_interval)
+        historical_data = get_history(selected_stock, period=time_range1, interval=time_interval)
+        
+        # Compute the indicators on the whole history
+        indicator_data = compute_indicators(selected_stock, time_interval, historical_data, indicators)
+        
+        # Zoom on a part of the history and downsample it to the chart width
+        candlestick = chart_type == 'Candlestick Chart'
+        historical_data = zoom_history(historical_data, candlestick,
+                                       key=f'zoom_{selected_stock}_{time_range1}_{time_interval}')
+        historical_data = downsample_ohlcv(historical_data, candlestick)
         
         # Plot the selected chart type
         fig = go.Figure()
@@ -401,15 +601,28 @@ def render_tab2():
                          yaxis=dict(title='Close Price', side='left'),
                          yaxis2=dict(title='Volume', side='right', overlaying='y'))
         
+        # Draw the indicators on the bars shown
+        add_indicator_traces(fig, indicator_data.reindex(historical_data.index))
+        
         # Show the chart
         st.plotly_chart(fig) 
         
+        # Export the whole history, not only the bars shown
+        export_button('Download the history',
+                      lambda: history_frames([selected_stock], period=time_range1, interval=time_interval),
+                      f'{selected_stock}_{time_range1}_{time_interval}', key='export_history')
+        
            
 #==============================================================================
 # Tab 3
 #==============================================================================
 
-def render_tab3():
+@st.fragment
+@instrument('render.tab3')
+def render_tab3(state):
+    # Read the inputs of the tab
+    selected_stock = state.selected_stock
+    ticker_list = state.ticker_list
     
     #Create two columns layout
     col1, col2 = st.columns(2)
@@ -426,123 +639,351 @@ def render_tab3():
     # Create a selection box for the period
     period = col2.selectbox('Select a Period:', period_options)
 
-    # Fetch financial data based on user inputs
-    if financial_statement == 'Income Statement':
-        financial_data = yf.Ticker(selected_stock).get_income_stmt(pretty=True, freq=period.lower())
-    elif financial_statement == 'Balance Sheet':
-        financial_data = yf.Ticker(selected_stock).get_balance_sheet(pretty=True, freq=period.lower())
-    elif financial_statement == 'Cash Flow':
-        financial_data = yf.Ticker(selected_stock).get_cash_flow(pretty=True, freq=period.lower())
+    # Fetch financial data based on user inputs (all statements are loaded
+    # and cached together)
+    financial_data = load_statements(selected_stock)[(financial_statement, period.lower())]
 
     # Display financial data
     st.write(f'**{selected_stock} {financial_statement} ({period}):**')
     st.write(financial_data)
 
+    # Compare a line item with peer companies
+    st.write('**Peer Comparison:**')
+    peers = st.multiselect('Select peers:', ticker_list)
+
+    if peers and not financial_data.empty:
+        item = st.selectbox('Select a line item:', financial_data.index)
+        panel, errors = statements_panel([selected_stock] + peers,
+                                         statements=[financial_statement],
+                                         periods=[period.lower()])
+        peer_data = panel[panel['item'] == item].pivot(index='date', columns='ticker', values='value')
+        st.write(peer_data.sort_index(ascending=False))
+        if errors:
+            st.warning(f"Financial statements not available for: {', '.join(errors)}")
+
+    # Export every statement of the stock and of its peers
+    export_button('Download the statements',
+                  lambda: statement_frames([selected_stock] + peers),
+                  f"{'_'.join([selected_stock] + peers)}_statements", key='export_statements')
+
 
 #==============================================================================
 # Tab 4
 #==============================================================================
 
-def render_tab4():
+@st.fragment
+@instrument('render.tab4')
+def render_tab4(state):
+    # Read the inputs of the tab
+    selected_stock = state.selected_stock
+    ticker_list = state.ticker_list
     
     st.write('**Monte Carlo Simulation**')
     
+    # Simulate a single stock or a portfolio of correlated stocks
+    mode = st.radio('Simulate:', ['Single stock', 'Portfolio'], horizontal=True)
+    
     # Create three columns layout
     col1, col2, col3 = st.columns(3)
 
     # Dropdown for the number of simulations
-    num_simulations_options = [200, 500, 1000]
+    num_simulations_options = [200, 500, 1000, 10000, 100000]
     num_simulations = col1.selectbox('Number of Simulations:', num_simulations_options)
 
     # Dropdown for the time horizon
     time_horizon_options = [30, 60, 90]
     time_horizon = col2.selectbox('Time Horizon (days):', time_horizon_options)
 
+    if mode == 'Single stock':
+        # Dropdown for the simulation model
+        model_options = {'Normal returns (GBM)': 'gbm', 'Historical bootstrap': 'bootstrap'}
+        model = col3.selectbox('Model:', list(model_options))
+    else:
+        # Dropdown for the history used to estimate the covariance matrix
+        lookback_options = {'6 months': '6mo', '1 year': '1y', '2 years': '2y', '5 years': '5y'}
+        lookback = col3.selectbox('Lookback:', list(lookback_options), index=1)
+        
+        # Stocks and weights of the portfolio
+        portfolio_stocks = st.multiselect('Select the stocks of the portfolio:', ticker_list,
+                                          default=[selected_stock] if selected_stock else [])
+        weights = st.data_editor(pd.DataFrame({'Stock': portfolio_stocks,
+                                               'Weight': [1.0] * len(portfolio_stocks)}),
+                                 disabled=['Stock'], hide_index=True,
+                                 key=f"weights_{'_'.join(portfolio_stocks)}")
+        portfolio_value = col2.number_input('Portfolio value ($):', min_value=1.0, value=10000.0, step=1000.0)
+        use_all_cores = col3.checkbox('Use all CPU cores')
+
+    # Seed of the random generator, to reproduce a simulation
+    seed = col1.number_input('Seed:', min_value=0, value=42, step=1)
+
     # Button to trigger the simulation
     simulate_button = col3.button("Simulate")
 
-    if simulate_button:
-        # Get historical data
-        historical_data = yf.Ticker(selected_stock).history(period=f"{time_horizon}d")
-
-        # Calculate daily returns
-        returns = historical_data['Close'].pct_change().dropna()
-
-        # Calculate standard deviation of returns
-        volatility = returns.std()
-        
-        simulated_df = pd.DataFrame()
-
-        for r in range(num_simulations):
-        
-            stock_price_list = []
-            current_price = historical_data['Close'][-1]
-        
-            for i in range(time_horizon):
+    if simulate_button and mode == 'Single stock':
+        # Simulate every path at once from the daily returns of the stock
+        with timed('simulation.paths'):
+            try:
+                last_price, returns, simulated_paths = simulate_stock(selected_stock, num_simulations,
+                                                                      time_horizon, model=model_options[model],
+                                                                      seed=int(seed))
+            except ValueError as error:
+                st.warning(str(error))
+                return
+
+        # Display a sample of the paths in Streamlit
+        max_plotted_paths = 200
+        simulated_df = pd.DataFrame(simulated_paths[:max_plotted_paths].T,
+                                    columns=[f"Sim{r}" for r in range(min(num_simulations, max_plotted_paths))])
+        st.line_chart(simulated_df)
+        if num_simulations > max_plotted_paths:
+            st.caption(f"Showing {max_plotted_paths} of {num_simulations} simulated paths.")
+
+        # Calculate VaR and CVaR at several confidence levels
+        risk = value_at_risk(simulated_paths[:, -1], last_price)
+        st.write(f"**Value at Risk at 95% confidence interval: {risk[0.95]['VaR']}**")
+        risk_df = pd.DataFrame(risk).T
+        risk_df.index = [f"{level:.0%}" for level in risk_df.index]
+        st.table(risk_df)
         
-                # Generate daily return
-                daily_return = np.random.normal(0, volatility, 1)[0]
+        # Export every path, simulated again chunk by chunk from the same seed
+        export_button('Download the simulated paths',
+                      lambda: path_frames(last_price, returns, num_simulations, time_horizon,
+                                          model=model_options[model], seed=int(seed)),
+                      f'{selected_stock}_simulations_{seed}', key='export_paths')
+    
+    elif simulate_button and mode == 'Portfolio':
+        if not portfolio_stocks:
+            st.warning('Select at least one stock for the portfolio.')
+            return
         
-                # Calculate the stock price of next day
-                future_price = current_price * (1 + daily_return)
+        # Simulate from the daily returns over the lookback, on the days every stock traded
+        with timed('simulation.portfolio'):
+            try:
+                simulation = portfolio_simulation(portfolio_stocks, weights['Weight'].to_numpy(),
+                                                  lookback_options[lookback], num_simulations, time_horizon,
+                                                  portfolio_value=portfolio_value, seed=int(seed),
+                                                  workers=os.cpu_count() if use_all_cores else None)
+            except ValueError as error:
+                st.warning(str(error))
+                return
         
-                # Save the results
-                stock_price_list.append(future_price)
+        # Distribution of the profit and loss of the portfolio
+        fig = go.Figure(go.Histogram(x=simulation['pnl'], nbinsx=100))
+        fig.update_layout(title=f'Portfolio profit and loss in {time_horizon} days',
+                          xaxis_title='Profit and loss ($)', yaxis_title='Simulations')
+        st.plotly_chart(fig)
         
-                # Change the current price
-                current_price = future_price
-                
-            # Store the simulation results
-            simulated_col = pd.Series(stock_price_list)
-            simulated_col.name = "Sim" + str(r)
-            simulated_df = pd.concat([simulated_df, simulated_col], axis=1)
+        # VaR and CVaR of the portfolio at several confidence levels
+        risk = simulation['risk']
+        st.write(f"**Portfolio Value at Risk at 95% confidence interval: {risk[0.95]['VaR']:,.2f} $**")
+        risk_df = pd.DataFrame(risk).T
+        risk_df.index = [f"{level:.0%}" for level in risk_df.index]
+        st.table(risk_df)
         
-       
-            
-        # Display the plot in Streamlit
-        st.line_chart(simulated_df)
-
-        # Calculate VaR at 95% confidence interval
-        ValueatRisk = np.percentile(simulated_df.iloc[-1, ], 5) - historical_data['Close'][-1]
-        st.write(f"**Value at Risk at 95% confidence interval: {ValueatRisk}**")
+        # Contribution of each stock to the CVaR
+        st.write('**CVaR contribution of each stock:**')
+        contributions = simulation['contributions']
+        contributions.columns = [f"{level:.0%}" for level in contributions.columns]
+        st.table(contributions)
 
 
 #==============================================================================
 # Tab 5
 #==============================================================================
 
-def render_tab5():
+@st.fragment
+@instrument('render.tab5')
+def render_tab5(state):
+    # Read the inputs of the tab
+    ticker_list = state.ticker_list
+    start_date = state.start_date
+    end_date = state.end_date
     
-   
     st.write("**Financial Analysis**")
     
     #Display stock comparison
     st.write("**Stock Comparison**")
     selected_stocks_comparison = st.multiselect("Select stocks for comparison:", ticker_list)
     
+    # Create a selection box
+    comparison_metric = st.selectbox('Select a comparison:', COMPARISONS)
+    
     if selected_stocks_comparison:
-        comparison_data = yf.download(selected_stocks_comparison, start=start_date, end=end_date)['Close']
+        comparison_data = close_matrix(selected_stocks_comparison, start=start_date, end=end_date)
         
-        # Plot stock prices for comparison
+        # Compute the selected comparison on all the stocks at once (the
+        # Rolling Beta is against the S&P 500 index)
+        comparison_values = compare_stocks(comparison_data, comparison_metric, start_date, end_date)
+        
+        # Plot the comparison
         fig_comparison = go.Figure()
         
         for stock in selected_stocks_comparison:
-            fig_comparison.add_trace(go.Scatter(x=comparison_data.index, y=comparison_data[stock], mode='lines', name=stock))
+            # Downsample the values to the chart width
+            stock_values = downsample_series(comparison_values[stock])
+            fig_comparison.add_trace(go.Scatter(x=stock_values.index, y=stock_values, mode='lines', name=stock))
         
         # Update layout
-        fig_comparison.update_layout(title='Stock Comparison',
+        fig_comparison.update_layout(title=f'Stock Comparison ({comparison_metric})',
                                      xaxis_title='Date',
-                                     yaxis_title='Stock Price',
+                                     yaxis_title=comparison_metric,
                                      xaxis_rangeslider_visible=False)
         
         # Show the chart
         st.plotly_chart(fig_comparison)
+        
+        # Export the comparison values
+        export_button('Download the comparison',
+                      lambda: frame_chunks(comparison_values.rename_axis('Date').reset_index()),
+                      f"{'_'.join(selected_stocks_comparison)}_{comparison_metric.replace(' ', '_')}",
+                      key='export_comparison')
+        
+        # Show the summary of the comparison
+        st.write("**Returns and Risk**")
+        st.table(comparison_summary(comparison_data))
+        
+        # Show the correlation of the daily returns
+        st.write("**Correlation of Daily Returns**")
+        returns_correlation = correlation(comparison_data)
+        fig_correlation = go.Figure(data=go.Heatmap(z=returns_correlation.to_numpy(),
+                                                    x=returns_correlation.columns,
+                                                    y=returns_correlation.index,
+                                                    zmin=-1, zmax=1, colorscale='RdBu'))
+        st.plotly_chart(fig_correlation)
+
+        # Get the key statistics of every selected stock at once
+        st.write("**Key Statistics**")
+        comparison_keys = {'marketCap'    : 'Market Cap',
+                           'beta'         : 'Beta (5Y Monthly)',
+                           'trailingPE'   : 'PE Ratio (TTM)',
+                           'trailingEps'  : 'EPS (TTM)',
+                           'dividendYield': 'Dividend Yield'}
+        infos, errors = YFinance.info_many(selected_stocks_comparison,
+                                           modules=('summaryDetail', 'defaultKeyStatistics'))
+        comparison_stats = pd.DataFrame({stock: {comparison_keys[key]: infos[stock].get(key, 'Not Available')
+                                                 for key in comparison_keys}
+                                         for stock in selected_stocks_comparison if stock in infos})
+        st.table(comparison_stats)
+        if errors:
+            st.warning(f"Key statistics not available for: {', '.join(errors)}")
+        
+        # Build a report of the selected stocks in the background
+        st.write("**Report**")
+        col1, col2 = st.columns(2, vertical_alignment='bottom')
+        report_format = col1.radio('Report format:', ['HTML', 'PDF'], horizontal=True)
+        if col2.button('Build report'):
+            state.report_id = start_report(selected_stocks_comparison, start_date, end_date, report_format).id
+        render_report_status(state)
+
+
+@st.fragment(run_every=2)
+def wait_for_report(job):
+    # Poll the report being built, and show it once it is done
+    if job.done:
+        st.rerun()
+    st.progress(job.progress, text=f'Building the {job.fmt} report of {len(job.tickers)} stocks...')
+
+
+def render_report_status(state):
+    job = get_report(state.report_id) if state.report_id else None
+    if job is None:
+        return
+    
+    if not job.done:
+        wait_for_report(job)
+    elif job.error is not None:
+        st.warning(f'The report could not be built: {job.error}')
+    else:
+        extension = 'pdf' if job.fmt == 'PDF' else 'html'
+        st.download_button(f'Download the {job.fmt} report', data=lambda: open(job.path, 'rb'),
+                           file_name=f"{'_'.join(job.tickers)}_report.{extension}",
+                           mime='application/pdf' if job.fmt == 'PDF' else 'text/html',
+                           on_click='ignore', key=f'report_{job.id}')
+
+    
+#==============================================================================
+# Tab 6
+#==============================================================================
+
+@st.fragment(run_every=5)
+def wait_for_snapshot(universe):
+    # Show the screener once the snapshot is built in the background
+    if get_snapshot(universe) is not None:
+        st.rerun()
+    if not is_refreshing(universe):
+        st.warning('The statistics could not be loaded, they will be loaded again in a few minutes.')
+
 
+@st.fragment
+@instrument('render.tab6')
+def render_tab6(state):
+    st.write('**Stock Screener**')
+    
+    # Statistics of every stock of the S&P 500, built in the background the
+    # first time
+    cached = get_snapshot('sp500')
+    if cached is None:
+        st.info('Loading the statistics of every stock, the screener will show up when they are ready.')
+        wait_for_snapshot('sp500')
+        return
+    snapshot_time, snapshot = cached
+    st.caption(f"Statistics of {len(snapshot)} stocks as of "
+               f"{pd.Timestamp(snapshot_time, unit='s'):%Y-%m-%d %H:%M} UTC.")
+    
+    # Create two columns layout
+    col1, col2 = st.columns(2)
+    
+    # Select the sectors and the statistics to filter on
+    sectors = col1.multiselect('Select sectors:', sorted(snapshot['Sector'].dropna().unique()))
+    filter_fields = col2.multiselect('Filter on:', SCREENER_FIELDS, format_func=key_stats_labels.get)
+    
+    # Range of each filtered statistic (no bound when empty)
+    conditions = []
+    for field in filter_fields:
+        col_min, col_max = st.columns(2)
+        minimum = col_min.number_input(f'{key_stats_labels[field]} min:', value=None, format='%g')
+        maximum = col_max.number_input(f'{key_stats_labels[field]} max:', value=None, format='%g')
+        if minimum is not None:
+            conditions.append((field, '>=', minimum))
+        if maximum is not None:
+            conditions.append((field, '<=', maximum))
+    
+    # Sort the matching stocks
+    col1, col2 = st.columns(2)
+    sort_by = col1.selectbox('Sort by:', SCREENER_FIELDS, index=SCREENER_FIELDS.index('marketCap'),
+                             format_func=key_stats_labels.get)
+    descending = col2.checkbox('Descending', value=True)
     
+    # Filter and sort the snapshot in memory
+    result = screen(snapshot, conditions, sectors, sort_by=sort_by, ascending=not descending)
+    st.write(f'**{len(result)} stocks match.**')
+    st.dataframe(result.rename(columns=key_stats_labels), hide_index=True)
+
+    
+#==============================================================================
+# Debug panel
+#==============================================================================
+
+def render_debug_panel():
+    # Show the timings of the fetches, transforms and renders
+    if st.sidebar.checkbox('Show timings'):
+        timings = pd.DataFrame(metrics.summary()).T
+        st.sidebar.dataframe(timings[['count', 'p50', 'p95', 'bytes', 'hits', 'misses', 'rows']])
+        
+        # Show the progress of the background prefetcher
+        progress = start_prefetcher().progress()
+        st.sidebar.caption(f"Prefetch: {progress['warmed']} tickers warmed, {progress['queued']} queued, "
+                           f"{progress['done']} loads done, {progress['failed']} failed"
+                           + (f", warming {progress['current']}" if progress['current'] else ''))
+
+
 #==============================================================================
 # Main body
 #==============================================================================
 
+# Start measuring the page
+page_start = time.perf_counter()
+
 # Render the page title
 render_page_title()
 
@@ -550,20 +991,34 @@ render_page_title()
 render_header()
 
 # Render the sidebar
-render_sidebar()
+app_state = get_app_state()
+render_sidebar(app_state)
 
 # Render the tabs
-tab1, tab2, tab3, tab4, tab5 = st.tabs(["Summary", "Chart", "Financials", "Monte Carlo simulation", "Analysis"])
+tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["Summary", "Chart", "Financials", "Monte Carlo simulation", "Analysis",
+                                              "Screener"])
 with tab1:
-    render_tab1()
+    render_tab1(app_state)
 with tab2:
-    render_tab2()
+    render_tab2(app_state)
 with tab3:
-    render_tab3()
+    render_tab3(app_state)
 with tab4:
-    render_tab4()
+    render_tab4(app_state)
 with tab5:
-    render_tab5()
+    render_tab5(app_state)
+with tab6:
+    render_tab6(app_state)
+
+# Record the page latency and export the metrics
+metrics.record('render.page', time.perf_counter() - page_start)
+if METRICS_DIR:
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    metrics.export_jsonl(os.path.join(METRICS_DIR, 'metrics.jsonl'))
+    metrics.export_prometheus(os.path.join(METRICS_DIR, 'metrics.prom'))
+
+# Render the debug panel
+render_debug_panel()
     
 
 ###############################################################################
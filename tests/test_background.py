@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the background refreshes.
+"""
+
+import os
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from background import BackgroundRefresh, save_atomically
+
+
+def wait_for(refresh, key):
+    for thread in threading.enumerate():
+        if thread.name == f"{refresh.name}-{key}":
+            thread.join()
+
+
+def test_one_refresh_at_a_time():
+    release = threading.Event()
+    calls = []
+
+    def function(key):
+        calls.append(key)
+        release.wait()
+
+    refresh = BackgroundRefresh(function, 'test')
+    assert refresh.start('a')
+    assert not refresh.start('a')
+    assert refresh.is_running('a')
+    assert refresh.start('b')
+
+    release.set()
+    wait_for(refresh, 'a')
+    wait_for(refresh, 'b')
+    assert not refresh.is_running('a')
+    assert sorted(calls) == ['a', 'b']
+
+
+def test_failed_refresh_is_not_retried_before_retry_after():
+    calls = []
+
+    def function(key):
+        calls.append(key)
+        if len(calls) == 1:
+            raise ConnectionError("down")
+
+    refresh = BackgroundRefresh(function, 'test', retry_after=3600)
+    refresh.start('a')
+    wait_for(refresh, 'a')
+    assert not refresh.start('a')
+
+    refresh.retry_after = 0
+    assert refresh.start('a')
+    wait_for(refresh, 'a')
+    assert len(calls) == 2
+
+    # A successful refresh can be started again at once
+    refresh.retry_after = 3600
+    assert refresh.start('a')
+    wait_for(refresh, 'a')
+
+
+def test_save_atomically(tmp_path):
+    path = str(tmp_path / 'dir' / 'file.txt')
+    save_atomically(path, lambda temporary_path: Path(temporary_path).write_text('data'))
+    assert Path(path).read_text() == 'data'
+    assert os.listdir(tmp_path / 'dir') == ['file.txt']
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the two-tier cache, with a failing backend.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import Cache
+
+
+class DownBackend:
+    """
+    Backend whose server is down.
+    """
+
+    def get(self, key):
+        raise ConnectionError("down")
+
+    def set(self, key, value, ttl):
+        raise ConnectionError("down")
+
+    def delete(self, key):
+        raise ConnectionError("down")
+
+    def clear(self):
+        raise ConnectionError("down")
+
+
+def test_failed_load_releases_its_lock():
+    cache = Cache(1 << 20)
+
+    def loader():
+        raise ValueError("no data")
+
+    with pytest.raises(ValueError):
+        cache.get_or_load('key', loader, ttl=60)
+    assert cache._locks == {}
+
+    assert cache.get_or_load('key', lambda: 1, ttl=60) == 1
+    assert cache._locks == {}
+
+
+def test_failed_loads_do_not_overlap():
+    cache = Cache(1 << 20)
+    loading = []
+    overlaps = []
+
+    def loader():
+        loading.append(1)
+        overlaps.append(len(loading) > 1)
+        time.sleep(0.05)
+        loading.pop()
+        raise ValueError("no data")
+
+    def load():
+        with pytest.raises(ValueError):
+            cache.get_or_load('key', loader, ttl=60)
+
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+
+    assert len(overlaps) == 8 and not any(overlaps)
+    assert cache._locks == {}
+
+
+def test_backend_errors_are_not_raised():
+    cache = Cache(1 << 20, DownBackend())
+    cache.set('key', 1, ttl=60)
+    assert cache.get('key') == (True, 1)
+
+    cache.delete('key')
+    assert cache.get('key') == (False, None)
+    cache.clear()
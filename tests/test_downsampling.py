@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the downsampling of the charts.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downsampling import downsample_ohlcv
+
+
+@pytest.fixture
+def history():
+    rng = np.random.default_rng(0)
+    close = 100 + rng.normal(0, 1, 5000).cumsum()
+    return pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close,
+                         'Volume': rng.integers(1000, 2000, 5000).astype(float)},
+                        index=pd.date_range('2000-01-01', periods=5000, freq='D'))
+
+
+@pytest.mark.parametrize('candlestick', [False, True])
+def test_volume_is_summed(history, candlestick):
+    sampled = downsample_ohlcv(history, candlestick, width=400)
+    assert len(sampled) <= 400
+    assert sampled['Volume'].sum() == history['Volume'].sum()
+
+
+def test_short_history_is_unchanged(history):
+    short = history.iloc[:100]
+    pd.testing.assert_frame_equal(downsample_ohlcv(short, width=400), short)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the fundamentals client, with a fake Yahoo session.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yahoo_finance
+from cache import Cache
+from yahoo_finance import Fundamentals, FundamentalsRecord
+
+
+class FakeSession:
+    """
+    Yahoo session answering quoteSummary requests from fixed modules.
+    """
+
+    summary = {'summaryDetail': {'trailingPE': 'Infinity', 'forwardPE': {'raw': 21.5},
+                                 'marketCap': {'raw': 3000000000}},
+               'financialData': {'recommendationKey': 'buy', 'currentPrice': {}},
+               'assetProfile'  : {'sector': 'Technology', 'companyOfficers': []}}
+
+    def __init__(self):
+        self.requests = []
+
+    def quote_summary(self, ticker, modules):
+        self.requests.append(tuple(modules))
+        return {module: self.summary[module] for module in modules}
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = FakeSession()
+    cache = Cache(10 ** 6)
+    monkeypatch.setattr(yahoo_finance, 'get_session', lambda: session)
+    monkeypatch.setattr(yahoo_finance, 'get_cache', lambda: cache)
+    return session
+
+
+def test_record_is_typed(session):
+    record = Fundamentals('AAPL').get(fields=['trailingPE', 'forwardPE', 'marketCap',
+                                              'recommendationKey', 'currentPrice'])
+    assert isinstance(record, FundamentalsRecord)
+    assert record.ticker == 'AAPL'
+    assert record == {'forwardPE': 21.5, 'marketCap': 3000000000, 'recommendationKey': 'buy'}
+
+
+def test_modules_are_fetched_once(session):
+    Fundamentals('AAPL').get(fields=['forwardPE'])
+    Fundamentals('AAPL').get(fields=['forwardPE', 'sector'])
+    assert session.requests == [('summaryDetail',), ('assetProfile',)]
+
+
+def test_unknown_fields_are_rejected(session):
+    with pytest.raises(KeyError):
+        Fundamentals('AAPL').get(fields=['peRatio'])
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the technical indicators engine.
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indicators import INDICATORS, IndicatorEngine, compute_indicators
+
+
+def bars(count, seed=0):
+    close = 100 + np.cumsum(np.random.default_rng(seed).normal(size=count))
+    return pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close,
+                         'Volume': 1e6}, index=pd.bdate_range('2024-01-01', periods=count))
+
+
+@pytest.fixture
+def frame():
+    return bars(300)
+
+
+def rolling_reference(close, window):
+    # Window statistics of the valid values, missing until the window is full
+    rolling = close.rolling(window, min_periods=1)
+    mean, std = rolling.mean().to_numpy().copy(), rolling.std(ddof=0).to_numpy().copy()
+    mean[:window - 1] = std[:window - 1] = np.nan
+    return mean, std
+
+
+def test_missing_close_only_affects_its_windows(frame):
+    frame.loc[frame.index[100], 'Close'] = np.nan
+    engine = IndicatorEngine()
+    engine.update(frame)
+
+    mean, std = rolling_reference(frame['Close'], 20)
+    sma = engine.indicator('SMA')['SMA(20)']
+    bollinger = engine.indicator('Bollinger')
+    assert np.allclose(sma, mean, equal_nan=True)
+    assert np.allclose(bollinger['Bollinger upper(20, 2)'], mean + 2 * std, equal_nan=True)
+    assert np.isfinite(sma[-1]) and np.isfinite(bollinger['Bollinger lower(20, 2)'][-1])
+
+
+def full_computation(frame):
+    engine = IndicatorEngine()
+    return engine.compute(frame, [(name, {}) for name in INDICATORS])[1]
+
+
+def assert_same_columns(columns, expected):
+    assert columns.keys() == expected.keys()
+    for label in expected:
+        assert np.allclose(columns[label], expected[label], equal_nan=True), label
+
+
+def test_appended_bars_match_full_computation(frame):
+    engine = IndicatorEngine()
+    engine.compute(frame.iloc[:200], [(name, {}) for name in INDICATORS])
+
+    changed, columns = engine.compute(frame, [(name, {}) for name in INDICATORS])
+    assert changed == 100
+    assert_same_columns(columns, full_computation(frame))
+
+
+def test_revised_bars_match_full_computation(frame):
+    engine = IndicatorEngine()
+    engine.compute(frame, [(name, {}) for name in INDICATORS])
+
+    revised = frame.copy()
+    revised.iloc[-3:, revised.columns.get_loc('Close')] += 5
+    revised.iloc[-2, revised.columns.get_loc('Volume')] = np.nan
+    changed, columns = engine.compute(revised, [(name, {}) for name in INDICATORS])
+    assert changed == 3
+    assert_same_columns(columns, full_computation(revised))
+
+
+def test_sessions_with_different_ends_share_an_engine(frame):
+    # Same ticker, interval and first bar, so the same cached engine
+    ends = [len(frame) - offset for offset in range(8)] * 10
+
+    def compute(end):
+        return end, compute_indicators('AAA', '1d', frame.iloc[:end], [('SMA', {}), ('MACD', {})])
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for end, columns in executor.map(compute, ends):
+            assert len(columns) == end
+            expected = full_computation(frame.iloc[:end])
+            assert np.allclose(columns['SMA(20)'], expected['SMA(20)'], equal_nan=True)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the shared price panel, with a fake price store.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import panel
+
+
+class FakeStore:
+    """
+    Price store returning one bar per weekday of 2024, the Close being the
+    position of the ticker in the alphabet.
+    """
+
+    def __init__(self):
+        self.reads = []
+
+    def get_history(self, ticker, start=None, interval='1d'):
+        self.reads.append((ticker, interval))
+        days = pd.bdate_range('2024-01-01', '2025-01-01', inclusive='left')
+        price = float(ord(ticker[0]))
+        return pd.DataFrame({column: price for column in panel.OHLCV_COLUMNS}, index=days)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = FakeStore()
+    monkeypatch.setattr(panel, 'get_store', lambda: store)
+    monkeypatch.setattr(panel, 'CACHE_DIR', str(tmp_path))
+    for state in (panel._panels, panel._pending, panel._panel_used, panel._refresh_due):
+        state.clear()
+    yield store
+    wait_for_update()
+
+
+def wait_for_update(interval='1d'):
+    while panel._updates.is_running(interval):
+        time.sleep(0.01)
+
+
+def tickers(count, first='A'):
+    return [f"{chr(ord(first) + i // 26)}{chr(ord('A') + i % 26)}" for i in range(count)]
+
+
+def test_missing_tickers_are_merged_in_batches(store, monkeypatch):
+    monkeypatch.setattr(panel, 'PANEL_BATCH', 4)
+    panel.get_panel(['AA', 'AB'])
+    wait_for_update()
+    shared = panel.get_panel(['AA', 'AB'])
+    assert shared.tickers == ['AA', 'AB']
+
+    # Below the batch size the shared panel is not rewritten
+    added = panel.get_panel(['AC'])
+    wait_for_update()
+    assert added.tickers == ['AC'] and added.frame('Close')['AC'].eq(ord('A')).all()
+    assert panel.get_panel(['AA']) is shared
+    assert len(store.reads) == 3
+
+    panel.get_panel(['AD', 'AE', 'AF'])
+    wait_for_update()
+    merged = panel.get_panel(['AC', 'AF'])
+    assert sorted(merged.tickers) == tickers(6)
+    assert len(store.reads) == 6
+
+
+def test_stale_panel_is_refreshed_in_the_background(store):
+    panel.get_panel(['AA', 'BA'])
+    wait_for_update()
+    shared = panel.get_panel(['AA'])
+    reads = len(store.reads)
+
+    assert panel.get_panel(['AA'], ttl=0) is shared
+    wait_for_update()
+    refreshed = panel.get_panel(['AA'])
+    assert refreshed is not shared and refreshed.refreshed > shared.refreshed
+    assert len(store.reads) == reads + 2
+
+
+def test_intervals_have_their_own_panel(store):
+    panel.get_panel(['AA'], interval='1d')
+    wait_for_update('1d')
+    panel.get_panel(['BA'], interval='1wk')
+    wait_for_update('1wk')
+
+    assert panel.get_panel(['AA'], interval='1d').tickers == ['AA']
+    assert panel.get_panel(['BA'], interval='1wk').tickers == ['BA']
+    assert ('BA', '1wk') in store.reads and ('BA', '1d') not in store.reads
+
+
+def test_least_recently_requested_tickers_are_evicted(store, monkeypatch):
+    monkeypatch.setattr(panel, 'PANEL_MAX_TICKERS', 6)
+    monkeypatch.setattr(panel, 'PANEL_BATCH', 4)
+    for batch in (tickers(4), tickers(4, 'B'), tickers(4, 'C')):
+        panel.get_panel(batch)
+        wait_for_update()
+
+    shared = panel.get_panel([])
+    assert len(shared) == 6 and set(tickers(4, 'C')) <= set(shared.tickers)
+    assert np.isnan(shared.frame('Close').to_numpy()).sum() == 0
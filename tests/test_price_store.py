@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the delta fetch of the price store, with a fake fetcher.
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from price_store import PriceStore, has_sessions
+
+
+class FakeFetcher:
+    """
+    Fetcher returning one bar per weekday, or nothing while offline (as
+    yfinance does on network errors).
+    """
+
+    def __init__(self):
+        self.online = True
+        self.calls = []
+
+    def __call__(self, ticker, start, end, interval):
+        self.calls.append((start, end))
+        days = pd.bdate_range(start, min(end, pd.Timestamp.now()), inclusive='left') if self.online else []
+        prices = np.arange(len(days), dtype=float) + 100
+        return pd.DataFrame({'Open': prices, 'High': prices, 'Low': prices, 'Close': prices,
+                             'Volume': prices}, index=pd.DatetimeIndex(days))
+
+
+@pytest.fixture
+def fetcher():
+    return FakeFetcher()
+
+
+@pytest.fixture
+def store(tmp_path, fetcher):
+    return PriceStore(root=str(tmp_path), fetcher=fetcher)
+
+
+def test_delta_merge_fetches_only_missing_ranges(store, fetcher):
+    store.get_history('AAA', start='2024-03-01', end='2024-04-01')
+    history = store.get_history('AAA', start='2024-01-01', end='2024-05-01')
+
+    assert fetcher.calls[1:] == [(pd.Timestamp('2024-01-01'), pd.Timestamp('2024-03-01')),
+                                 (pd.Timestamp('2024-04-01'), pd.Timestamp('2024-05-01'))]
+    assert history.index.equals(pd.bdate_range('2024-01-01', '2024-05-01', inclusive='left'))
+    assert history.index.is_unique
+
+
+def test_warm_store_is_not_fetched_again(store, fetcher):
+    for _ in range(3):
+        store.get_history('AAA', period='1y')
+    assert len(fetcher.calls) == 1
+
+
+def test_stale_day_is_fetched_again(tmp_path, fetcher):
+    store = PriceStore(root=str(tmp_path), fetcher=fetcher, freshness=0)
+    store.get_history('AAA', period='1y')
+    store.get_history('AAA', period='1y')
+
+    assert len(fetcher.calls) == 2
+    assert fetcher.calls[1][0] == pd.Timestamp.now().normalize()
+
+
+def test_failed_fetch_is_not_covered(store, fetcher):
+    fetcher.online = False
+    assert store.get_history('AAA', start='2024-01-01', end='2024-02-01').empty
+
+    fetcher.online = True
+    history = store.get_history('AAA', start='2024-01-01', end='2024-02-01')
+    assert len(fetcher.calls) == 2
+    assert len(history) == len(pd.bdate_range('2024-01-01', '2024-02-01', inclusive='left'))
+
+
+def test_range_without_sessions_is_covered(store, fetcher):
+    # Saturday to Monday, Monday being New Year's Day
+    fetcher.online = False
+    store.get_history('AAA', start='2022-12-31', end='2023-01-03')
+    store.get_history('AAA', start='2022-12-31', end='2023-01-03')
+    assert len(fetcher.calls) == 1
+    assert not has_sessions('2022-12-31', '2023-01-03')
+    assert has_sessions('2022-12-31', '2023-01-04')
+
+
+def test_range_before_listing_is_covered(store, fetcher):
+    # Listed on 2024-02-01: the first covered sessions have no bars
+    def listed(ticker, start, end, interval):
+        bars = FakeFetcher.__call__(fetcher, ticker, start, end, interval)
+        return bars[bars.index >= '2024-02-01']
+
+    store.fetcher = listed
+    store.get_history('AAA', start='2024-01-01', end='2024-03-01')
+    store.get_history('AAA', start='2023-01-01', end='2024-03-01')
+    store.get_history('AAA', start='2023-01-01', end='2024-03-01')
+    assert len(fetcher.calls) == 2
+
+
+def test_unreadable_partition_is_fetched_again(store, fetcher):
+    store.get_history('AAA', start='2024-01-01', end='2024-02-01')
+    with open(store._path('AAA', '1d', 'parquet'), 'wb'):
+        pass
+
+    history = store.get_history('AAA', start='2024-01-01', end='2024-02-01')
+    assert len(fetcher.calls) == 2
+    assert len(history) == len(pd.bdate_range('2024-01-01', '2024-02-01', inclusive='left'))
+
+
+def test_stores_sharing_a_root_write_concurrently(tmp_path):
+    # One store per server process, the partition locks do not cover them
+    stores = [PriceStore(root=str(tmp_path), fetcher=FakeFetcher(), freshness=0) for _ in range(4)]
+
+    def load(store):
+        return [len(store.get_history('AAA', start='2024-01-01', end='2024-06-01')) for _ in range(20)]
+
+    with ThreadPoolExecutor(max_workers=len(stores)) as executor:
+        lengths = sum(executor.map(load, stores), [])
+    assert set(lengths) == {len(pd.bdate_range('2024-01-01', '2024-06-01', inclusive='left'))}
+    assert not [name for name in os.listdir(tmp_path / '1d') if name.endswith('.tmp')]
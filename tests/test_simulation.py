@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the portfolio simulation.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulation import simulate_portfolio
+
+
+@pytest.fixture
+def returns():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(rng.normal(0, 0.01, size=(250, 2)), columns=['AAA', 'BBB'])
+
+
+def test_portfolio_risk(returns):
+    simulation = simulate_portfolio(returns, [0.5, 0.5], 1000, 10, seed=1)
+    assert all(np.isfinite(measures['VaR']) and np.isfinite(measures['CVaR'])
+               for measures in simulation['risk'].values())
+
+
+@pytest.mark.parametrize('weights', [[0.5, np.nan], [0.5, np.inf], [0.5], [0.3, -0.3 + 1e-12]])
+def test_invalid_weights_are_rejected(returns, weights):
+    with pytest.raises(ValueError):
+        simulate_portfolio(returns, weights, 1000, 10, seed=1)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Ticker universes of the stock dashboard (S&P 500 constituents, ...).
+
+A universe is served from memory, then from an on-disk snapshot, then from a
+file bundled with the dashboard. Expired snapshots are refreshed in the
+background, so the page never waits for the source to be scraped.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import os
+import threading
+import time
+
+import pandas as pd
+
+from background import BackgroundRefresh, save_atomically
+from instrumentation import instrument
+from settings import CACHE_DIR
+
+
+# Columns of every universe
+UNIVERSE_COLUMNS = ['Symbol', 'Security', 'Sector', 'Industry']
+
+# Folder of the files bundled with the dashboard
+BUNDLED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+#==============================================================================
+# Universe sources
+#==============================================================================
+
+class WikipediaUniverse:
+    """
+    Universe scraped from a table of a Wikipedia page.
+    """
+
+    def __init__(self, url, columns, table=0):
+        self.url = url
+        self.columns = columns  # {Wikipedia column: universe column}
+        self.table = table
+
+    def load(self):
+        table = pd.read_html(self.url)[self.table]
+        table = table.rename(columns=self.columns).reindex(columns=UNIVERSE_COLUMNS)
+
+        # Yahoo Finance uses '-' for share classes (BRK.B -> BRK-B)
+        table['Symbol'] = table['Symbol'].str.replace('.', '-', regex=False)
+        return table
+
+
+# Available universes: {name: source}, a source has a load() method returning
+# a DataFrame with the UNIVERSE_COLUMNS
+UNIVERSES = {
+    'sp500': WikipediaUniverse('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies',
+                               {'GICS Sector': 'Sector',
+                                'GICS Sub-Industry': 'Industry'}),
+}
+
+
+def register_universe(name, source):
+    """
+    This function makes a new universe available to get_universe. A fallback
+    can be bundled as data/<name>.csv.
+    """
+    UNIVERSES[name] = source
+
+
+#==============================================================================
+# Universe provider
+#==============================================================================
+
+_memory = {}       # {name: (load time, universe)}
+_lock = threading.Lock()
+
+
+def _snapshot_path(name):
+    return os.path.join(CACHE_DIR, 'universe', f"{name}.csv")
+
+
+def _bundled_path(name):
+    return os.path.join(BUNDLED_DIR, f"{name}.csv")
+
+
+@instrument('universe.refresh')
+def refresh_universe(name):
+    """
+    This function loads a universe from its source and saves the snapshot.
+    """
+    universe = UNIVERSES[name].load()
+    save_atomically(_snapshot_path(name), lambda path: universe.to_csv(path, index=False))
+
+    with _lock:
+        _memory[name] = (time.time(), universe)
+    return universe
+
+
+def bundle_universe(name):
+    """
+    This function loads a universe from its source and saves it as the
+    bundled file, the fallback of a cold start without a snapshot.
+    """
+    universe = UNIVERSES[name].load()
+    universe.to_csv(_bundled_path(name), index=False)
+    return universe
+
+
+_refreshes = BackgroundRefresh(refresh_universe, 'universe')
+
+
+@instrument('universe.get_universe')
+def get_universe(name='sp500', ttl=24 * 3600):
+    """
+    This function returns a universe as a DataFrame with the columns Symbol,
+    Security, Sector and Industry.
+
+    The universe is read from memory, the on-disk snapshot or the bundled
+    file. When the data is older than ttl seconds it is still returned, and a
+    refresh from the source is started in the background.
+    """
+    with _lock:
+        cached = _memory.get(name)
+    if cached is not None:
+        if time.time() - cached[0] >= ttl:
+            _refreshes.start(name)
+        return cached[1]
+
+    # Read the snapshot, or the bundled file if there is no snapshot yet
+    snapshot_path = _snapshot_path(name)
+    if os.path.exists(snapshot_path):
+        loaded_at, universe = os.path.getmtime(snapshot_path), pd.read_csv(snapshot_path)
+    elif os.path.exists(_bundled_path(name)):
+        loaded_at, universe = 0.0, pd.read_csv(_bundled_path(name))
+    else:
+        # Nothing stored yet, the source has to be loaded now
+        return refresh_universe(name)
+
+    with _lock:
+        _memory[name] = (loaded_at, universe)
+
+    if time.time() - loaded_at >= ttl:
+        _refreshes.start(name)
+
+    return universe
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+Yahoo Finance quoteSummary client used by the stock dashboard.
+"""
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+
+# Libraries
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import requests
+import yfinance as yf
+from requests.adapters import HTTPAdapter
+
+from cache import TTLS, cached, get_cache
+from instrumentation import timed
+
+
+#==============================================================================
+# Yahoo session
+#==============================================================================
+
+class YahooSession:
+    """
+    Shared, thread-safe session to the Yahoo Finance API.
+
+    Connections are pooled and kept alive, the auth cookie and crumb are reused
+    until they expire or Yahoo answers 401, and concurrent requests for the
+    same data are collapsed into a single in-flight request. At most
+    max_per_host requests are sent to the same host at once.
+    """
+    user_agent_key = "User-Agent"
+    user_agent_value = ("Mozilla/5.0 (Windows NT 6.1; Win64; x64) "
+                        "AppleWebKit/537.36 (KHTML, like Gecko) "
+                        "Chrome/58.0.3029.110 Safari/537.36")
+
+    cookie_url = "https://fc.yahoo.com"
+    crumb_url = "https://query1.finance.yahoo.com/v1/test/getcrumb"
+    quote_summary_url = "https://query1.finance.yahoo.com/v10/finance/quoteSummary/{ticker}"
+
+    def __init__(self, auth_ttl=3600, pool_size=20, max_per_host=8, timeout=10):
+        self.auth_ttl = auth_ttl
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+
+        # Pooled keep-alive connections, the cookie jar keeps the auth cookie
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.headers[self.user_agent_key] = self.user_agent_value
+
+        self._crumb = None
+        self._crumb_time = 0.0
+        self._auth_lock = threading.Lock()
+
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+
+    def request(self, url, metric='yahoo.request', **kwargs):
+        """
+        This function sends a GET request, waiting for a free slot of the host.
+        Its time and size are recorded under the metric name.
+        """
+        host = urlsplit(url).netloc
+        with self._host_slots_lock:
+            slots = self._host_slots.setdefault(host, threading.BoundedSemaphore(self.max_per_host))
+
+        with slots, timed(metric) as measure:
+            response = self.session.get(url, allow_redirects=True, timeout=self.timeout, **kwargs)
+            measure['bytes'] = len(response.content)
+            return response
+
+    def get_crumb(self, stale_crumb=None):
+        """
+        This function returns the cached crumb, refreshing the cookie and the
+        crumb when they expired or when stale_crumb was rejected by Yahoo.
+        """
+        with self._auth_lock:
+            expired = time.monotonic() - self._crumb_time > self.auth_ttl
+            if self._crumb is not None and not expired and self._crumb != stale_crumb:
+                return self._crumb
+
+            response = self.request(self.cookie_url, metric='yahoo.cookie')
+            if not response.cookies:
+                raise Exception("Failed to obtain Yahoo auth cookie.")
+
+            crumb_response = self.request(self.crumb_url, metric='yahoo.crumb')
+            crumb = crumb_response.text
+            if not crumb or crumb_response.status_code != 200:
+                raise Exception("Failed to retrieve Yahoo crumb.")
+
+            self._crumb = crumb
+            self._crumb_time = time.monotonic()
+            return crumb
+
+    def get_json(self, url, params=None, metric='yahoo.request'):
+        """
+        This function sends an authenticated GET request and returns its JSON
+        content, refreshing the crumb once if Yahoo answers 401.
+        """
+        crumb = self.get_crumb()
+        response = self.request(url, metric, params={**(params or {}), 'crumb': crumb})
+
+        if response.status_code == 401:
+            crumb = self.get_crumb(stale_crumb=crumb)
+            response = self.request(url, metric, params={**(params or {}), 'crumb': crumb})
+
+        response.raise_for_status()
+        return response.json()
+
+    def single_flight(self, key, function, *args):
+        """
+        This function calls function(*args), unless a call with the same key is
+        already running, in which case its result is shared.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = function(*args)
+            future.set_result(result)
+            return result
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def quote_summary(self, ticker, modules):
+        """
+        This function returns the raw quoteSummary result of a ticker for the
+        given modules.
+        """
+        # Yahoo modules doc informations :
+        # https://cryptocointracker.com/yahoo-finance/yahoo-finance-api
+        modules = ",".join(modules)
+
+        def fetch():
+            data = self.get_json(self.quote_summary_url.format(ticker=ticker),
+                                 params={'modules': modules, 'ssl': 'true'},
+                                 metric='yahoo.quoteSummary')
+            return data['quoteSummary']['result'][0]
+
+        return self.single_flight(('quoteSummary', ticker, modules), fetch)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    This function returns the Yahoo session shared by the whole process.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = YahooSession()
+        return _session
+
+
+#==============================================================================
+# HOT FIX FOR YFINANCE .INFO METHOD
+# Ref: https://github.com/ranaroussi/yfinance/issues/1729
+#==============================================================================
+
+def flatten_quote_summary(summary):
+    """
+    This function flattens a quoteSummary result into {field: raw value}.
+    """
+    ret = {}
+
+    for mainKeys in summary.keys():
+        for key in summary[mainKeys].keys():
+            if isinstance(summary[mainKeys][key], dict):
+                try:
+                    ret[key] = summary[mainKeys][key]['raw']
+                except (KeyError, TypeError):
+                    pass
+            else:
+                ret[key] = summary[mainKeys][key]
+
+    return ret
+
+
+def _is_retryable(error):
+    # Network failures, rate limiting and server errors are worth a retry
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+#==============================================================================
+# Fundamentals
+#==============================================================================
+
+# Time to live (seconds) of each quoteSummary module
+MODULE_TTL = {'assetProfile'        : TTLS['profile'],
+              'summaryDetail'       : TTLS['quote'],
+              'financialData'       : TTLS['fundamentals'],
+              'indexTrend'          : TTLS['trend'],
+              'defaultKeyStatistics': TTLS['fundamentals']}
+
+# Module holding each field used by the dashboard
+FIELD_MODULES = {
+    # assetProfile
+    'address1': 'assetProfile', 'address2': 'assetProfile', 'city': 'assetProfile',
+    'state': 'assetProfile', 'zip': 'assetProfile', 'country': 'assetProfile',
+    'phone': 'assetProfile', 'website': 'assetProfile', 'industry': 'assetProfile',
+    'sector': 'assetProfile', 'fullTimeEmployees': 'assetProfile',
+    'longBusinessSummary': 'assetProfile', 'companyOfficers': 'assetProfile',
+    # summaryDetail
+    'previousClose': 'summaryDetail', 'open': 'summaryDetail', 'bid': 'summaryDetail',
+    'ask': 'summaryDetail', 'dayLow': 'summaryDetail', 'dayHigh': 'summaryDetail',
+    'fiftyTwoWeekLow': 'summaryDetail', 'fiftyTwoWeekHigh': 'summaryDetail',
+    'volume': 'summaryDetail', 'averageVolume': 'summaryDetail',
+    'marketCap': 'summaryDetail', 'beta': 'summaryDetail', 'trailingPE': 'summaryDetail',
+    'forwardPE': 'summaryDetail', 'dividendRate': 'summaryDetail',
+    'dividendYield': 'summaryDetail',
+    # financialData
+    'currentPrice': 'financialData', 'targetMeanPrice': 'financialData',
+    'recommendationKey': 'financialData', 'totalRevenue': 'financialData',
+    'profitMargins': 'financialData', 'returnOnEquity': 'financialData',
+    # defaultKeyStatistics
+    'trailingEps': 'defaultKeyStatistics', 'forwardEps': 'defaultKeyStatistics',
+    'priceToBook': 'defaultKeyStatistics', 'sharesOutstanding': 'defaultKeyStatistics',
+    'enterpriseValue': 'defaultKeyStatistics',
+}
+
+# Fields holding text, the other fields are numbers (companyOfficers is a list)
+TEXT_FIELDS = {'address1', 'address2', 'city', 'state', 'zip', 'country', 'phone',
+               'website', 'industry', 'sector', 'longBusinessSummary', 'recommendationKey'}
+
+
+def _field_type(field):
+    if field in TEXT_FIELDS:
+        return (str,)
+    if field == 'companyOfficers':
+        return (list,)
+    return (int, float)
+
+
+class FundamentalsRecord(dict):
+    """
+    Flat {field: value} fundamentals of a ticker.
+
+    The fields of FIELD_MODULES are typed: text fields are strings, the other
+    ones are numbers. A value of another type (Yahoo sends 'Infinity' or an
+    empty dict for some ratios) is left out, as a missing field would be.
+    Fields of other modules are kept as they come.
+    """
+
+    def __init__(self, ticker, fields=None):
+        super().__init__()
+        self.ticker = ticker
+        for field, value in (fields or {}).items():
+            if field not in FIELD_MODULES or (isinstance(value, _field_type(field))
+                                              and not isinstance(value, bool)):
+                self[field] = value
+
+
+class Fundamentals:
+    """
+    Fundamentals of a ticker, fetched lazily one quoteSummary module at a time.
+
+    Each module is kept separately in the shared cache with its own time to
+    live (MODULE_TTL), so asking for a couple of fields only fetches the
+    modules holding them, and only when they are missing or expired.
+    """
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+
+    @staticmethod
+    def modules_for(fields):
+        """
+        This function returns the modules holding the given fields.
+        """
+        unknown = [field for field in fields if field not in FIELD_MODULES]
+        if unknown:
+            raise KeyError(f"Unknown fields {unknown}, pass their modules instead.")
+        return tuple(dict.fromkeys(FIELD_MODULES[field] for field in fields))
+
+    def get_modules(self, modules):
+        """
+        This function returns {module: flat module}, fetching the missing or
+        expired modules in a single request.
+        """
+        cache = get_cache()
+        with timed('fundamentals.get_modules') as measure:
+            ret = {}
+            for module in modules:
+                found, flat = cache.get(('fundamentals', self.ticker, module))
+                if found:
+                    ret[module] = flat
+
+            missing = tuple(module for module in modules if module not in ret)
+            measure['cache'] = 'miss' if missing else 'hit'
+            if missing:
+                summary = get_session().quote_summary(self.ticker, missing)
+                for module in missing:
+                    ret[module] = flatten_quote_summary({module: summary.get(module) or {}})
+                    cache.set(('fundamentals', self.ticker, module), ret[module],
+                              ttl=MODULE_TTL.get(module, TTLS['fundamentals']))
+
+            return ret
+
+    def get(self, fields=None, modules=None):
+        """
+        This function returns a FundamentalsRecord.
+
+        Only the modules holding the requested fields (or the requested
+        modules) are fetched. Fields missing from Yahoo's answer are left out
+        of the record.
+        """
+        if modules is None:
+            modules = self.modules_for(fields) if fields is not None else tuple(MODULE_TTL)
+
+        record = {}
+        for flat in self.get_modules(modules).values():
+            record.update(flat)
+
+        if fields is not None:
+            record = {field: record[field] for field in fields if field in record}
+        return FundamentalsRecord(self.ticker, record)
+
+
+class YFinance:
+    yahoo_modules = ("assetProfile",  # longBusinessSummary
+                     "summaryDetail",
+                     "financialData",
+                     "indexTrend",
+                     "defaultKeyStatistics")
+
+    def __init__(self, ticker):
+        self.yahoo_ticker = ticker
+
+    def __str__(self):
+        return self.yahoo_ticker
+
+    @property
+    def info(self):
+        return Fundamentals(self.yahoo_ticker).get(modules=self.yahoo_modules)
+
+    @classmethod
+    def info_many(cls, tickers, modules=None, max_workers=16, retries=3, backoff=0.5):
+        """
+        This function gets the information of many tickers concurrently.
+
+        Requests go through a bounded thread pool (and the per-host limit of
+        the shared session); failed requests are retried with a jittered
+        exponential backoff.
+
+        Returns
+        -------
+        tuple
+            ({ticker: info}, {ticker: exception}) for the tickers that
+            succeeded and the ones that failed.
+        """
+        modules = tuple(modules or cls.yahoo_modules)
+
+        def fetch(ticker):
+            for attempt in range(retries + 1):
+                try:
+                    return Fundamentals(ticker).get(modules=modules)
+                except Exception as error:
+                    if attempt == retries or not _is_retryable(error):
+                        raise
+                    time.sleep(random.uniform(0, backoff * 2 ** attempt))
+
+        infos = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(fetch, ticker): ticker for ticker in dict.fromkeys(tickers)}
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    infos[ticker] = future.result()
+                except Exception as error:
+                    errors[ticker] = error
+
+        return infos, errors
+
+
+#==============================================================================
+# Holders
+#==============================================================================
+
+@cached('holders')
+def get_major_holders(ticker):
+    """
+    This function returns the major holders breakdown of a ticker.
+    """
+    return yf.Ticker(ticker).get_major_holders()